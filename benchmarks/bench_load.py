@@ -0,0 +1,216 @@
+"""
+Навантажувальний бенчмарк: скільки кас витримує один процес бота.
+
+Fake Checkbox API і fake Telegram Bot API запускаються в окремих процесах
+(щоб CPU і пам'ять бота вимірювались окремо), а в поточному процесі
+справжні планувальник, handle_shift_and_receipts і черга відправки
+опитують N кас протягом --duration секунд. Стан, журнал чеків і PDF кеш
+пишуться в тимчасовий каталог.
+
+Звіт: опитування та запити до API за секунду, доставлені сповіщення за
+секунду, p50/p99 затримки сповіщення (від створення чеку до отримання
+документа в Telegram), CPU та RSS процесу бота.
+
+Запуск з кореня репозиторію:
+    python -m benchmarks.bench_load --kasas 500 --rate 6 --duration 60
+    python -m benchmarks.bench_load --kasas 200 --latency 150 --error-rate 0.02 --flood-rate 0.01
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import resource
+import socket
+import tempfile
+import time
+
+import aiohttp
+
+from benchmarks import fake_checkbox, fake_telegram
+
+BOT_TOKEN = '123456:bench'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+async def wait_port(port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.05)
+
+
+async def fetch_json(url):
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url) as resp:
+            return await resp.json()
+
+
+def rss_mb():
+    with open('/proc/self/statm') as f:
+        pages = int(f.read().split()[1])
+    return pages * os.sysconf('SC_PAGE_SIZE') / 1048576
+
+
+def configure(args, tmp, api_port):
+    """Налаштування треба змінити до імпорту модулів бота: вони читають їх при імпорті."""
+    import config.settings as settings
+    settings.BASE_URL = f'http://127.0.0.1:{api_port}/api/v1'
+    settings.KASAS_FILE = os.path.join(tmp, 'kasas.json')
+    settings.KASAS_DB_FILE = os.path.join(tmp, 'kasas.db')
+    settings.LEDGER_DB_FILE = os.path.join(tmp, 'ledger.db')
+    settings.PDF_CACHE_DIR = os.path.join(tmp, 'pdf_cache')
+    settings.POLL_WORKERS = args.workers
+    # Без нічного режиму: перше опитування закритої зміни - в межах кількох секунд
+    settings.POLL_NIGHT_HOURS = (0, 0)
+    settings.TELEGRAM_GLOBAL_RATE = args.tg_global_rate
+    settings.CHECKBOX_GLOBAL_RATE = args.api_rate
+    settings.TELEGRAM_CHAT_RATE = args.tg_chat_rate
+    settings.TELEGRAM_CHAT_BURST = max(1, int(args.tg_chat_rate * 3))
+    if args.interval:
+        settings.ADAPTIVE_POLLING = False
+        settings.POLL_INTERVAL_OPEN = args.interval
+
+
+async def run(args, api_port, tg_port):
+    from aiogram import Bot, Dispatcher
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from services.checkbox_api import CheckboxClient, set_client
+    from utils.storage import open_storage
+    import handlers.start as start
+
+    open_storage()
+
+    client = CheckboxClient()
+    set_client(client)
+    session = AiohttpSession(api=TelegramAPIServer.from_base(f'http://127.0.0.1:{tg_port}'))
+    bot = Bot(BOT_TOKEN, session=session)
+    start.register_start_handlers(Dispatcher(), bot)
+
+    for i in range(args.kasas):
+        user_id = str(1000 + i // args.kasas_per_user)
+        start.kasas_data.setdefault(user_id, []).append({
+            'license_key': f'bench-{i:06d}',
+            'pin_code': '0000',
+            'kasa_name': f'Каса {i}',
+            'shift_id': None,
+            'last_receipt_datetime': None,
+            'last_receipt_id': None,
+            'receipt_counter': 0
+        })
+
+    cpu0 = resource.getrusage(resource.RUSAGE_SELF)
+    t0 = time.perf_counter()
+    for user_id in list(start.kasas_data):
+        await start.start_background_polling(user_id)
+    await asyncio.sleep(args.duration)
+    sched = start.scheduler.stats()
+    queue = start.delivery.stats()
+    elapsed = time.perf_counter() - t0
+    cpu1 = resource.getrusage(resource.RUSAGE_SELF)
+    rss_now = rss_mb()
+
+    await start.stop_background_polling()
+    await client.close()
+    await session.close()
+
+    api = await fetch_json(f'http://127.0.0.1:{api_port}/_stats')
+    tg = await fetch_json(f'http://127.0.0.1:{tg_port}/_stats')
+    cpu = (cpu1.ru_utime - cpu0.ru_utime) + (cpu1.ru_stime - cpu0.ru_stime)
+    api_total = sum(v for k, v in api['requests'].items() if k != 'stats')
+    return {
+        'elapsed': elapsed,
+        'polls': sched['polls_done'],
+        'lag_avg': sched['lag_avg'],
+        'lag_max': sched['lag_max'],
+        'api': api,
+        'api_total': api_total,
+        'tg': tg,
+        'queue_depth': queue['depth'],
+        'cpu': cpu,
+        'rss_now': rss_now,
+        'rss_max': cpu1.ru_maxrss / 1024
+    }
+
+
+def fmt_ms(value):
+    return f"{value * 1000:.0f}ms" if value is not None else 'n/a'
+
+
+def report(args, res):
+    el = res['elapsed']
+    tg = res['tg']
+    print(f"kasas={args.kasas} duration={el:.1f}s rate={args.rate}/min/kasa "
+          f"api_latency={args.latency}ms error_rate={args.error_rate}")
+    print(f"polls:          {res['polls']} ({res['polls'] / el:.1f}/s), "
+          f"lag avg={res['lag_avg']:.2f}s max={res['lag_max']:.2f}s")
+    print(f"api requests:   {res['api_total']} ({res['api_total'] / el:.1f}/s), "
+          f"injected errors={res['api']['errors']}")
+    print("  by endpoint:  " + ', '.join(f"{k}={v}" for k, v in sorted(res['api']['requests'].items())
+                                         if k != 'stats'))
+    print(f"receipts:       created={res['api']['receipts']} notified={tg['receipts']} "
+          f"({tg['receipts'] / el:.1f}/s), queue left={res['queue_depth']}, flood 429={tg['flood']}")
+    print(f"notify latency: p50={fmt_ms(tg['latency_p50'])} p99={fmt_ms(tg['latency_p99'])} "
+          f"max={fmt_ms(tg['latency_max'])}")
+    print(f"cpu:            {res['cpu']:.2f}s ({res['cpu'] / el * 100:.1f}% of one core)")
+    print(f"telegram:       {tg['calls']}")
+    print(f"rss:            now={res['rss_now']:.1f}MB max={res['rss_max']:.1f}MB")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--kasas', type=int, default=100)
+    ap.add_argument('--kasas-per-user', type=int, default=3)
+    ap.add_argument('--duration', type=float, default=30.0, help='тривалість, с')
+    ap.add_argument('--workers', type=int, default=20, help='POLL_WORKERS')
+    ap.add_argument('--interval', type=float, default=0, help='фіксований інтервал опитування (вимикає адаптивний)')
+    ap.add_argument('--tg-global-rate', type=float, default=30.0)
+    ap.add_argument('--api-rate', type=float, default=0.0,
+                    help='межа запитів бота до Checkbox API за секунду (0 - без межі)')
+    ap.add_argument('--tg-chat-rate', type=float, default=1.0)
+    ap.add_argument('--log-level', default='WARNING')
+    fake_checkbox.add_arguments(ap)
+    fake_telegram.add_arguments(ap)
+    args = ap.parse_args()
+
+    logging.basicConfig(level=args.log_level, format='%(asctime)s %(levelname)s %(name)s %(message)s')
+    ctx = multiprocessing.get_context('spawn')
+    api_port, tg_port = free_port(), free_port()
+    servers = [
+        ctx.Process(target=fake_checkbox.serve, args=(api_port,),
+                    kwargs=fake_checkbox.options_from_args(args), daemon=True),
+        ctx.Process(target=fake_telegram.serve, args=(tg_port,),
+                    kwargs=fake_telegram.options_from_args(args), daemon=True)
+    ]
+    for p in servers:
+        p.start()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            configure(args, tmp, api_port)
+
+            async def go():
+                await wait_port(api_port)
+                await wait_port(tg_port)
+                return await run(args, api_port, tg_port)
+
+            report(args, asyncio.run(go()))
+    finally:
+        for p in servers:
+            p.terminate()
+            p.join()
+
+
+if __name__ == '__main__':
+    main()
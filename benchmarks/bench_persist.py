@@ -0,0 +1,115 @@
+"""
+Бенчмарк блокування event loop при збереженні стану кас.
+
+Порівнює старий підхід (синхронний save_kasas_data 3 рази за цикл
+опитування) із відкладеним записом StatePersister для JSON та SQLite.
+Затримка loop вимірюється задачею-монітором, що прокидається кожну 1 мс.
+
+Запуск з кореня репозиторію:
+    python -m benchmarks.bench_persist --kasas 300 --rounds 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import utils.storage as storage
+from utils.persister import StatePersister
+
+
+def make_data(n):
+    data = {}
+    for i in range(n):
+        user_id = str(100000 + i // 3)
+        data.setdefault(user_id, []).append({
+            'license_key': f'lic{i:06d}',
+            'pin_code': '0000',
+            'kasa_name': f'Каса №{i}',
+            'shift_id': f'shift-{i}',
+            'last_receipt_datetime': datetime.now(timezone.utc),
+            'last_receipt_id': f'r{i}'
+        })
+    return data
+
+
+def legacy_save(data):
+    # Поведінка до змін: повний перезапис файлу з indent=2 на кожен виклик
+    sanitized = storage.snapshot_kasas_data(data)
+    with open(storage.KASAS_FILE, 'w') as f:
+        json.dump(sanitized, f, indent=2)
+
+
+async def monitor(stalls, stop):
+    interval = 0.001
+    while not stop.is_set():
+        t = time.perf_counter()
+        await asyncio.sleep(interval)
+        stalls.append(max(0.0, time.perf_counter() - t - interval))
+
+
+async def run(mode, n, rounds):
+    data = make_data(n)
+    kasas = [k for ks in data.values() for k in ks]
+    persister = StatePersister(data, interval=1.0) if mode != 'sync-json' else None
+
+    def save():
+        if persister is None:
+            legacy_save(data)
+        else:
+            persister.mark_dirty()
+
+    async def poll(kasa, r):
+        await asyncio.sleep(0)
+        kasa['last_receipt_id'] = f'r{r}'
+        save()  # handle_shift_and_receipts
+        save()  # fetch_new_receipts
+        await asyncio.sleep(0)
+        save()  # наприкінці циклу
+
+    stalls = []
+    stop = asyncio.Event()
+    mon = asyncio.create_task(monitor(stalls, stop))
+    started = time.perf_counter()
+    for r in range(rounds):
+        await asyncio.gather(*(poll(k, r) for k in kasas))
+        await asyncio.sleep(0.05)
+    if persister is not None:
+        await persister.stop()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await mon
+    stalls.sort()
+    return {
+        'mode': mode,
+        'elapsed_s': elapsed,
+        'stall_max_ms': stalls[-1] * 1000,
+        'stall_p99_ms': stalls[int(len(stalls) * 0.99) - 1] * 1000,
+        'stall_mean_ms': statistics.fmean(stalls) * 1000,
+        'writes': persister.flush_count if persister else rounds * len(kasas) * 3
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--kasas', type=int, default=300)
+    ap.add_argument('--rounds', type=int, default=20)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.KASAS_FILE = os.path.join(tmp, 'kasas.json')
+        storage.KASAS_DB_FILE = os.path.join(tmp, 'kasas.db')
+        for mode in ('sync-json', 'persister-json', 'persister-sqlite'):
+            storage.STORAGE_BACKEND = 'sqlite' if mode.endswith('sqlite') else 'json'
+            storage._store = storage.SqliteKasaStore(storage.KASAS_DB_FILE) if mode.endswith('sqlite') else None
+            res = asyncio.run(run(mode, args.kasas, args.rounds))
+            print(f"{res['mode']:<17} elapsed={res['elapsed_s']:.2f}s writes={res['writes']:<6} "
+                  f"stall max={res['stall_max_ms']:.1f}ms p99={res['stall_p99_ms']:.1f}ms "
+                  f"mean={res['stall_mean_ms']:.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""
+Мікробенчмарк гарячого шляху синхронізації чеків на одній великій зміні.
+
+Порівнює колишню обробку сирих словників (dateutil.isoparse у ключі
+сортування і знову у фільтрі, pytz.timezone на кожне форматування) з
+utils.receipt.Receipt: розбір сторінки один раз, далі - цілі числа.
+
+Етапи: декодування сторінок, сортування та фільтр за курсором, підсумки
+зміни, форматування сповіщень, а також пам'ять на один чек.
+
+    python -m benchmarks.bench_receipts --receipts 5000
+"""
+import argparse
+import json
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+import dateutil.parser
+import pytz
+
+from utils.format_helpers import format_receipt_info
+from utils.receipt import decode_receipts, datetime_to_us
+from utils.shift_totals import totals_from_receipts
+
+
+def make_shift(n, seed=3):
+    rng = random.Random(seed)
+    opened = datetime(2024, 3, 1, 6, 0, tzinfo=timezone.utc)
+    receipts = []
+    for i in range(n):
+        created = opened + timedelta(seconds=i * 7, microseconds=rng.randrange(1_000_000))
+        r_type = 'RETURN' if i % 25 == 24 else ('SERVICE_IN' if i % 200 == 199 else 'SELL')
+        total = rng.randrange(500, 500_000)
+        if r_type == 'SERVICE_IN':
+            payments = []
+        elif i % 4 == 0:
+            cash = rng.randrange(0, total)
+            payments = [{'type': 'CASH', 'value': cash, 'label': 'Готівка'},
+                        {'type': 'CARD', 'value': total - cash, 'label': 'Картка'}]
+        else:
+            payments = [{'type': rng.choice(('CASH', 'CASHLESS')), 'value': total, 'label': 'Оплата'}]
+        receipts.append({
+            'id': f"{i:08d}-0000-4000-8000-{rng.getrandbits(48):012x}",
+            'serial': i + 1,
+            'type': r_type,
+            'total_sum': total,
+            'service_in': total if r_type == 'SERVICE_IN' else 0,
+            'service_out': 0,
+            'created_at': created.isoformat(),
+            'modified_at': (created + timedelta(seconds=1)).isoformat(),
+            'payments': payments
+        })
+    return receipts
+
+
+def legacy_sync(raw, last_dt):
+    def best_time(r):
+        return r.get('modified_at') or r.get('created_at')
+    raw = sorted(raw, key=lambda x: (best_time(x), x.get('id')))
+    new = []
+    for r in raw:
+        t_parsed = dateutil.parser.isoparse(best_time(r))
+        if t_parsed > last_dt and str(r.get('service_out', '0')).strip() == '0':
+            new.append(r)
+    return new
+
+
+def legacy_totals(raw):
+    """Колишні utils.shift_totals.apply_receipt/allocate_payments над словниками."""
+    totals = {'count': 0, 'sales': 0, 'returns': 0, 'cash': 0, 'card': 0, 'service_in': 0}
+    for r in raw:
+        r_type = str(r.get('type', '')).upper()
+        total = int(r.get('total_sum') or 0)
+        if r_type == 'SERVICE_IN':
+            totals['service_in'] += total or int(r.get('service_in') or 0)
+            continue
+        payments = r.get('payments') or []
+        values = [int(p.get('value') or 0) for p in payments]
+        sum_payments = sum(values)
+        cash = card = 0
+        if sum_payments:
+            shares = [total * v // sum_payments for v in values]
+            rest = total - sum(shares)
+            order = sorted(range(len(values)), key=lambda i: (total * values[i]) % sum_payments, reverse=True)
+            for i in order[:rest]:
+                shares[i] += 1
+            for p, share in zip(payments, shares):
+                pay_type = str(p.get('type', '')).upper()
+                if pay_type == 'CASH':
+                    cash += share
+                elif pay_type in ('CARD', 'CASHLESS'):
+                    card += share
+        sign = -1 if r_type == 'RETURN' else 1
+        totals['count'] += 1
+        totals['returns' if sign < 0 else 'sales'] += total
+        totals['cash'] += sign * cash
+        totals['card'] += sign * card
+    return totals
+
+
+def legacy_format(r):
+    d_utc = dateutil.parser.isoparse(r['created_at'])
+    d_local = d_utc.astimezone(pytz.timezone("Europe/Kiev"))
+    return f"Чек {r.get('serial')}: {r.get('total_sum', 0) / 100:.2f} грн, {d_local.strftime('%d.%m.%Y %H:%M:%S')}"
+
+
+def timed(fn, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def memory_per_item(build, n):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    items = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del items
+    return (after - before) / n
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--receipts', type=int, default=5000)
+    ap.add_argument('--repeat', type=int, default=5)
+    args = ap.parse_args()
+
+    raw = make_shift(args.receipts)
+    # Курсор посередині зміни: половина чеків "нові"
+    last_dt = dateutil.parser.isoparse(raw[len(raw) // 2]['modified_at'])
+    last_us = datetime_to_us(last_dt)
+
+    decode_t, receipts = timed(lambda: decode_receipts(raw), args.repeat)
+
+    def typed_sync():
+        rs = sorted(receipts, key=lambda r: (r.best_us, r.id))
+        return [r for r in rs if r.best_us > last_us and r.service_out == 0]
+
+    rows = [
+        ('sort + cursor filter', timed(lambda: legacy_sync(raw, last_dt), args.repeat),
+         timed(typed_sync, args.repeat)),
+        ('shift totals', timed(lambda: legacy_totals(raw), args.repeat),
+         timed(lambda: totals_from_receipts(receipts), args.repeat)),
+        ('format notifications', timed(lambda: [legacy_format(r) for r in raw], args.repeat),
+         timed(lambda: [format_receipt_info(r, 'Каса') for r in receipts], args.repeat)),
+    ]
+    assert len(rows[0][1][1]) == len(rows[0][2][1])
+
+    n = args.receipts
+    print(f"shift: {n} receipts, python {sys.version.split()[0]}")
+    print(f"decode page -> Receipt (once per page): {decode_t * 1000:8.1f} ms ({decode_t / n * 1e6:.1f} us/receipt)")
+    print(f"{'stage':<24}{'raw dicts':>12}{'Receipt':>12}{'speedup':>10}")
+    for name, (old_t, _), (new_t, _) in rows:
+        print(f"{name:<24}{old_t * 1000:>10.1f}ms{new_t * 1000:>10.1f}ms{old_t / new_t:>9.1f}x")
+    old_total = sum(r[1][0] for r in rows)
+    new_total = sum(r[2][0] for r in rows) + decode_t
+    print(f"{'total (incl. decode)':<24}{old_total * 1000:>10.1f}ms{new_total * 1000:>10.1f}ms{old_total / new_total:>9.1f}x")
+
+    payload = json.dumps({'results': raw})
+    dict_mem = memory_per_item(lambda: json.loads(payload)['results'], n)
+    rec_mem = memory_per_item(lambda: decode_receipts(json.loads(payload)['results']), n)
+    print(f"memory per receipt: raw dict {dict_mem:.0f} B, Receipt {rec_mem:.0f} B (after the page is dropped)")
+
+
+if __name__ == '__main__':
+    main()
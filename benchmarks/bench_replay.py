@@ -0,0 +1,177 @@
+"""
+Офлайн-відтворення записаного трафіку Checkbox API (див. API_RECORD_FILE).
+
+Каси з запису (за псевдонімами) проганяються через справжні
+handle_shift_and_receipts, журнал чеків, підсумки зміни та чергу відправки;
+API відповідає ReplayTransport без мережі й затримок, Telegram - заглушка
+в пам'яті без обмеження швидкості.
+
+Звіт: час, цикли та запити за секунду. Для регресійної перевірки
+зберігається дайджест результату (повідомлення та підсумки по касах):
+    python -m benchmarks.bench_replay data/api_trace.jsonl.gz --save-digest base.json
+    python -m benchmarks.bench_replay data/api_trace.jsonl.gz --compare base.json
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+
+class MemoryBot:
+    """Заглушка aiogram.Bot: запам'ятовує надіслані повідомлення."""
+
+    class _Document:
+        def __init__(self, file_id):
+            self.file_id = file_id
+
+    class _Message:
+        def __init__(self, document=None):
+            self.document = document
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((str(chat_id), 'message', text))
+        return self._Message()
+
+    async def send_document(self, chat_id, document, caption=None, **kwargs):
+        self.sent.append((str(chat_id), 'document', caption))
+        return self._Message(self._Document(f"file-{len(self.sent)}"))
+
+
+def configure(tmp):
+    """Налаштування змінюються до імпорту модулів бота: вони читають їх при імпорті."""
+    import config.settings as settings
+    settings.KASAS_FILE = os.path.join(tmp, 'kasas.json')
+    settings.KASAS_DB_FILE = os.path.join(tmp, 'kasas.db')
+    settings.LEDGER_DB_FILE = os.path.join(tmp, 'ledger.db')
+    settings.PDF_CACHE_DIR = os.path.join(tmp, 'pdf_cache')
+    settings.TELEGRAM_GLOBAL_RATE = 1e9
+    settings.TELEGRAM_CHAT_RATE = 1e9
+    settings.TELEGRAM_CHAT_BURST = 1e9
+    settings.CHECKBOX_GLOBAL_RATE = 0
+    settings.CHECKBOX_LICENSE_RATE = 0
+
+
+def digest(bot, kasas):
+    per_chat = {}
+    for chat_id, kind, text in bot.sent:
+        d = per_chat.setdefault(chat_id, {'messages': Counter(), 'hash': hashlib.sha256()})
+        d['messages'][kind] += 1
+        d['hash'].update(f"{kind}\0{text}\0".encode('utf-8'))
+    return {
+        'chats': {
+            chat_id: {'messages': dict(d['messages']), 'sha256': d['hash'].hexdigest()}
+            for chat_id, d in sorted(per_chat.items())
+        },
+        'kasas': {
+            k['license_key']: {
+                'receipt_counter': k.get('receipt_counter', 0),
+                'last_receipt_id': k.get('last_receipt_id'),
+                'shift_totals': k.get('shift_totals')
+            }
+            for k in kasas
+        }
+    }
+
+
+async def run(trace, cycles):
+    from services.api_trace import ReplayTransport
+    from services.checkbox_api import CheckboxClient, set_client
+    from services.delivery import DeliveryQueue
+    from utils.storage import open_storage
+    import handlers.start as start
+
+    open_storage()
+
+    transport = ReplayTransport(trace)
+    client = CheckboxClient(transport=transport)
+    set_client(client)
+    bot = MemoryBot()
+    start.delivery = DeliveryQueue(bot, start.pdf_cache)
+
+    kasas = []
+    for alias in transport.kasas:
+        # Один користувач на касу: повідомлення кожної каси йдуть в окремий чат
+        kasa = {
+            'license_key': alias,
+            'pin_code': '0000',
+            'kasa_name': alias,
+            'shift_id': None,
+            'last_receipt_datetime': None,
+            'last_receipt_id': None,
+            'receipt_counter': 0
+        }
+        start.kasas_data[alias] = [kasa]
+        kasas.append(kasa)
+    if cycles is None:
+        # Кожен цикл опитування починається з одного GET /shifts
+        per_kasa = Counter(e['k'] for e in trace if e['m'] == 'GET' and e['p'] == '/shifts')
+        cycles = max(per_kasa.values(), default=1)
+
+    started = time.perf_counter()
+    for _ in range(cycles):
+        await asyncio.gather(*(start.handle_shift_and_receipts(k['license_key'], k) for k in kasas))
+    await start.delivery.stop(drain_timeout=60)
+    elapsed = time.perf_counter() - started
+    result = {
+        'kasas': len(kasas),
+        'cycles': cycles,
+        'elapsed': elapsed,
+        'replay': transport.stats(),
+        'sent': len(bot.sent),
+        'digest': digest(bot, kasas)
+    }
+    await start.stop_background_polling()
+    await client.close()
+    return result
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('trace', help='файл запису (gzip JSON lines)')
+    ap.add_argument('--cycles', type=int, default=None, help='циклів опитування на касу (за замовчуванням - як у записі)')
+    ap.add_argument('--save-digest', help='зберегти дайджест результату в JSON')
+    ap.add_argument('--compare', help='порівняти з раніше збереженим дайджестом')
+    ap.add_argument('--log-level', default='WARNING')
+    args = ap.parse_args()
+    logging.basicConfig(level=args.log_level, format='%(asctime)s %(levelname)s %(name)s %(message)s')
+
+    from services.api_trace import load_trace
+    trace = load_trace(args.trace)
+    with tempfile.TemporaryDirectory() as tmp:
+        configure(tmp)
+        res = asyncio.run(run(trace, args.cycles))
+
+    calls = res['replay']['hits'] + res['replay']['fallbacks'] + res['replay']['misses']
+    el = res['elapsed']
+    print(f"trace: {len(trace)} calls, {res['kasas']} kasas, {res['cycles']} cycles")
+    print(f"elapsed: {el:.3f}s, {res['kasas'] * res['cycles'] / el:.0f} kasa-cycles/s, {calls / el:.0f} api calls/s")
+    print(f"replay: {res['replay']}, telegram messages: {res['sent']}")
+
+    if args.save_digest:
+        with open(args.save_digest, 'w') as f:
+            json.dump(res['digest'], f, indent=2, ensure_ascii=False, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            expected = json.load(f)
+        actual = json.loads(json.dumps(res['digest'], sort_keys=True))
+        if actual != expected:
+            print("DIGEST MISMATCH")
+            for section in ('chats', 'kasas'):
+                for key in sorted(set(expected.get(section, {})) | set(actual.get(section, {}))):
+                    if expected.get(section, {}).get(key) != actual.get(section, {}).get(key):
+                        print(f"  {section}/{key}: expected {expected[section].get(key)}, got {actual[section].get(key)}")
+            sys.exit(1)
+        print("digest matches")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Мікробенчмарк агрегації /report (services.reports): стовпці чеків за період
+групуються за днем, годиною та касою - NumPy (bincount) проти проходу
+Python по тих самих стовпцях (запасний шлях без NumPy) і проти колишнього
+підходу - utils.shift_totals над кожним Receipt з перетворенням часу через pytz.
+
+    python -m benchmarks.bench_report --kasas 20 --days 31 --per-day 300
+"""
+import argparse
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+import services.reports as reports
+from utils.receipt import Payment, Receipt, ReceiptType, local_time_str
+from utils.shift_totals import apply_receipt, empty_totals
+
+
+def make_receipts(kasas, days, per_day, first, seed=7):
+    rng = random.Random(seed)
+    start_us = reports.local_midnight_us(first)
+    result = []
+    for k in range(kasas):
+        receipts = []
+        for i in range(days * per_day):
+            created = start_us + rng.randrange(days * reports.DAY_US)
+            r_type = ReceiptType.RETURN if i % 25 == 24 else ReceiptType.SELL
+            total = rng.randrange(500, 500_000)
+            pay_type = rng.choice(('CASH', 'CARD', 'CASHLESS'))
+            receipts.append(Receipt(f"{k}-{i}", i + 1, r_type, total, created_us=created,
+                                    payments=(Payment(pay_type, total, None, None),)))
+        result.append(receipts)
+    return result
+
+
+def legacy_report(per_kasa):
+    """Словник підсумків на кожну групу, день і година - рядками з local_time_str."""
+    by_day, by_hour, by_kasa = {}, {}, {}
+    for idx, receipts in enumerate(per_kasa):
+        for r in receipts:
+            day, hour = local_time_str(r.created_us, '%Y-%m-%d %H').split()
+            for grouped, key in ((by_day, day), (by_hour, hour), (by_kasa, idx)):
+                apply_receipt(grouped.setdefault(key, empty_totals()), r)
+    return by_day, by_hour, by_kasa
+
+
+def timed(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--kasas', type=int, default=20)
+    ap.add_argument('--days', type=int, default=31)
+    ap.add_argument('--per-day', type=int, default=300)
+    ap.add_argument('--repeat', type=int, default=3)
+    args = ap.parse_args()
+
+    first = date(2024, 3, 1)
+    per_kasa = make_receipts(args.kasas, args.days, args.per_day, first)
+    n = sum(len(rs) for rs in per_kasa)
+    columns = reports.ReceiptColumns()
+
+    def build():
+        columns.__init__()
+        for idx, receipts in enumerate(per_kasa):
+            columns.extend(idx, receipts)
+
+    build_t = timed(build, args.repeat)
+    from_us = reports.local_midnight_us(first)
+    to_us = reports.local_midnight_us(first + timedelta(days=args.days))
+    first_day = (first - date(1970, 1, 1)).days
+
+    def run(np_module):
+        saved, reports.np = reports.np, np_module
+        try:
+            return reports.aggregate(columns, from_us, to_us, first_day, args.days, args.kasas)
+        finally:
+            reports.np = saved
+
+    print(f"{n} receipts ({args.kasas} kasas x {args.days} days), python {sys.version.split()[0]}")
+    print(f"build columns: {build_t * 1000:8.1f} ms")
+    legacy_t = timed(lambda: legacy_report(per_kasa), args.repeat)
+    print(f"{'per-receipt dicts':<20}{legacy_t * 1000:>10.1f} ms")
+    python_t = timed(lambda: run(None), args.repeat)
+    print(f"{'columns, python':<20}{python_t * 1000:>10.1f} ms{legacy_t / python_t:>8.1f}x")
+    if reports.np is not None:
+        assert run(None) == run(reports.np)
+        numpy_t = timed(lambda: run(reports.np), args.repeat)
+        print(f"{'columns, numpy':<20}{numpy_t * 1000:>10.1f} ms{legacy_t / numpy_t:>8.1f}x")
+    else:
+        print("numpy is not installed: only the fallback path was measured")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+"""
+Локальна заміна Checkbox API для навантажувальних тестів.
+
+Реалізує ендпоінти, якими користується бот: cashier/signinPinCode, shifts,
+shifts/{id}, receipts/search, receipts/{id}, receipts/{id}/pdf, reports та
+cash-register. Каса визначається за заголовком X-License-Key; на кожній касі
+відкрита зміна, а чеки "з'являються" з заданою частотою (генеруються ліниво
+за часом, тож стан не залежить від частоти опитування).
+
+ID чеку містить час його створення в мілісекундах (останнє поле через '-'),
+за яким fake Telegram рахує затримку сповіщення.
+
+Окремий запуск:
+    python -m benchmarks.fake_checkbox --port 8081 --rate 6 --latency 50 --error-rate 0.01
+"""
+import argparse
+import asyncio
+import bisect
+import random
+import time
+from datetime import datetime, timezone
+from aiohttp import web
+
+API_PREFIX = '/api/v1'
+
+
+def iso(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+
+def parse_iso(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+
+def receipt_created_at(receipt_id):
+    """Час створення чеку (epoch, с) з його ID або None для інших документів."""
+    try:
+        return int(str(receipt_id).rsplit('-', 1)[1]) / 1000
+    except (IndexError, ValueError):
+        return None
+
+
+class FakeKasa:
+    def __init__(self, idx, license_key, rate, opened_at, rng):
+        self.idx = idx
+        self.license_key = license_key
+        self.rate = rate                    # чеків за секунду
+        self.opened_at = opened_at
+        self.phase = rng.random()           # щоб каси не генерували чеки синхронно
+        self.shift_id = f"shift-{idx}"
+        self.receipts = []
+        self.times = []
+        self.balance = {
+            'sell_receipts_count': 0, 'return_receipts_count': 0,
+            'sales': 0, 'returns': 0, 'service_in': 0, 'service_out': 0
+        }
+
+    def _make(self, seq, created):
+        if seq % 40 == 39:
+            r_type = 'SERVICE_IN'
+        elif seq % 15 == 14:
+            r_type = 'RETURN'
+        else:
+            r_type = 'SELL'
+        total = 1000 + (seq * 37) % 9000
+        if r_type == 'SERVICE_IN':
+            self.balance['service_in'] += total
+            payments = []
+        else:
+            if r_type == 'RETURN':
+                self.balance['return_receipts_count'] += 1
+                self.balance['returns'] += total
+            else:
+                self.balance['sell_receipts_count'] += 1
+                self.balance['sales'] += total
+            pay_type = 'CASH' if seq % 3 else 'CASHLESS'
+            payments = [{'type': pay_type, 'value': total, 'label': 'Оплата'}]
+        created_iso = iso(created)
+        return {
+            'id': f"{self.idx}-{seq:07d}-{int(created * 1000)}",
+            'serial': seq + 1,
+            'type': r_type,
+            'created_at': created_iso,
+            'modified_at': created_iso,
+            'total_sum': total,
+            'service_in': total if r_type == 'SERVICE_IN' else 0,
+            'service_out': 0,
+            'payments': payments
+        }
+
+    def advance(self, now):
+        if self.rate <= 0:
+            return
+        due = int((now - self.opened_at) * self.rate + self.phase)
+        while len(self.receipts) < due:
+            seq = len(self.receipts)
+            created = self.opened_at + (seq + 1 - self.phase) / self.rate
+            self.receipts.append(self._make(seq, created))
+            self.times.append(created)
+
+    def shift(self):
+        return {
+            'id': self.shift_id,
+            'serial': self.idx + 1,
+            'status': 'OPENED',
+            'opened_at': iso(self.opened_at),
+            'balance': dict(self.balance)
+        }
+
+
+class FakeCheckbox:
+    def __init__(self, rate=0.1, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0,
+                 pdf_size=20000, seed=1):
+        self.rate = rate
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.error_rate = error_rate
+        self.pdf_body = b'%PDF-1.4\n' + b'0' * max(0, pdf_size - 9)
+        self.rng = random.Random(seed)
+        self.started = time.time()
+        self.kasas = {}
+        self.requests = {}
+        self.errors = 0
+
+    def kasa(self, license_key):
+        kasa = self.kasas.get(license_key)
+        if kasa is None:
+            kasa = self.kasas[license_key] = FakeKasa(
+                len(self.kasas), license_key, self.rate, self.started, self.rng
+            )
+        kasa.advance(time.time())
+        return kasa
+
+    @web.middleware
+    async def middleware(self, request, handler):
+        name = request.match_info.route.name or 'unknown'
+        self.requests[name] = self.requests.get(name, 0) + 1
+        if name == 'stats':
+            return await handler(request)
+        if self.latency or self.jitter:
+            await asyncio.sleep(max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter)))
+        if self.error_rate and self.rng.random() < self.error_rate:
+            self.errors += 1
+            return web.json_response({'message': 'injected error'}, status=500)
+        return await handler(request)
+
+    async def signin(self, request):
+        return web.json_response({'access_token': f"token-{self.rng.getrandbits(64):x}"})
+
+    async def shifts(self, request):
+        kasa = self.kasa(request.headers.get('X-License-Key'))
+        return web.json_response({'results': [kasa.shift()]})
+
+    async def shift(self, request):
+        kasa = self.kasa(request.headers.get('X-License-Key'))
+        return web.json_response(kasa.shift())
+
+    async def search(self, request):
+        kasa = self.kasa(request.headers.get('X-License-Key'))
+        q = request.query
+        lo, hi = 0, len(kasa.receipts)
+        if 'from_date' in q:
+            lo = bisect.bisect_left(kasa.times, parse_iso(q['from_date']))
+        if 'to_date' in q:
+            hi = bisect.bisect_right(kasa.times, parse_iso(q['to_date']))
+        offset = int(q.get('offset', 0))
+        limit = int(q.get('limit', 25))
+        if q.get('desc') == 'true':
+            start, stop = max(lo, hi - offset - limit), hi - offset
+            page = kasa.receipts[start:max(start, stop)][::-1]
+        else:
+            page = kasa.receipts[lo + offset:min(hi, lo + offset + limit)]
+        return web.json_response({'results': page})
+
+    async def receipt(self, request):
+        rid = request.match_info['id']
+        kasa = self.kasa(request.headers.get('X-License-Key'))
+        created = receipt_created_at(rid)
+        if created is not None:
+            i = bisect.bisect_left(kasa.times, created - 0.001)
+            for r in kasa.receipts[i:i + 2]:
+                if r['id'] == rid:
+                    return web.json_response(r)
+        return web.json_response({'message': 'not found'}, status=404)
+
+    async def pdf(self, request):
+        return web.Response(body=self.pdf_body, content_type='application/pdf')
+
+    async def reports(self, request):
+        kasa = self.kasa(request.headers.get('X-License-Key'))
+        return web.json_response({'results': [{'id': f"report-{kasa.shift_id}"}]})
+
+    async def cash_register(self, request):
+        kasa = self.kasa(request.headers.get('X-License-Key'))
+        return web.json_response({'title': f"Каса {kasa.idx}"})
+
+    async def stats(self, request):
+        return web.json_response({
+            'requests': self.requests,
+            'errors': self.errors,
+            'receipts': sum(len(k.receipts) for k in self.kasas.values())
+        })
+
+    def app(self):
+        app = web.Application(middlewares=[self.middleware])
+        r = app.router
+        r.add_post(f'{API_PREFIX}/cashier/signinPinCode', self.signin, name='signin')
+        r.add_get(f'{API_PREFIX}/shifts', self.shifts, name='shifts')
+        r.add_get(f'{API_PREFIX}/shifts/{{id}}', self.shift, name='shift')
+        r.add_get(f'{API_PREFIX}/receipts/search', self.search, name='search')
+        r.add_get(f'{API_PREFIX}/receipts/{{id}}/pdf', self.pdf, name='pdf')
+        r.add_get(f'{API_PREFIX}/receipts/{{id}}', self.receipt, name='receipt')
+        r.add_get(f'{API_PREFIX}/reports', self.reports, name='reports')
+        r.add_get(f'{API_PREFIX}/cash-register', self.cash_register, name='cash_register')
+        r.add_get('/_stats', self.stats, name='stats')
+        return app
+
+
+def serve(port, **options):
+    web.run_app(FakeCheckbox(**options).app(), host='127.0.0.1', port=port, access_log=None, print=None)
+
+
+def add_arguments(ap):
+    ap.add_argument('--rate', type=float, default=6.0, help='чеків на хвилину на касу')
+    ap.add_argument('--latency', type=float, default=30.0, help='затримка відповіді API, мс')
+    ap.add_argument('--jitter', type=float, default=10.0, help='розкид затримки, +- мс')
+    ap.add_argument('--error-rate', type=float, default=0.0, help='частка відповідей 500')
+    ap.add_argument('--pdf-size', type=int, default=20000, help='розмір PDF, байт')
+
+
+def options_from_args(args):
+    return {
+        'rate': args.rate / 60,
+        'latency_ms': args.latency,
+        'jitter_ms': args.jitter,
+        'error_rate': args.error_rate,
+        'pdf_size': args.pdf_size
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--port', type=int, default=8081)
+    add_arguments(ap)
+    args = ap.parse_args()
+    serve(args.port, **options_from_args(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""
+Fake Telegram Bot API для навантажувальних тестів: приймає sendMessage і
+sendDocument (multipart чи urlencoded), відповідає як справжній API і
+рахує затримку сповіщень про чеки - від часу створення чеку (закодованого
+в ID fake Checkbox) до отримання документа.
+
+Опційно імітує flood control: частка відповідей 429 з retry_after.
+
+Окремий запуск:
+    python -m benchmarks.fake_telegram --port 8082 --flood-rate 0.01
+"""
+import argparse
+import asyncio
+import itertools
+import random
+import re
+import time
+from aiohttp import web
+from benchmarks.fake_checkbox import receipt_created_at
+
+RECEIPT_FILE_RE = re.compile(r'^receipt_(.+)\.pdf$')
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    idx = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[idx]
+
+
+class FakeTelegram:
+    def __init__(self, latency_ms=0.0, flood_rate=0.0, retry_after=1, seed=2):
+        self.latency = latency_ms / 1000
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.message_ids = itertools.count(1)
+        self.calls = {}
+        self.flood = 0
+        self.latencies = []
+        self.file_ids = {}      # file_id -> receipt_id
+
+    def _message(self, chat_id, extra):
+        msg = {
+            'message_id': next(self.message_ids),
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id), 'type': 'private'}
+        }
+        msg.update(extra)
+        return msg
+
+    def _observe(self, receipt_id):
+        created = receipt_created_at(receipt_id)
+        if created is None:
+            return
+        self.latencies.append(time.time() - created)
+
+    async def handle(self, request):
+        method = request.match_info['method']
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if request.content_type == 'application/json':
+            form = await request.json()
+        else:
+            form = await request.post()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method in ('sendMessage', 'sendDocument') and self.flood_rate and self.rng.random() < self.flood_rate:
+            self.flood += 1
+            return web.json_response({
+                'ok': False, 'error_code': 429,
+                'description': f'Too Many Requests: retry after {self.retry_after}',
+                'parameters': {'retry_after': self.retry_after}
+            })
+
+        chat_id = form.get('chat_id', 0)
+        if method == 'sendMessage':
+            result = self._message(chat_id, {'text': form.get('text', '')})
+        elif method == 'sendDocument':
+            document = form.get('document')
+            if isinstance(document, str) and document.startswith('attach://'):
+                # aiogram передає файл окремим полем, а в document - посилання на нього
+                document = form.get(document[len('attach://'):])
+            if isinstance(document, web.FileField):
+                await asyncio.get_running_loop().run_in_executor(None, document.file.read)
+                m = RECEIPT_FILE_RE.match(document.filename or '')
+                receipt_id = m.group(1) if m else None
+                file_id = f"file-{next(self.message_ids)}"
+                self.file_ids[file_id] = receipt_id
+            else:
+                file_id = str(document)
+                receipt_id = self.file_ids.get(file_id)
+            if receipt_id:
+                self._observe(receipt_id)
+            result = self._message(chat_id, {
+                'caption': form.get('caption'),
+                'document': {'file_id': file_id, 'file_unique_id': file_id}
+            })
+        elif method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'}
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+    async def stats(self, request):
+        lat = sorted(self.latencies)
+        return web.json_response({
+            'calls': self.calls,
+            'flood': self.flood,
+            'receipts': len(lat),
+            'latency_p50': percentile(lat, 0.50),
+            'latency_p99': percentile(lat, 0.99),
+            'latency_max': lat[-1] if lat else None
+        })
+
+    def app(self):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        app.router.add_get('/_stats', self.stats)
+        return app
+
+
+def serve(port, **options):
+    web.run_app(FakeTelegram(**options).app(), host='127.0.0.1', port=port, access_log=None, print=None)
+
+
+def add_arguments(ap):
+    ap.add_argument('--tg-latency', type=float, default=20.0, help='затримка Bot API, мс')
+    ap.add_argument('--flood-rate', type=float, default=0.0, help='частка відповідей 429')
+
+
+def options_from_args(args):
+    return {'latency_ms': args.tg_latency, 'flood_rate': args.flood_rate}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--port', type=int, default=8082)
+    add_arguments(ap)
+    args = ap.parse_args()
+    serve(args.port, **options_from_args(args))
+
+
+if __name__ == '__main__':
+    main()
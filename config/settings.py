@@ -7,24 +7,182 @@ BASE_URL = 'https://api.checkbox.in.ua/api/v1'
 CLIENT_NAME = 'IOClient'
 CLIENT_VERSION = '1.0'
 
+# --- Налаштування HTTP-пулу з'єднань до Checkbox API ---
+# Загальна кількість одночасних з'єднань у пулі
+HTTP_POOL_LIMIT = 100
+# Максимум з'єднань до одного хоста
+HTTP_POOL_LIMIT_PER_HOST = 30
+# Час кешування DNS-записів (у секундах)
+HTTP_DNS_CACHE_TTL = 300
+# Скільки тримати неактивне keep-alive з'єднання (у секундах)
+HTTP_KEEPALIVE_TIMEOUT = 60
+# Загальний таймаут одного запиту (у секундах)
+HTTP_REQUEST_TIMEOUT = 30
+
+# Запис трафіку Checkbox API для офлайн-бенчмарків (gzip JSON lines; None - вимкнено).
+# Ключі ліцензій, токени та PIN-коди у запис не потрапляють.
+API_RECORD_FILE = None  # наприклад, 'data/api_trace.jsonl.gz'
+# Зберігати вміст PDF (інакше лише розмір)
+API_RECORD_KEEP_PDF = False
+
 # Файли для збереження токена та даних про каси
 TOKEN_FILE = 'data/token.json'
 KASAS_FILE = 'data/kasas.json'
 
+# Сховище стану кас: 'sqlite' (рядок на касу, режим WAL) або 'json' (весь файл KASAS_FILE)
+STORAGE_BACKEND = 'sqlite'
+# Файл бази SQLite; при першому запуску дані переносяться з KASAS_FILE
+KASAS_DB_FILE = 'data/kasas.db'
+# Локальний журнал чеків (для звітів за зміною без повторної пагінації API).
+# У режимі шардування кожен воркер веде власний файл (data/ledger.shard-N.db),
+# а цей лишається фронт-процесу (/report)
+LEDGER_DB_FILE = 'data/ledger.db'
+# Скільки днів зберігати чеки в журналі (0 - не видаляти)
+LEDGER_RETENTION_DAYS = 90
+# /report: найдовший період звіту в днях (на кожну касу - список змін і чеки незакешованих змін з API)
+REPORT_MAX_DAYS = 93
+# /export: каталог тимчасових файлів, розмір сторінки receipts/search, gzip на льоту
+EXPORT_DIR = 'data/exports'
+EXPORT_PAGE_SIZE = 100
+EXPORT_COMPRESS = True
+# Найбільший файл, який бот може надіслати документом (обмеження Telegram Bot API)
+EXPORT_MAX_BYTES = 50 * 1024 * 1024
+# Дисковий кеш PDF чеків і звітів (LRU за сумарним розміром)
+PDF_CACHE_DIR = 'data/pdf_cache'
+PDF_CACHE_MAX_BYTES = 200 * 1024 * 1024
+# Скільки Telegram file_id пам'ятати для повторної відправки без upload
+PDF_CACHE_MAX_FILE_IDS = 50000
+# Мінімальний інтервал між записами стану кас на диск (у секундах)
+PERSIST_INTERVAL = 2.0
+
 # Регулярний вираз для перевірки формату Telegram токена
 TELEGRAM_TOKEN_REGEX = r'^\d+:.+'
 
+# --- Отримання оновлень Telegram ---
+# 'polling' - long polling (dp.start_polling); 'webhook' - вбудований HTTP-сервер
+UPDATE_MODE = 'polling'
+# Публічна адреса (https://host[:port]), за якою Telegram надсилає оновлення;
+# None - webhook у Telegram не реєструється (локальна перевірка / reverse proxy)
+WEBHOOK_URL = None
+WEBHOOK_PATH = '/telegram/webhook'
+# Адреса, яку слухає вбудований сервер (за reverse proxy - лише локальна)
+WEBHOOK_HOST = '127.0.0.1'
+WEBHOOK_PORT = 8080
+# Секрет для заголовка X-Telegram-Bot-Api-Secret-Token; запити без нього відхиляються.
+# None - випадковий при кожній реєстрації (лише з WEBHOOK_URL, інакше обов'язковий)
+WEBHOOK_SECRET = None
+
+# --- Токени касира ---
+# Час життя токена, якщо не вдалося прочитати exp з JWT (у секундах)
+CASHIER_TOKEN_TTL = 8 * 60 * 60
+# За скільки секунд до закінчення дії токен оновлюється заздалегідь
+CASHIER_TOKEN_REFRESH_MARGIN = 300
+
 # Інтервали опитування (у секундах) для відкритої/закритої зміни
 POLL_INTERVAL_OPEN = 10      # для відкритої зміни
 POLL_INTERVAL_CLOSED = 30    # для закритої зміни
 
+# --- Адаптивні інтервали опитування ---
+# Підлаштовувати інтервал під частоту чеків (False - статичні інтервали вище)
+ADAPTIVE_POLLING = True
+# Нижня та верхня межа інтервалу для відкритої зміни (у секундах)
+POLL_INTERVAL_MIN = 5
+POLL_INTERVAL_MAX = 60
+# Скільки секунд після відкриття зміни опитувати з мінімальним інтервалом
+POLL_SHIFT_OPEN_BOOST = 300
+# Вікно усереднення частоти чеків (у секундах)
+POLL_RATE_WINDOW = 900
+# Скільки нових чеків в середньому очікуємо за одне опитування
+POLL_TARGET_RECEIPTS = 1.0
+# Нічні години (за Києвом, [початок, кінець)) та інтервал для закритої зміни вночі
+POLL_NIGHT_HOURS = (23, 7)
+POLL_INTERVAL_NIGHT = 300
+
+# --- Планувальник опитування ---
+# Кількість воркерів = глобальна межа одночасних опитувань кас
+POLL_WORKERS = 20
+# Розкид інтервалу опитування (частка від інтервалу, 0.1 = +-10%)
+POLL_JITTER = 0.1
+# Пауза перед повтором після помилки опитування (у секундах); при невдачах поспіль
+# подвоюється (з розкидом) до POLL_BACKOFF_MAX
+POLL_ERROR_RETRY = 10
+POLL_BACKOFF_MAX = 300
+# Затримка опитування (lag), після якої пишеться попередження (у секундах)
+POLL_LAG_WARNING = 5
+# Як часто писати в лог статистику планувальника (у секундах, 0 - вимкнено)
+POLL_STATS_LOG_INTERVAL = 60
+
+# --- Захист Checkbox API ---
+# Межа частоти запитів (запитів за секунду) і допустимий "сплеск": на процес і на одну касу (0 - без межі)
+CHECKBOX_GLOBAL_RATE = 100
+CHECKBOX_GLOBAL_BURST = 200
+CHECKBOX_LICENSE_RATE = 5
+CHECKBOX_LICENSE_BURST = 10
+# Пауза після 429/503 без заголовка Retry-After та максимум для Retry-After (у секундах)
+CHECKBOX_RETRY_AFTER_DEFAULT = 5
+CHECKBOX_RETRY_AFTER_MAX = 300
+# Найдовше очікування перед запитом; якщо API недоступне довше - запит одразу відхиляється
+CHECKBOX_MAX_WAIT = 10
+# Circuit breaker на (каса, група ендпоінтів): невдач поспіль до відкриття,
+# пауза до пробного запиту та її максимум (подвоюється з кожним відкриттям)
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_TIMEOUT = 30
+BREAKER_RESET_MAX = 300
+
+# --- Шардування опитування між процесами ---
+# Кількість процесів-воркерів, між якими розподіляються каси (0 або 1 - усе в одному процесі).
+# Фронт-процес лишає собі Telegram (Dispatcher, черга відправки) і збереження стану.
+POLL_SHARDS = 0
+# Як часто воркер надсилає фронту стан свого планувальника (у секундах)
+SHARD_STATS_INTERVAL = 5
+# Пауза перед перезапуском воркера, що завершився аварійно (у секундах)
+SHARD_RESTART_DELAY = 2
+# Скільки чекати завершення воркерів при зупинці бота чи зменшенні POLL_SHARDS (у секундах)
+SHARD_STOP_TIMEOUT = 10
+
+# --- Черга відправки повідомлень у Telegram ---
+# Глобальна межа швидкості відправки (повідомлень за секунду)
+TELEGRAM_GLOBAL_RATE = 25
+# Межа швидкості для одного чату та допустимий "сплеск"
+TELEGRAM_CHAT_RATE = 1
+TELEGRAM_CHAT_BURST = 3
+# Кількість паралельних відправників (повільний upload не блокує інші чати)
+DELIVERY_WORKERS = 4
+# Межі черги: кількість повідомлень і сумарний розмір PDF у них (байтів).
+# Сповіщення про чеки відкидаються вже на DELIVERY_RECEIPT_SHARE від межі,
+# решта - резерв для повідомлень про зміну; понад межу відкидається все
+DELIVERY_QUEUE_MAXSIZE = 5000
+DELIVERY_QUEUE_MAX_BYTES = 64 * 1024 * 1024
+DELIVERY_RECEIPT_SHARE = 0.9
+# Кількість спроб при мережевих помилках
+DELIVERY_MAX_ATTEMPTS = 5
+
+# --- Метрики (Prometheus) ---
+# Локальний HTTP-ендпоінт /metrics у текстовому форматі Prometheus
+METRICS_ENABLED = False
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9108
+
 # --- Налаштування логування ---
 # Загальний рівень логування
 LOG_LEVEL = 'INFO'
-# Каталог для лог-файлів
+# Каталог і назва лог-файлу
 LOG_DIR = 'logs'
-# Максимальна кількість лог-файлів, після досягнення якої видаляються найстаріші
+LOG_FILE = 'bot.log'
+# Ротація лог-файлу: за розміром (у байтах) і за часом (у секундах, 0 - лише за розміром)
+LOG_MAX_BYTES = 20 * 1024 * 1024
+LOG_ROTATE_INTERVAL = 24 * 3600
+# Стискати ротовані файли gzip (у фоновому потоці)
+LOG_COMPRESS = True
+# Максимальна кількість ротованих лог-файлів, після досягнення якої видаляються найстаріші
 MAX_LOG_FILES = 10
+# Проріджування частих повідомлень INFO/DEBUG: з одного джерела (логер + тег повідомлення)
+# за LOG_SAMPLE_WINDOW секунд пишуться перші LOG_SAMPLE_BURST (0 - без проріджування)
+LOG_SAMPLE_WINDOW = 60
+LOG_SAMPLE_BURST = 50
+# Проріджуються лише логери циклу опитування та доставки чеків (і їх дочірні);
+# одноразові записи стану в них позначаються extra=UNSAMPLED (utils.log_config)
+LOG_SAMPLE_LOGGERS = ('handlers.start', 'services.checkbox_api')
 # Формат повідомлень логування
 LOG_FORMAT = '[%(asctime)s] [%(levelname)s] [%(name)s] %(message)s'
 
@@ -41,4 +199,20 @@ DEBUG_WITHDRAWAL_LOG = False # відключено, до видалення.
 # --- Налаштування оптимізації опитування чеків ---
 # Використовуємо "короткий" запит – порівнюємо лише останній ID чеку,
 # а розширені дані отримуємо лише при виявленні нового чеку.
-SHORT_RECEIPT_OPTIMIZATION = True
\ No newline at end of file
+# Окремий запит limit=1 робиться лише в режимі 'window': в 'incremental'
+# його роль виконує перша мала сторінка (RECEIPT_SYNC_PAGE_SIZE).
+SHORT_RECEIPT_OPTIMIZATION = True
+
+# Режим синхронізації чеків:
+#   'incremental' - сторінки від найновіших чеків до останнього відомого ID;
+#   'window'      - повторний запит усього часового вікна від останнього чеку.
+RECEIPT_SYNC_MODE = 'incremental'
+# Розмір першої (малої) сторінки інкрементальної синхронізації
+RECEIPT_SYNC_PAGE_SIZE = 10
+# Розмір сторінки при повній пагінації, якщо виявлено розрив
+RECEIPT_SYNC_FULL_PAGE_SIZE = 100
+# Скільки нових чеків одночасно завантажувати (деталі + PDF); 1 - послідовно
+RECEIPT_PIPELINE_CONCURRENCY = 8
+# Скільки циклів поспіль повторювати чек, деталі чи PDF якого не отримано,
+# перш ніж надіслати його без PDF (або пропустити, якщо немає деталей)
+RECEIPT_MAX_ATTEMPTS = 5
\ No newline at end of file
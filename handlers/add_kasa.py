@@ -6,8 +6,7 @@ from aiogram.fsm.context import FSMContext
 from aiogram.filters.state import StateFilter
 from datetime import datetime, timezone
 from services.checkbox_api import get_cashier_token, get_kasa_name
-from utils.storage import save_kasas_data
-from handlers.start import kasas_data, get_shift_status_msg, start_background_polling
+from handlers.start import kasas_data, persister, get_shift_status_msg, start_background_polling
 
 logger = logging.getLogger(__name__)
 
@@ -60,7 +59,7 @@ async def process_pin_code(message: types.Message, state: FSMContext):
     }
     user_kasas.append(kasa_data)
     kasas_data[user_id] = user_kasas
-    save_kasas_data(kasas_data)
+    persister.mark_dirty()
 
     st_msg = await get_shift_status_msg(kasa_data, idx)
     await message.answer(f"Каса '{nm}' додана.\n{st_msg}")
@@ -11,6 +11,10 @@ async def cmd_help(message: types.Message):
         "/start - Перевірити статус кас\n"
         "/add_kasa - Додати касу\n"
         "/list_kasas - Переглянути всі каси\n"
+        "/stats - Стан опитування кас\n"
+        "/totals - Підсумки відкритих змін на зараз\n"
+        "/report - Звіт за період (today, week, month або дати)\n"
+        "/export - Чеки за період файлом CSV або JSON Lines\n"
         "/help - Допомога (це повідомлення)"
     )
     await message.answer(text)
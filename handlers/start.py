@@ -4,29 +4,69 @@ handlers/start.py
 """
 
 import asyncio
+import json
 import logging
-from datetime import datetime, timezone
+import os
+from collections import deque
+from datetime import datetime, timedelta, timezone
 import dateutil.parser
-from config.settings import POLL_INTERVAL_OPEN, POLL_INTERVAL_CLOSED, DEBUG_SHIFT_LOG
+from config.settings import POLL_INTERVAL_OPEN, POLL_INTERVAL_CLOSED, DEBUG_SHIFT_LOG, POLL_ERROR_RETRY, POLL_BACKOFF_MAX
 from aiogram import Bot, Dispatcher, types
 from aiogram.filters import Command
+from aiogram.types import FSInputFile
 
 from services.checkbox_api import (
+    count_requests,
+    get_client,
     get_cashier_token,
-    get_current_shift_id,
+    get_current_shift,
     get_shift_info,
-    get_recent_receipts
+    get_receipts_page,
+    iter_receipts,
+    ReceiptsTruncatedError,
+    get_receipt_pdf,
+    get_report_receipt_info
 )
-from utils.storage import load_kasas_data, save_kasas_data
-from utils.format_helpers import format_receipt_info, format_shift_statistics
+from services.reports import build_report, local_midnight_us, parse_period
+from services.export import FORMATS as EXPORT_FORMATS, export_filename, export_receipts
+from services import metrics
+from services.api_trace import kasa_alias
+from services.pdf_cache import PdfCache
+from services.delivery import DeliveryQueue, make_item, PRIORITY_SHIFT, PRIORITY_RECEIPT
+from services.poll_scheduler import PollScheduler
+from services.sharding import ShardSupervisor, FRONT_FIELDS
+from services.adaptive_interval import compute_interval, mark_shift_opened, observe_receipts
+from services.resilience import ApiUnavailableError, backoff_delay
+from utils.storage import load_kasas_data
+from utils.persister import StatePersister
+from utils.ledger import ReceiptLedger, shift_receipts_count
+from utils.format_helpers import format_receipt_info, format_shift_totals, format_report, split_message
+from utils.shift_totals import SERVICE_TYPES, apply_receipt, kasa_totals, totals_from_receipts
+from utils.receipt import KYIV_TZ, datetime_to_us, us_to_datetime, us_to_iso
+from utils.log_config import UNSAMPLED
 
 # Додамо параметри опитування та налаштування налагодження з налаштувань
 from config.settings import POLL_INTERVAL_OPEN, POLL_INTERVAL_CLOSED, DEBUG_SHIFT_LOG, DEBUG_WITHDRAWAL_LOG
+from config.settings import EXPORT_DIR, EXPORT_MAX_BYTES
 
 logger = logging.getLogger(__name__)
-kasas_data = load_kasas_data()
+# Стан кас завантажується явно при старті бота (load_state), не при імпорті
+kasas_data = {}
+persister = StatePersister(kasas_data)
+ledger = ReceiptLedger()
+pdf_cache = PdfCache()
 bot: Bot = None
 dp: Dispatcher = None
+delivery: DeliveryQueue = None
+# ShardSupervisor у режимі шардування (POLL_SHARDS > 1), інакше опитує scheduler
+shards = None
+# Користувачі, для яких зараз виконується /export (один експорт на користувача)
+exports_running = set()
+
+def load_state():
+    """Завантажує каси зі сховища у kasas_data (після utils.storage.open_storage)."""
+    kasas_data.clear()
+    kasas_data.update(load_kasas_data())
 
 async def cmd_start(message: types.Message):
     user_id = str(message.from_user.id)
@@ -43,12 +83,14 @@ async def cmd_start(message: types.Message):
         await message.answer("Перевіряю стан кас...")
 
     # Скидаємо лише необхідні поля, НЕ змінюючи last_receipt_datetime
+    reset = {'last_polled_shift_status': None, 'shift_id': None, 'shift_closed': True}
     for kasa_info in user_kasas:
         kasa_info['task_started'] = False
-        kasa_info['last_polled_shift_status'] = None
-        kasa_info['shift_id'] = None
-        kasa_info['shift_closed'] = True
-    save_kasas_data(kasas_data)
+        kasa_info.update(reset)
+        if shards is not None:
+            # Стан каси веде її воркер - скидання має дійти і до нього
+            shards.update(user_id, kasa_info['license_key'], reset)
+    persister.mark_dirty()
     await start_background_polling(user_id)
     await message.answer("✅ Моніторинг запущено. Очікуйте сповіщення про зміни.")
 
@@ -67,80 +109,157 @@ async def cmd_list_kasas(message: types.Message):
 async def get_shift_status_msg(kasa_info, idx=1):
     license_key = kasa_info['license_key']
     pin_code = kasa_info['pin_code']
-    if not kasa_info.get('cashier_token'):
-        kasa_info['cashier_token'] = await get_cashier_token(license_key, pin_code)
+    # Токен береться з кешу і оновлюється лише перед закінченням дії
+    kasa_info['cashier_token'] = await get_cashier_token(license_key, pin_code)
     kasa_name = kasa_info.get('kasa_name', f"Каса №{idx}")
-    shift_id = await get_current_shift_id(license_key, kasa_info['cashier_token'])
-    if not shift_id:
-        return f"На касі '{kasa_name}' зміна закрита."
-    inf = await get_shift_info(license_key, kasa_info['cashier_token'], shift_id)
+    inf = await get_current_shift(license_key, kasa_info['cashier_token'])
     if not inf:
-        return f"Не вдалося отримати інформацію про зміну на касі '{kasa_name}'."
+        return f"На касі '{kasa_name}' зміна закрита."
     st = inf.get('status', 'UNKNOWN')
     if st == 'OPENED':
         srl = inf.get('serial', 'N/A')
         return f"На касі '{kasa_name}' відкрита зміна №{srl}."
     return f"На касі '{kasa_name}' зміна має статус '{st}'."
 
+def poll_key(user_id, kasa_info):
+    return (user_id, kasa_info['license_key'])
+
 async def start_background_polling(user_id):
     user_kasas = kasas_data.get(user_id, [])
     for kasa_info in user_kasas:
-        if not kasa_info.get('task_started'):
-            kasa_info['task_started'] = True
-            asyncio.create_task(poll_kasa_loop(user_id, kasa_info))
-    save_kasas_data(kasas_data)
+        key = poll_key(user_id, kasa_info)
+        if shards is not None:
+            shards.assign(user_id, kasa_info)
+        elif key not in scheduler:
+            scheduler.add(key, user_id, kasa_info)
+        kasa_info['task_started'] = True
+    persister.mark_dirty()
 
-async def poll_kasa_loop(user_id, kasa_info):
+async def stop_background_polling():
+    if shards is not None:
+        await shards.stop()
+    await scheduler.stop()
+    if delivery is not None:
+        await delivery.stop()
+    # Фінальний запис стану після зупинки опитування
+    await persister.stop()
+    ledger.close()
+    pdf_cache.close()
+
+async def poll_kasa_once(user_id, kasa_info):
     kasa_name = kasa_info.get('kasa_name', 'N/A')
-    while True:
-        try:
-            logger.info(f"[poll_kasa_loop] Polling kasa: {kasa_name} for user: {user_id}")
-            await handle_shift_and_receipts(user_id, kasa_info)
-            # Використовуємо різний інтервал в залежності від стану зміни
-            if kasa_info.get('last_polled_shift_status') == 'OPENED':
-                sleep_seconds = POLL_INTERVAL_OPEN
-            else:
-                sleep_seconds = POLL_INTERVAL_CLOSED
-            await asyncio.sleep(sleep_seconds)
-        except Exception as e:
-            logger.exception(f"[poll_kasa_loop] Error polling kasa '{kasa_name}': {e}")
-            await asyncio.sleep(10)
+    logger.info(f"[poll_kasa_once] Polling kasa: {kasa_name} for user: {user_id}")
+    await handle_shift_and_receipts(user_id, kasa_info)
+
+def poll_interval(kasa):
+    """
+    Інтервал до наступного опитування: адаптивний (compute_interval), але не
+    раніше, ніж API знову доступне для каси (Retry-After, відкритий circuit
+    breaker), і з експоненційною паузою після невдалих циклів поспіль.
+    """
+    interval = compute_interval(kasa)
+    failures = kasa.get('poll_failures', 0)
+    if failures:
+        interval = max(interval, backoff_delay(failures, POLL_ERROR_RETRY, POLL_BACKOFF_MAX))
+    interval = max(interval, get_client().guard.retry_delay(kasa['license_key']))
+    kasa['poll_interval'] = round(interval, 1)
+    return interval
+
+scheduler = PollScheduler(poll_kasa_once, poll_interval)
+
+async def cmd_stats(message: types.Message):
+    user_id = str(message.from_user.id)
+    if shards is not None:
+        st = shards.stats()
+    else:
+        st = scheduler.stats() if scheduler.running else None
+    if not st:
+        await message.answer("Опитування кас ще не запущено.")
+        return
+    lines = [
+        "Стан опитування:",
+        f"Кас у розкладі: {st['kasas']}",
+        f"Опитувань зараз: {st['in_flight']} з {st['workers']}",
+        f"Затримка (сер./макс.): {st['lag_avg']:.2f} / {st['lag_max']:.2f} с",
+        f"Прострочених: {st['overdue']} (макс. {st['overdue_max']:.1f} с)"
+    ]
+    if shards is not None:
+        lines.append(f"Процесів опитування: {st['shards']} (перезапусків {st['restarts']}, "
+                     f"відхилено сповіщень про чеки {st['rejected']})")
+    dq = delivery.stats()
+    lines.append(
+        f"Черга відправки: {dq['depth']}, {dq['bytes'] / 1048576:.1f} МБ (надіслано {dq['sent']}, відкинуто {dq['dropped']}, "
+        f"помилок {dq['failed']}, flood-control {dq['retry_after']})"
+    )
+    pc = pdf_cache.stats()
+    lines.append(
+        f"PDF кеш: {pc['files']} файлів, {pc['bytes'] / 1048576:.1f} МБ, "
+        f"влучань {pc['hits']}, промахів {pc['misses']}, повторів за file_id {pc['file_id_hits']}"
+    )
+    for idx, k in enumerate(kasas_data.get(user_id, []), start=1):
+        nm = k.get('kasa_name', f"Каса №{idx}")
+        rate = k.get('receipt_rate')
+        rate_txt = f"{rate * 3600:.1f} чек/год" if rate is not None else "н/д"
+        lines.append(
+            f"{idx}. {nm}: інтервал {k.get('poll_interval', '-')} с, "
+            f"частота {rate_txt}, затримка {k.get('poll_lag', 0):.2f} с, "
+            f"запитів за цикл {k.get('http_calls', '-')}"
+        )
+        if k.get('poll_failures') or k.get('api_breakers'):
+            breakers = ', '.join(f"{f}: {s}" for f, s in sorted(k.get('api_breakers', {}).items()))
+            lines.append(
+                f"   API недоступне: невдалих циклів поспіль {k.get('poll_failures', 0)}"
+                + (f", запобіжники {breakers}" if breakers else "")
+            )
+    await message.answer("\n".join(lines))
 
 async def handle_shift_and_receipts(user_id, kasa):
-    from datetime import datetime, timezone
-    import dateutil.parser
-    # (інші імпорти та початкова логіка залишаються без змін)
-    lic = kasa['license_key']
-    pin = kasa['pin_code']
     kasa_name = kasa.get('kasa_name', 'N/A')
 
     logger.info(f"[handle_shift_and_receipts] Handling kasa '{kasa_name}' for user: {user_id}")
+    calls = count_requests()
+    ok = False
+    try:
+        ok = await poll_shift_and_receipts(user_id, kasa)
+    finally:
+        # Невдалі цикли поспіль відсувають наступне опитування (див. poll_interval)
+        kasa['poll_failures'] = 0 if ok else kasa.get('poll_failures', 0) + 1
+        kasa['api_breakers'] = get_client().guard.breaker_states(kasa['license_key'])
+        kasa['http_calls'] = calls.calls
+        logger.info(f"[handle_shift_and_receipts] Cycle for kasa '{kasa_name}' made {calls.calls} HTTP calls"
+                    + (f" ({calls.summary()})" if calls.calls else ""))
+
+async def poll_shift_and_receipts(user_id, kasa):
+    """
+    Один цикл опитування каси. Стан зміни (ID, статус, serial, opened_at)
+    береться з одного запиту GET /shifts, тож для відкритої зміни без нових
+    чеків цикл коштує один запит (див. shift_balance_signature).
+    Повертає False, якщо стан зміни отримати не вдалося: стан каси тоді
+    не змінюється (недоступність API не вважається закриттям зміни).
+    False і тоді, коли зміну отримано, а пошук чеків чи їх деталі - ні:
+    такий цикл теж відсуває наступне опитування (poll_failures).
+    """
+    lic = kasa['license_key']
+    pin = kasa['pin_code']
+    kasa_name = kasa.get('kasa_name', 'N/A')
 
-    if not kasa.get('cashier_token'):
-        logger.info(f"[handle_shift_and_receipts] Fetching cashier token for kasa '{kasa_name}'")
-        kasa['cashier_token'] = await get_cashier_token(lic, pin)
+    # Токен береться з кешу і оновлюється лише перед закінченням дії
+    kasa['cashier_token'] = await get_cashier_token(lic, pin)
+    if not kasa['cashier_token']:
+        logger.error(f"[handle_shift_and_receipts] No cashier token for kasa '{kasa_name}'")
+        return False
 
-    sid = None
     try:
-        sid = await get_current_shift_id(lic, kasa['cashier_token'])
-        logger.info(f"[handle_shift_and_receipts] Current shift ID for kasa '{kasa_name}': {sid}")
+        shift_data = await get_current_shift(lic, kasa['cashier_token'], strict=True)
+        if DEBUG_SHIFT_LOG:
+            logger.info(f"[handle_shift_and_receipts] Shift data for kasa '{kasa_name}': {shift_data}")
     except Exception as e:
-        logger.error(f"[handle_shift_and_receipts] Failed to fetch shift ID for kasa '{kasa_name}': {e}")
-        sid = None
+        logger.error(f"[handle_shift_and_receipts] Failed to fetch shift for kasa '{kasa_name}': {e}")
+        return False
+    sid = shift_data.get('id') if shift_data else None
+    logger.info(f"[handle_shift_and_receipts] Current shift ID for kasa '{kasa_name}': {sid}")
 
     new_status = 'CLOSED'
-    shift_data = None
-
-    if sid:
-        try:
-            shift_data = await get_shift_info(lic, kasa['cashier_token'], sid)
-            if DEBUG_SHIFT_LOG:
-                logger.info(f"[handle_shift_and_receipts] Shift data for kasa '{kasa_name}': {shift_data}")
-            else:
-                logger.info(f"[handle_shift_and_receipts] Shift info fetched for kasa '{kasa_name}'")
-        except Exception as e:
-            logger.error(f"[handle_shift_and_receipts] Failed to fetch shift info for kasa '{kasa_name}': {e}")
-
     if shift_data:
         shift_status = shift_data.get('status', 'UNKNOWN')
         if shift_status == 'OPENED':
@@ -149,20 +268,11 @@ async def handle_shift_and_receipts(user_id, kasa):
     old_status = kasa.get('last_polled_shift_status')
     kasa['last_polled_shift_status'] = new_status
 
-    # Формування часових діапазонів для запиту звітів
-    if 'shift_start_datetime' in kasa and kasa['shift_start_datetime']:
-        if isinstance(kasa['shift_start_datetime'], str):
-            from_date_str = kasa['shift_start_datetime']
-        else:
-            from_date_str = kasa['shift_start_datetime'].isoformat()
-    else:
-        from_date_str = datetime.now(timezone.utc).isoformat()
-    to_date_str = datetime.now(timezone.utc).isoformat()
-
 # У відповідному блоці для OPENED
     if new_status == 'OPENED' and old_status != 'OPENED':
         kasa['shift_id'] = sid
         kasa['shift_closed'] = False
+        mark_shift_opened(kasa)
         if not kasa.get('shift_start_datetime'):
             opened_at = shift_data.get('opened_at') if shift_data else None
             if opened_at:
@@ -172,79 +282,141 @@ async def handle_shift_and_receipts(user_id, kasa):
         if not kasa.get('last_receipt_datetime'):
             kasa['last_receipt_datetime'] = kasa['shift_start_datetime']
 
-        logger.info(f"[handle_shift_and_receipts] Shift opened for kasa '{kasa_name}' (ID: {sid})")
-        await bot.send_message(user_id, f"Зміна відкрита на касі '{kasa_name}'.")
+        logger.info(f"[handle_shift_and_receipts] Shift opened for kasa '{kasa_name}' (ID: {sid})", extra=UNSAMPLED)
+        notify(user_id, f"Зміна відкрита на касі '{kasa_name}'.")
         
         # --- Отримання X звіту ---
-        from_date_str = kasa['shift_start_datetime'].isoformat()
-        to_date_str = datetime.now(timezone.utc).isoformat()
-        from services.checkbox_api import get_report_receipt_info, get_receipt_pdf
-        reports = await get_report_receipt_info(lic, kasa['cashier_token'], is_z_report=False, shift_id=sid,
-                                               from_date=from_date_str, to_date=to_date_str)
-        pdf_x = None
-        if reports:
-            for rep in reports:
-                receipt_id = rep.get('last_receipt_id') or rep.get('id')
-                logger.info(f"[handle_shift_and_receipts] Trying X report with receipt_id: {receipt_id}")
-                pdf_x = await get_receipt_pdf(kasa, receipt_id)
-                if pdf_x:
-                    logger.info(f"[handle_shift_and_receipts] Successfully retrieved X report PDF for receipt_id: {receipt_id}")
-                    break
-            if pdf_x:
-                from aiogram.types import BufferedInputFile
-                x_file = BufferedInputFile(pdf_x, filename=f"x_report_{sid}.pdf")
-                await bot.send_document(user_id, x_file, caption=f"X звіт для зміни ({sid})")
-            else:
-                logger.error(f"[handle_shift_and_receipts] Не вдалося отримати PDF для X звіту (перевірте звіти для shift {sid}).")
-        else:
-            logger.error(f"[handle_shift_and_receipts] Звіт X не знайдено для зміни ({sid}).")
-            
+        await send_shift_report(user_id, kasa, sid, False, kasa['shift_start_datetime'].isoformat())
+
     # --- Блок для CLOSED (аналогічно, для Z звіту) ---
     elif new_status == 'CLOSED' and old_status != 'CLOSED':
         await send_shift_summary(user_id, kasa)
+        # Зміна вже закрита, тож беремо ID та початок закритої зміни до скидання стану
+        closed_sid = kasa.get('shift_id')
+        closed_from = kasa.get('shift_start_datetime')
         kasa['shift_id'] = None
         kasa['shift_closed'] = True
         kasa['last_receipt_datetime'] = None
         kasa.pop('shift_start_datetime', None)
         kasa['last_receipt_id'] = None
         kasa['receipt_counter'] = 0  # скидання лічильника чеків
-        logger.info(f"[handle_shift_and_receipts] Shift closed for kasa '{kasa_name}'")
-        await bot.send_message(user_id, f"На касі '{kasa_name}' зміна закрита.")
+        kasa.pop('rate_observed_at', None)
+        logger.info(f"[handle_shift_and_receipts] Shift closed for kasa '{kasa_name}'", extra=UNSAMPLED)
+        notify(user_id, f"На касі '{kasa_name}' зміна закрита.")
         
-        from_date_str = kasa.get('shift_start_datetime').isoformat() if kasa.get('shift_start_datetime') else datetime.now(timezone.utc).isoformat()
-        to_date_str = datetime.now(timezone.utc).isoformat()
-        from services.checkbox_api import get_report_receipt_info, get_receipt_pdf
-        reports = await get_report_receipt_info(lic, kasa['cashier_token'], is_z_report=True, shift_id=sid,
-                                               from_date=from_date_str, to_date=to_date_str)
-        pdf_z = None
-        if reports:
-            for rep in reports:
-                receipt_id = rep.get('last_receipt_id') or rep.get('id')
-                logger.info(f"[handle_shift_and_receipts] Trying Z report with receipt_id: {receipt_id}")
-                pdf_z = await get_receipt_pdf(kasa, receipt_id)
-                if pdf_z:
-                    logger.info(f"[handle_shift_and_receipts] Successfully retrieved Z report PDF for receipt_id: {receipt_id}")
-                    break
-            if pdf_z:
-                from aiogram.types import BufferedInputFile
-                z_file = BufferedInputFile(pdf_z, filename=f"z_report_{sid}.pdf")
-                await bot.send_document(user_id, z_file, caption=f"Z звіт для зміни ({sid})")
-            else:
-                logger.error(f"[handle_shift_and_receipts] Не вдалося отримати PDF для Z звіту (перевірте звіти для shift {sid}).")
-        else:
-            logger.error(f"[handle_shift_and_receipts] Звіт Z не знайдено для зміни ({sid}).")
+        from_date_str = closed_from.isoformat() if closed_from else datetime.now(timezone.utc).isoformat()
+        await send_shift_report(user_id, kasa, closed_sid, True, from_date_str)
     else:
         logger.info(f"[handle_shift_and_receipts] No change in shift status for kasa '{kasa_name}'")
 
+    receipts_ok = True
     if new_status == 'OPENED':
-        await fetch_new_receipts(user_id, kasa)
+        balance_sig = shift_balance_signature(shift_data)
+        if balance_sig is not None and balance_sig == kasa.get('balance_sig') and old_status == 'OPENED':
+            # Баланс зміни не змінився - нових чеків немає, пошук чеків не потрібен
+            logger.info(f"[handle_shift_and_receipts] Shift balance unchanged for kasa '{kasa_name}'")
+            observe_receipts(kasa, 0)
+        else:
+            try:
+                new_count = await fetch_new_receipts(user_id, kasa)
+            except (ApiUnavailableError, ReceiptsTruncatedError) as e:
+                logger.error(f"[handle_shift_and_receipts] Failed to fetch receipts for kasa '{kasa_name}': {e}")
+                new_count = None
+                receipts_ok = False
+            if new_count is not None:
+                kasa['balance_sig'] = balance_sig
+            observe_receipts(kasa, new_count or 0)
 
-    save_kasas_data(kasas_data)
+    persister.mark_dirty()
+    return receipts_ok
+
+async def send_shift_report(user_id, kasa, shift_id, is_z_report, from_date_str):
+    """
+    Надсилає PDF X- або Z-звіту зміни: перебирає знайдені звіти, доки
+    не вдасться отримати PDF.
+    """
+    kind = 'Z' if is_z_report else 'X'
+    to_date_str = datetime.now(timezone.utc).isoformat()
+    reports = await get_report_receipt_info(kasa['license_key'], kasa['cashier_token'], is_z_report=is_z_report,
+                                            shift_id=shift_id, from_date=from_date_str, to_date=to_date_str)
+    if not reports:
+        logger.error(f"[handle_shift_and_receipts] Звіт {kind} не знайдено для зміни ({shift_id}).")
+        return
+    for rep in reports:
+        receipt_id = rep.get('last_receipt_id') or rep.get('id')
+        logger.info(f"[handle_shift_and_receipts] Trying {kind} report with receipt_id: {receipt_id}")
+        sent = await send_pdf_document(
+            user_id, kasa, receipt_id,
+            filename=f"{kind.lower()}_report_{shift_id}.pdf",
+            caption=f"{kind} звіт для зміни ({shift_id})"
+        )
+        if sent:
+            logger.info(f"[handle_shift_and_receipts] Successfully sent {kind} report PDF for receipt_id: {receipt_id}",
+                        extra=UNSAMPLED)
+            return
+    logger.error(f"[handle_shift_and_receipts] Не вдалося отримати PDF для {kind} звіту (перевірте звіти для shift {shift_id}).")
+
+async def fetch_pdf_cached(kasa, receipt_id, strict=False):
+    pdf = await pdf_cache.get(receipt_id)
+    if pdf is not None:
+        metrics.PDF_FETCHES.inc(source='cache')
+        return pdf
+    pdf = await get_receipt_pdf(kasa, receipt_id, strict)
+    metrics.PDF_FETCHES.inc(source='api' if pdf else 'missing')
+    if pdf:
+        await pdf_cache.put(receipt_id, pdf)
+    return pdf
+
+def notify(user_id, text, priority=PRIORITY_SHIFT):
+    """Ставить текстове повідомлення в чергу відправки (опитування не чекає на Telegram)."""
+    return delivery.enqueue(make_item(user_id, text), priority)
+
+async def resolve_pdf(kasa, receipt_id, strict=False):
+    """
+    Повертає (file_id, pdf): file_id, якщо документ уже надсилався в Telegram,
+    інакше байти PDF з дискового кешу або API (None, якщо PDF недоступний).
+    strict - див. get_receipt_pdf.
+    """
+    file_id = await pdf_cache.get_file_id(receipt_id)
+    if file_id:
+        metrics.PDF_FETCHES.inc(source='file_id')
+        return file_id, None
+    return None, await fetch_pdf_cached(kasa, receipt_id, strict)
+
+def enqueue_pdf(user_id, receipt_id, file_id, pdf, filename, caption, priority):
+    if not file_id and not pdf:
+        return False
+    return delivery.enqueue(
+        make_item(user_id, caption, document=pdf, file_id=file_id, filename=filename, pdf_key=receipt_id),
+        priority
+    )
+
+async def send_pdf_document(user_id, kasa, receipt_id, filename, caption, priority=PRIORITY_SHIFT):
+    """
+    Ставить у чергу відправки PDF чеку чи звіту (див. resolve_pdf).
+    Повертає False, якщо PDF недоступний.
+    """
+    file_id, pdf = await resolve_pdf(kasa, receipt_id)
+    return enqueue_pdf(user_id, receipt_id, file_id, pdf, filename, caption, priority)
 
 async def fetch_new_receipts(user_id, kasa):
-    from config.settings import DEBUG_RECEIPT_INFO
+    """
+    Надсилає нові чеки зміни. Повертає кількість знайдених нових чеків
+    (використовується для адаптивного інтервалу опитування) або None,
+    якщо не всі чеки вдалося обробити (решта повториться в наступному
+    циклі). Збій API - ReceiptsTruncatedError (пошук чеків) або
+    ApiUnavailableError (деталі чи PDF чека); оброблені до збою чеки
+    вже враховані курсором.
+    """
+    from config.settings import DEBUG_RECEIPT_INFO, RECEIPT_SYNC_MODE, SHORT_RECEIPT_OPTIMIZATION
     if not kasa.get('shift_id'):
-        return
+        return 0
+    if RECEIPT_SYNC_MODE == 'incremental':
+        # Перша мала сторінка інкрементального пошуку сама є коротким запитом:
+        # окрема перевірка limit=1 лише додала б ще один запит
+        return await fetch_new_receipts_incremental(user_id, kasa)
+    if SHORT_RECEIPT_OPTIMIZATION and not await receipts_changed(kasa):
+        return 0
 
     lic = kasa['license_key']
     token = kasa['cashier_token']
@@ -255,138 +427,466 @@ async def fetch_new_receipts(user_id, kasa):
     if kasa.get('last_receipt_datetime') is None:
         far_past = datetime(2023, 1, 1, tzinfo=timezone.utc)
         now_utc = datetime.now(timezone.utc)
-        all_receipts = await get_recent_receipts(lic, token, sid, far_past, now_utc)
-        valid_receipts = []
-        for r in all_receipts:
-            service_out = str(r.get('service_out', '0')).strip()
-            if DEBUG_RECEIPT_INFO:
-                logger.info(f"[Init] Receipt {r.get('id')} info: service_out={service_out}, total_sum={r.get('total_sum')}, payments={r.get('payments')}")
-            # Ігноруємо чеки виводу (service_out відмінне від "0")
-            if service_out == "0":
-                valid_receipts.append(r)
-            else:
-                logger.info(f"[Init] Ignoring receipt {r.get('id')} because service_out={service_out}")
-        if valid_receipts:
-            def best_time(r):
-                return r.get('modified_at') or r.get('created_at')
-            valid_receipts.sort(key=lambda x: (best_time(x), x.get('id')))
-            last_rc = valid_receipts[-1]
-            best_ts = best_time(last_rc)
-            if best_ts:
-                kasa['last_receipt_datetime'] = dateutil.parser.isoparse(best_ts)
-                kasa['last_receipt_id'] = last_rc.get('id')
-        save_kasas_data(kasas_data)
-        return
+        newest = None
+        try:
+            async with iter_receipts(lic, token, sid, far_past, now_utc) as pages:
+                async for page in pages:
+                    # Сторінка пишеться в журнал, поки наступна завантажується
+                    await ledger.add_many(sid, lic, page)
+                    for r in page:
+                        if DEBUG_RECEIPT_INFO:
+                            logger.info(f"[Init] Receipt {r.id} info: service_out={r.service_out}, total_sum={r.total}, payments={r.payments}")
+                        # Ігноруємо чеки виводу (service_out відмінне від 0)
+                        if r.service_out != 0:
+                            logger.info(f"[Init] Ignoring receipt {r.id} because service_out={r.service_out}")
+                            continue
+                        if r.best_us is not None and r.id and (newest is None or receipt_sort_key(r) > receipt_sort_key(newest)):
+                            newest = r
+        except ReceiptsTruncatedError as e:
+            logger.error(f"[Init] Receipt search failed on '{k_name}', cursor not set: {e}")
+            raise
+        if newest is not None:
+            set_receipt_cursor(kasa, newest)
+        # Чеки до курсора вже в журналі - з них і підсумки зміни
+        await seed_shift_totals(kasa, sid)
+        persister.mark_dirty()
+        return 0
 
-    # Обробка нових чеків (якщо вже був встановлений last_receipt_datetime)
+    # Обробка нових чеків (якщо вже був встановлений last_receipt_datetime).
+    # Сторінки йдуть від найстаріших: кожна обробляється і надсилається, поки
+    # завантажується наступна; курсор просувається лише за надісланими чеками.
     from_dt = kasa['last_receipt_datetime']
     if isinstance(from_dt, str):
         from_dt = dateutil.parser.isoparse(from_dt)
     to_dt = datetime.now(timezone.utc)
-    receipts = await get_recent_receipts(lic, token, sid, from_dt, to_dt)
+    last_us = datetime_to_us(from_dt)
+    last_id = kasa.get('last_receipt_id')
+    totals = await current_shift_totals(kasa, sid)
+    sent = 0
+    try:
+        async with iter_receipts(lic, token, sid, from_dt, to_dt) as pages:
+            async for page in pages:
+                await ledger.add_many(sid, lic, page)
+                page = sorted((r for r in page if r.best_us is not None and r.id), key=receipt_sort_key)
+                page = [r for r in page if r.best_us > last_us or (r.best_us == last_us and r.id != last_id)]
+                done, ok = await process_receipts(user_id, kasa, page, totals)
+                sent += done
+                if not ok:
+                    # Чек, що не вдався, і решту сторінок повторить наступний цикл
+                    persister.mark_dirty()
+                    return None
+    except ReceiptsTruncatedError as e:
+        # Оброблені сторінки вже враховані курсором, решту знайде наступний цикл
+        logger.error(f"[Fetch] Receipt search truncated on '{k_name}' after {e.received} receipts: {e}")
+        raise
+
+    if sent:
+        logger.info(f"[Fetch] Fetched {sent} new receipts on '{k_name}'")
+    else:
+        logger.info(f"[Fetch] No new receipts found on '{k_name}'")
 
-    def best_time(r):
-        return r.get('modified_at') or r.get('created_at')
-    receipts.sort(key=lambda x: (best_time(x), x.get('id')))
-    last_dt = from_dt
+    persister.mark_dirty()
+    return sent
+
+def shift_balance_signature(shift_data):
+    """
+    Відбиток балансу зміни з відповіді GET /shifts. Будь-який чек (продаж,
+    повернення, службове внесення/видача) змінює баланс, тож незмінний
+    відбиток означає, що нових чеків немає. None, якщо API не повернуло balance.
+    """
+    balance = (shift_data or {}).get('balance')
+    if not balance:
+        return None
+    return json.dumps(balance, sort_keys=True)
+
+async def receipts_changed(kasa):
+    """
+    Короткий запит (SHORT_RECEIPT_OPTIMIZATION): лише найновіший чек зміни
+    (limit=1, за спаданням). False, якщо він збігається з last_receipt_id,
+    тобто нових чеків немає і повну синхронізацію можна пропустити.
+    При помилці API чи без курсора повертає True.
+    """
     last_id = kasa.get('last_receipt_id')
+    if not last_id or kasa.get('last_receipt_datetime') is None:
+        return True
+    page = await get_receipts_page(kasa['license_key'], kasa['cashier_token'], kasa['shift_id'], limit=1)
+    if page is None:
+        return True
+    if not page or page[0].id == last_id:
+        logger.debug(f"[Fetch] Short probe: no new receipts on '{kasa.get('kasa_name', 'N/A')}'")
+        return False
+    return True
+
+def receipt_sort_key(r):
+    return r.best_us, r.id
+
+def set_receipt_cursor(kasa, r):
+    if r.best_us is not None:
+        kasa['last_receipt_datetime'] = us_to_datetime(r.best_us)
+    kasa['last_receipt_id'] = r.id
+
+async def collect_new_receipts(kasa):
+    """
+    Інкрементальний пошук нових чеків: сторінки від найновіших чеків зміни
+    до курсора (last_receipt_id / last_receipt_datetime). Спершу одна мала
+    сторінка; повна пагінація - лише якщо курсор на ній не знайдено (розрив),
+    тоді наступна сторінка завантажується, поки переглядається поточна.
+    Повертає нові чеки за зростанням часу; при помилці API -
+    ReceiptsTruncatedError.
+    """
+    from config.settings import RECEIPT_SYNC_PAGE_SIZE, RECEIPT_SYNC_FULL_PAGE_SIZE
+    lic = kasa['license_key']
+    token = kasa['cashier_token']
+    sid = kasa['shift_id']
+    last_id = kasa.get('last_receipt_id')
+    last_us = datetime_to_us(kasa.get('last_receipt_datetime'))
+
+    seen = set()
+    found = []
+    async with iter_receipts(lic, token, sid, desc=True, page_size=RECEIPT_SYNC_FULL_PAGE_SIZE,
+                             first_page_size=RECEIPT_SYNC_PAGE_SIZE) as pages:
+        async for page in pages:
+            for r in page:
+                rid = r.id
+                t_us = r.best_us
+                if not rid or t_us is None or rid in seen:
+                    continue
+                if rid == last_id:
+                    return found[::-1]
+                if last_us is not None and t_us < last_us:
+                    return found[::-1]
+                seen.add(rid)
+                found.append(r)
+            if pages.pages == 1 and len(page) == RECEIPT_SYNC_PAGE_SIZE:
+                logger.info(f"[Fetch] Cursor not in first page for '{kasa.get('kasa_name', 'N/A')}', widening to full pagination")
+    return found[::-1]
+
+async def fetch_new_receipts_incremental(user_id, kasa):
+    k_name = kasa.get('kasa_name', 'N/A')
+
+    # При першому запуску лише ставимо курсор на найновіший чек зміни,
+    # а чеки до нього враховуємо в підсумках зміни
+    if kasa.get('last_receipt_datetime') is None:
+        try:
+            newest = await load_shift_into_ledger(kasa, kasa['shift_id'])
+        except ReceiptsTruncatedError as e:
+            logger.error(f"[Init] Receipt search failed on '{k_name}', cursor not set: {e}")
+            raise
+        if newest is not None:
+            set_receipt_cursor(kasa, newest)
+            logger.info(f"[Init] Receipt cursor for '{k_name}' set to {kasa['last_receipt_id']}", extra=UNSAMPLED)
+        await seed_shift_totals(kasa, kasa['shift_id'])
+        persister.mark_dirty()
+        return 0
+
+    try:
+        receipts = await collect_new_receipts(kasa)
+    except ReceiptsTruncatedError as e:
+        logger.error(f"[Fetch] Receipt search failed on '{k_name}', cursor kept: {e}")
+        raise
+    await ledger.add_many(kasa['shift_id'], kasa['license_key'], receipts)
+
+    totals = await current_shift_totals(kasa, kasa['shift_id'])
+    sent, ok = await process_receipts(user_id, kasa, receipts, totals)
+    if sent:
+        logger.info(f"[Fetch] Fetched {sent} new receipts on '{k_name}'")
+    else:
+        logger.info(f"[Fetch] No new receipts found on '{k_name}'")
+
+    persister.mark_dirty()
+    return sent if ok else None
+
+async def load_shift_into_ledger(kasa, sid):
+    """
+    Усі чеки зміни з API - у журнал. Повертає найновіший чек зміни (None,
+    якщо чеків немає); ReceiptsTruncatedError, якщо частину сторінок не отримано.
+    """
+    from config.settings import RECEIPT_SYNC_FULL_PAGE_SIZE
+    newest = None
+    async with iter_receipts(kasa['license_key'], kasa['cashier_token'], sid,
+                             page_size=RECEIPT_SYNC_FULL_PAGE_SIZE) as pages:
+        async for page in pages:
+            await ledger.add_many(sid, kasa['license_key'], page)
+            for r in page:
+                if r.best_us is not None and r.id and (newest is None or receipt_sort_key(r) > receipt_sort_key(newest)):
+                    newest = r
+    return newest
+
+async def seed_shift_totals(kasa, sid):
+    """
+    Підсумки зміни з журналу: чеки до курсора включно. Чеки після курсора
+    додаються як нові (apply_receipt), тож не враховуються двічі.
+    """
+    last_id = kasa.get('last_receipt_id')
+    last_us = datetime_to_us(kasa.get('last_receipt_datetime'))
+    receipts = await ledger.receipts(sid) if last_id and last_us is not None else []
+    kasa['shift_totals'] = totals_from_receipts(
+        r for r in receipts if r.best_us is not None and (r.best_us < last_us or r.id == last_id)
+    )
+    kasa['shift_totals_id'] = sid
+    return kasa['shift_totals']
+
+async def current_shift_totals(kasa, sid):
+    """
+    Підсумки зміни, до яких додаються нові чеки. Якщо їх для цієї зміни ще
+    немає, а курсор уже стоїть на чеку (бот запущено чи касу додано посеред
+    зміни), журнал доповнюється чеками зміни з API і підсумки рахуються з
+    чеків до курсора. ReceiptsTruncatedError, якщо чеки з API отримати не вдалося.
+    """
+    if kasa.get('shift_totals_id') == sid and kasa.get('shift_totals'):
+        return kasa['shift_totals']
+    if not kasa.get('last_receipt_id'):
+        # Нова зміна: чеків до курсора немає
+        return kasa_totals(kasa, sid)
+    logger.info(f"[Fetch] Seeding shift totals for '{kasa.get('kasa_name', 'N/A')}' from shift {sid}", extra=UNSAMPLED)
+    try:
+        await load_shift_into_ledger(kasa, sid)
+    except ReceiptsTruncatedError as e:
+        logger.error(f"[Fetch] Shift totals not seeded for '{kasa.get('kasa_name', 'N/A')}': {e}")
+        raise
+    return await seed_shift_totals(kasa, sid)
+
+async def process_receipts(user_id, kasa, receipts, totals):
+    """
+    Нові чеки (за зростанням часу): надсилання, підсумки зміни і курсор.
+    Підсумки й курсор просуваються лише до першого чека, який не вдалося
+    підготувати чи поставити в чергу, тож він і наступні чеки повторяться
+    в наступному циклі. Повертає (кількість надісланих чеків, чи оброблено всі).
+    ApiUnavailableError з send_receipts прокидається: курсор тоді стоїть
+    на останньому обробленому чеку.
+    """
+    from config.settings import DEBUG_RECEIPT_INFO
     new_list = []
+    pending = iter(receipts)
+
+    def advance(upto=None, before=None):
+        # Підсумки й курсор просуваються разом із доставкою: до чека upto
+        # включно або до before (не включно). Курсор - найновіший оброблений
+        # чек, включно з проігнорованими, інакше короткий запит бачив би
+        # "новий" чек на кожному циклі
+        for r in pending:
+            if r is before:
+                return
+            apply_receipt(totals, r)
+            set_receipt_cursor(kasa, r)
+            if r is upto:
+                return
+
     for r in receipts:
-        rid = r.get('id')
-        t_str = best_time(r)
-        if not t_str or not rid:
-            continue
-        t_parsed = dateutil.parser.isoparse(t_str)
-        service_out = str(r.get('service_out', '0')).strip()
         if DEBUG_RECEIPT_INFO:
-            logger.info(f"[Fetch] Processing receipt {rid}: service_out={service_out}, total_sum={r.get('total_sum')}, payments={r.get('payments')}")
-        # Якщо значення не рівне "0" – це чек виводу, ігноруємо його
-        if service_out != "0":
-            logger.info(f"[Fetch] Ignoring receipt {rid} because service_out={service_out}")
+            logger.info(f"[Fetch] Processing receipt {r.id}: service_out={r.service_out}, total_sum={r.total}, payments={r.payments}")
+        # Якщо значення не рівне 0 – це чек виводу, ігноруємо його
+        if r.service_out != 0:
+            logger.info(f"[Fetch] Ignoring receipt {r.id} because service_out={r.service_out}")
             continue
-        if t_parsed > last_dt or (t_parsed == last_dt and rid != last_id):
-            new_list.append(r)
-
-    if new_list:
-        for item in new_list:
-            await send_one_receipt(user_id, item, kasa)  # Виклик передаємо як позиційний аргумент
-        last_obj = new_list[-1]
-        last_t = best_time(last_obj)
-        if last_t:
-            kasa['last_receipt_datetime'] = dateutil.parser.isoparse(last_t)
-        kasa['last_receipt_id'] = last_obj['id']
-        logger.info(f"[Fetch] Fetched {len(new_list)} new receipts on '{k_name}'")
-    else:
-        logger.info(f"[Fetch] No new receipts found on '{k_name}'")
+        new_list.append(r)
+
+    done = await send_receipts(user_id, new_list, kasa, advance)
+    ok = done == len(new_list)
+    advance(before=None if ok else new_list[done])
+    return done, ok
 
-    save_kasas_data(kasas_data)
+class ReceiptNotReadyError(Exception):
+    """Деталі чи PDF чека поки недоступні - чек повториться в наступному циклі."""
+
+def last_receipt_attempt(kasa, receipt_id):
+    from config.settings import RECEIPT_MAX_ATTEMPTS
+    failed = kasa.get('failed_receipt')
+    return failed is not None and failed[0] == receipt_id and failed[1] + 1 >= RECEIPT_MAX_ATTEMPTS
+
+async def prepare_receipt(rc, kasa):
+    """
+    Етап завантаження: повна інформація про чек і PDF (або file_id).
+    Повертає словник для deliver_receipt або None, якщо чек пропускається.
+    Якщо деталі чи PDF недоступні, кидає ReceiptNotReadyError; після
+    RECEIPT_MAX_ATTEMPTS спроб чек без деталей пропускається, а без PDF
+    надсилається текстом. Збій API (мережа, 429, 5xx) - ApiUnavailableError:
+    він не рахується спробою чека. Не змінює стан каси, тож може
+    виконуватись паралельно для кількох чеків.
+    """
+    from config.settings import DEBUG_RECEIPT_INFO, DEBUG_RECEIPT_DETAILS, SHORT_RECEIPT_OPTIMIZATION
+    receipt_id = rc.id or '???'
+    last_attempt = last_receipt_attempt(kasa, receipt_id)
+
+    # Тип чека вже є у відповіді receipts/search - службові чеки
+    # відкидаємо без запиту розширених даних
+    if SHORT_RECEIPT_OPTIMIZATION and rc.is_service:
+        logger.info(f"[SendOne] Ignoring receipt {receipt_id} due to type {rc.type.value}.")
+        return None
 
-async def send_one_receipt(user_id, rc, kasa):
-    from config.settings import DEBUG_RECEIPT_INFO, DEBUG_RECEIPT_DETAILS
-    receipt_id = rc.get('id', '???')
-    
     # Отримання повної інформації про чек через API
-    from services.checkbox_api import get_receipt_info, get_receipt_pdf
-    full_receipt_info = await get_receipt_info(receipt_id, kasa['license_key'], kasa['cashier_token'])
+    from services.checkbox_api import get_receipt_info
+    full_receipt_info = await get_receipt_info(receipt_id, kasa['license_key'], kasa['cashier_token'], strict=True)
     if full_receipt_info is None:
+        if not last_attempt:
+            raise ReceiptNotReadyError(f"No details for receipt {receipt_id}")
         logger.error(f"[SendOne] Failed to retrieve full info for receipt {receipt_id}, skipping.")
-        return
+        return None
 
     # Перевірка типу чека: ігноруємо, якщо тип SERVICE_OUT або SERVICE_IN
     receipt_type = full_receipt_info.get('type', '').upper()
     if receipt_type in ["SERVICE_OUT", "SERVICE_IN"]:
         logger.info(f"[SendOne] Ignoring receipt {receipt_id} due to type {receipt_type}.")
-        return
+        return None
 
     if DEBUG_RECEIPT_DETAILS:
         logger.info(f"[SendOne] Full receipt info for {receipt_id}: {full_receipt_info}")
 
     # Додатковий вивід базових деталей, якщо увімкнено DEBUG_RECEIPT_INFO
-    receipt_details_partial = (
-        f"ID: {rc.get('id')}, "
-        f"service_out: {rc.get('service_out')}, "
-        f"total_sum: {rc.get('total_sum')}, "
-        f"payments: {rc.get('payments')}"
-    )
     if DEBUG_RECEIPT_INFO:
-        logger.info(f"[SendOne] Processing receipt: {receipt_details_partial}")
-
-    # Стандартна обробка чека
-    kasa['receipt_counter'] = kasa.get('receipt_counter', 0) + 1
-    txt = format_receipt_info(rc, kasa.get('kasa_name', 'N/A'), kasa['receipt_counter'])
-    pdf_bin = await get_receipt_pdf(kasa, receipt_id)
-    if pdf_bin:
-        from aiogram.types import BufferedInputFile
-        fobj = BufferedInputFile(pdf_bin, filename=f"receipt_{receipt_id}.pdf")
-        await bot.send_document(user_id, fobj, caption=txt)
+        logger.info(f"[SendOne] Processing receipt: ID: {rc.id}, service_out: {rc.service_out}, "
+                    f"total_sum: {rc.total}, payments: {rc.payments}")
+
+    file_id, pdf = await resolve_pdf(kasa, receipt_id, strict=True)
+    if not file_id and not pdf and not last_attempt:
+        raise ReceiptNotReadyError(f"No PDF for receipt {receipt_id}")
+    return {'file_id': file_id, 'pdf': pdf}
+
+def receipt_checkpoint(kasa):
+    """
+    Стан каси перед сповіщенням про чек. У режимі шардування фронт повертає
+    його воркеру, якщо черга відправки не прийняла сповіщення (див.
+    rollback_receipts); epoch відрізняє сповіщення, надіслані до відкату.
+    """
+    return {
+        'license_key': kasa['license_key'],
+        'shift_id': kasa.get('shift_id'),
+        'epoch': kasa.get('delivery_epoch', 0),
+        'last_receipt_datetime': kasa.get('last_receipt_datetime'),
+        'last_receipt_id': kasa.get('last_receipt_id'),
+        'receipt_counter': kasa.get('receipt_counter', 0)
+    }
+
+def note_rejected_receipts(kasa, checkpoint):
+    """
+    Черга фронту не прийняла сповіщення про чек: відкат виконується перед
+    наступним циклом каси (rollback_receipts), не посеред поточного.
+    Checkpoint, надісланий до попереднього відкату, ігнорується.
+    """
+    if checkpoint['epoch'] == kasa.get('delivery_epoch', 0):
+        kasa['delivery_rollback'] = checkpoint
+
+def rollback_receipts(kasa):
+    """
+    Повертає курсор і лічильник каси до checkpoint з note_rejected_receipts:
+    чек, сповіщення про який не прийняла черга, і наступні за ним
+    повторяться в цьому циклі. Підсумки зміни перераховуються з журналу до
+    курсора (current_shift_totals). Чеки іншої зміни не відкочуються.
+    """
+    checkpoint = kasa.pop('delivery_rollback', None)
+    if checkpoint is None:
+        return
+    kasa['delivery_epoch'] = checkpoint['epoch'] + 1
+    if checkpoint['shift_id'] != kasa.get('shift_id'):
+        logger.warning(f"[SendOne] Rejected receipts of '{kasa.get('kasa_name', 'N/A')}' belong to "
+                       f"a previous shift, not rolling back")
+        return
+    kasa['last_receipt_datetime'] = checkpoint['last_receipt_datetime']
+    kasa['last_receipt_id'] = checkpoint['last_receipt_id']
+    kasa['receipt_counter'] = checkpoint['receipt_counter']
+    kasa.pop('shift_totals_id', None)
+    # Баланс зміни міг не змінитися, а пошук чеків усе одно потрібен
+    kasa.pop('balance_sig', None)
+    logger.warning(f"[SendOne] Delivery queue rejected receipts of '{kasa.get('kasa_name', 'N/A')}', "
+                   f"rolled back to receipt {checkpoint['last_receipt_id']}")
+
+def deliver_receipt(user_id, rc, kasa, prepared):
+    """
+    Етап доставки: нумерація та постановка в чергу відправки.
+    Викликається строго в порядку чеків, тож receipt_counter детермінований.
+    Повертає False, якщо черга відправки переповнена.
+    """
+    receipt_id = rc.id or '???'
+    counter = kasa.get('receipt_counter', 0) + 1
+    txt = format_receipt_info(rc, kasa.get('kasa_name', 'N/A'), counter)
+    checkpoint = receipt_checkpoint(kasa)
+    if prepared['file_id'] or prepared['pdf']:
+        item = make_item(user_id, txt, document=prepared['pdf'], file_id=prepared['file_id'],
+                         filename=f"receipt_{receipt_id}.pdf", pdf_key=receipt_id, checkpoint=checkpoint)
     else:
-        await bot.send_message(user_id, txt)
+        item = make_item(user_id, txt, checkpoint=checkpoint)
+    sent = delivery.enqueue(item, PRIORITY_RECEIPT)
+    if sent:
+        kasa['receipt_counter'] = counter
+        metrics.RECEIPTS_PROCESSED.inc()
+    return sent
+
+async def send_receipts(user_id, receipts, kasa, on_done=None):
+    """
+    Конвеєрна обробка нових чеків: деталі та PDF завантажуються
+    паралельно для ковзного вікна з RECEIPT_PIPELINE_CONCURRENCY чеків,
+    а доставка йде строго в порядку чеків. Зупиняється на першому чеку,
+    який не вдалося підготувати чи поставити в чергу; повертає кількість
+    оброблених чеків від початку списку. on_done(чек) викликається після
+    кожного обробленого чека. ApiUnavailableError з prepare_receipt
+    прокидається без зміни failed_receipt.
+    """
+    from config.settings import RECEIPT_PIPELINE_CONCURRENCY
+    pending = iter(receipts)
+    window = deque()
+
+    def fill():
+        while len(window) < max(1, RECEIPT_PIPELINE_CONCURRENCY):
+            rc = next(pending, None)
+            if rc is None:
+                return
+            window.append((rc, asyncio.ensure_future(prepare_receipt(rc, kasa))))
+
+    fill()
+    done = 0
+    try:
+        while window:
+            rc, task = window.popleft()
+            try:
+                prepared = await task
+            except ReceiptNotReadyError as e:
+                failed = kasa.get('failed_receipt')
+                attempts = failed[1] + 1 if failed and failed[0] == rc.id else 1
+                kasa['failed_receipt'] = (rc.id, attempts)
+                logger.warning(f"[SendOne] {e} (attempt {attempts}), retrying next cycle")
+                return done
+            fill()
+            if prepared is not None and not deliver_receipt(user_id, rc, kasa, prepared):
+                logger.warning(f"[SendOne] Delivery queue full, receipt {rc.id} will be retried next cycle")
+                return done
+            if kasa.get('failed_receipt', (None,))[0] == rc.id:
+                kasa.pop('failed_receipt')
+            done += 1
+            if on_done is not None:
+                on_done(rc)
+    finally:
+        for _, task in window:
+            task.cancel()
+    return done
 
 async def send_withdrawal_receipt(user_id, receipt, kasa):
     # Функція залишається, але її виклик більше не відбувається
     kasa_name = kasa.get('kasa_name', 'N/A')
-    service_out_amount = receipt.get('service_out', 0) / 100
+    service_out_amount = receipt.service_out / 100
     msg = (
         f"💵 <b>Виведення грошей</b>\n"
         f"Каса: {kasa_name}\n"
         f"Сума: {service_out_amount:.2f} грн\n"
-        f"Час: {receipt.get('created_at', 'N/A')}"
+        f"Час: {us_to_iso(receipt.created_us) or 'N/A'}"
     )
-    await bot.send_message(user_id, msg)
+    notify(user_id, msg, PRIORITY_RECEIPT)
     logger.info(f"Sent withdrawal receipt for kasa '{kasa_name}' (amount={service_out_amount:.2f} грн)")
 
-async def send_shift_summary(user_id, kasa):
+async def load_shift_receipts(kasa, sid, expected):
     """
-    Формуємо звіт за зміною, обчислюючи суму продажів і кількість чеків,
-    ігноруючи чеки з типом SERVICE_OUT та SERVICE_IN.
+    Чеки зміни з локального журналу. До API звертаємось лише тоді, коли
+    кількість чеків у журналі не збігається з expected - кількістю чеків
+    за даними зміни в API (або expected невідоме, а журнал порожній).
+    Повертає (чеки, complete); complete False - частину сторінок з API не отримано.
     """
     lic = kasa['license_key']
     token = kasa['cashier_token']
-    sid = kasa.get('shift_id')
-    if not sid:
-        await bot.send_message(user_id, "Немає активної зміни для формування звіту.")
-        return
+    count = await ledger.count(sid, exclude_types=SERVICE_TYPES)
+    if expected == count or (expected is None and count):
+        logger.info(f"[Report] Using ledger for shift {sid}: {count} receipts")
+        return await ledger.receipts(sid), True
 
+    logger.info(f"[Report] Ledger has {count} receipts for shift {sid}, API reports {expected}; reconciling")
     # Визначаємо початковий час зміни (якщо встановлено, інакше використовується last_receipt_datetime)
     if 'shift_start_datetime' in kasa and kasa['shift_start_datetime']:
         start_time = kasa['shift_start_datetime']
@@ -398,56 +898,223 @@ async def send_shift_summary(user_id, kasa):
         start_time = datetime.now(timezone.utc)
     end_time = datetime.now(timezone.utc)
 
-    receipts = await get_recent_receipts(lic, token, sid, start_time, end_time)
-    filtered_receipts = []
-    for r in receipts:
-        r_type = str(r.get('type', '')).upper()
-        if r_type in ("SERVICE_OUT", "SERVICE_IN"):
-            logger.info(f"[Report] Ignoring receipt {r.get('id')} with type {r_type}")
-            continue
-        filtered_receipts.append(r)
-
-    if filtered_receipts:
-        cash_total = 0
-        card_total = 0
-        overall_total = 0
-        for r in filtered_receipts:
-            receipt_total = r.get('total_sum', 0)
-            overall_total += receipt_total
-            payments = r.get('payments', [])
-            sum_payments = sum(p.get('value', 0) for p in payments)
-            if sum_payments == 0:
-                if payments:
-                    pay_type = payments[0].get('type', '').upper()
-                    if pay_type == 'CASH':
-                        cash_total += receipt_total
-                    elif pay_type in ('CARD', 'CASHLESS'):
-                        card_total += receipt_total
-                continue
-            for p in payments:
-                pay_type = p.get('type', '').upper()
-                allocated = (p.get('value', 0) / sum_payments) * receipt_total
-                if pay_type == 'CASH':
-                    cash_total += allocated
-                elif pay_type in ('CARD', 'CASHLESS'):
-                    card_total += allocated
-
-        overall_total /= 100.0
-        cash_total /= 100.0
-        card_total /= 100.0
-
-        report_text = (f"Звіт за зміною на касі '{kasa.get('kasa_name', 'N/A')}':\n"
-                       f"Кількість чеків: {len(filtered_receipts)}\n"
-                       f"Сума продаж (готівка): {cash_total:.2f} грн\n"
-                       f"Сума продаж (картки): {card_total:.2f} грн\n"
-                       f"Загальна сума продаж: {overall_total:.2f} грн")
-        await bot.send_message(user_id, report_text)
+    # Від найновіших: у журналі зазвичай бракує останніх чеків, тож, щойно
+    # кількість збіглася з API, решта сторінок не потрібна
+    complete = True
+    try:
+        async with iter_receipts(lic, token, sid, start_time, end_time, desc=True) as pages:
+            async for page in pages:
+                await ledger.add_many(sid, lic, page)
+                if expected is not None and await ledger.count(sid, exclude_types=SERVICE_TYPES) >= expected:
+                    break
+    except ReceiptsTruncatedError as e:
+        logger.error(f"[Report] Receipts of shift {sid} incomplete: {e}")
+        complete = False
+    return await ledger.receipts(sid), complete
+
+async def send_shift_summary(user_id, kasa):
+    """
+    Формуємо звіт за зміною з поточних підсумків каси (kasa['shift_totals']),
+    що оновлюються з кожним чеком. Якщо кількість чеків не збігається з
+    підсумками зміни в API, підсумки перераховуються з локального журналу
+    (див. load_shift_receipts).
+    """
+    sid = kasa.get('shift_id')
+    if not sid:
+        notify(user_id, "Немає активної зміни для формування звіту.")
+        return
+
+    totals = kasa.get('shift_totals') if kasa.get('shift_totals_id') == sid else None
+    expected = shift_receipts_count(await get_shift_info(kasa['license_key'], kasa['cashier_token'], sid))
+    complete = True
+    if totals is None or (expected is not None and expected != totals['count']):
+        receipts, complete = await load_shift_receipts(kasa, sid, expected)
+        totals = totals_from_receipts(receipts)
+        if complete:
+            kasa['shift_totals'] = totals
+            kasa['shift_totals_id'] = sid
+
+    if totals['count']:
+        text = format_shift_totals(totals, kasa.get('kasa_name', 'N/A'))
+        if not complete:
+            text += "\n⚠️ Не всі чеки вдалося отримати з API, підсумки можуть бути неповними."
+        notify(user_id, text)
     else:
-        await bot.send_message(user_id, f"На касі '{kasa.get('kasa_name', 'N/A')}' немає чеків для звіту.")
+        notify(user_id, f"На касі '{kasa.get('kasa_name', 'N/A')}' немає чеків для звіту.")
+
+async def cmd_totals(message: types.Message):
+    """Підсумки відкритих змін "на зараз" - з локального стану, без запитів до API."""
+    user_id = str(message.from_user.id)
+    user_kasas = kasas_data.get(user_id, [])
+    if not user_kasas:
+        await message.answer("У вас ще немає доданих кас.")
+        return
+    parts = []
+    for idx, k in enumerate(user_kasas, start=1):
+        nm = k.get('kasa_name', f"Каса №{idx}")
+        sid = k.get('shift_id')
+        if not sid or k.get('last_polled_shift_status') != 'OPENED':
+            parts.append(f"На касі '{nm}' зміна закрита.")
+            continue
+        if k.get('shift_totals_id') != sid or not k.get('shift_totals'):
+            # Підсумки рахуються з чеків зміни в наступному циклі опитування
+            parts.append(f"Підсумки зміни на касі '{nm}' ще не пораховано, спробуйте трохи згодом.")
+            continue
+        parts.append(format_shift_totals(k['shift_totals'], nm, title="Підсумки зміни на зараз"))
+    await message.answer("\n\n".join(parts))
+
+PERIOD_USAGE = (
+    "Період: today, yesterday, week (за замовчуванням), month, дата або дві дати РРРР-ММ-ДД.\n"
+    "Номери кас - як у /list_kasas, без них - усі каси."
+)
+REPORT_USAGE = "Використання: /report [період] [номери кас]\n" + PERIOD_USAGE
+EXPORT_USAGE = "Використання: /export [період] [номери кас] [csv|jsonl]\n" + PERIOD_USAGE
+
+def parse_period_args(args, user_kasas):
+    """Аргументи /report і /export: період (services.reports.parse_period) і номери кас; ValueError для користувача."""
+    numbers = [int(a) for a in args if a.isdigit()]
+    from_day, to_day = parse_period([a for a in args if not a.isdigit()], datetime.now(KYIV_TZ).date())
+    for n in numbers:
+        if not 1 <= n <= len(user_kasas):
+            raise ValueError(f"Каси №{n} немає у вашому списку.")
+    return from_day, to_day, [user_kasas[n - 1] for n in dict.fromkeys(numbers)] or user_kasas
+
+async def cmd_report(message: types.Message):
+    """Звіт за період по касах користувача (services.reports): закриті зміни - з локального кешу."""
+    user_id = str(message.from_user.id)
+    user_kasas = kasas_data.get(user_id, [])
+    if not user_kasas:
+        await message.answer("У вас ще немає доданих кас.")
+        return
+    try:
+        from_day, to_day, selected = parse_period_args((message.text or '').split()[1:], user_kasas)
+    except ValueError as e:
+        await message.answer(f"{e}\n\n{REPORT_USAGE}")
+        return
+    await message.answer("Формую звіт...")
+    report = await build_report(ledger, selected, from_day, to_day)
+    for part in split_message(format_report(report)):
+        await message.answer(part)
+
+async def cmd_export(message: types.Message):
+    """
+    Чеки за період файлом (services.export): сторінки receipts/search пишуться
+    у тимчасовий файл одразу, після завершення файл надсилається документом.
+    """
+    user_id = str(message.from_user.id)
+    user_kasas = kasas_data.get(user_id, [])
+    if not user_kasas:
+        await message.answer("У вас ще немає доданих кас.")
+        return
+    args = (message.text or '').split()[1:]
+    fmt = next((a.lower() for a in args if a.lower() in EXPORT_FORMATS), 'csv')
+    try:
+        from_day, to_day, selected = parse_period_args(
+            [a for a in args if a.lower() not in EXPORT_FORMATS], user_kasas
+        )
+    except ValueError as e:
+        await message.answer(f"{e}\n\n{EXPORT_USAGE}")
+        return
+    if user_id in exports_running:
+        await message.answer("Експорт уже виконується, дочекайтеся файлу.")
+        return
+
+    exports_running.add(user_id)
+    filename = export_filename(from_day, to_day, fmt)
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    path = os.path.join(EXPORT_DIR, f"{user_id}_{filename}")
+    try:
+        await message.answer("Вивантажую чеки, це може зайняти кілька хвилин...")
+        from_us = local_midnight_us(from_day)
+        to_us = local_midnight_us(to_day + timedelta(days=1))
+        result = await export_receipts(selected, from_us, to_us, path, fmt)
+        if not result['receipts']:
+            await message.answer("За цей період чеків немає.")
+            return
+        size = os.path.getsize(path)
+        if size > EXPORT_MAX_BYTES:
+            await message.answer(f"Файл завеликий для Telegram ({size / 1024 / 1024:.1f} МБ). "
+                                 f"Оберіть коротший період або менше кас.")
+            return
+        caption = f"Чеків: {result['receipts']}"
+        if result['failed']:
+            caption += f"\n⚠️ Вивантажено не повністю: {', '.join(result['failed'])}"
+        await message.answer_document(FSInputFile(path, filename=filename), caption=caption)
+    finally:
+        exports_running.discard(user_id)
+        if os.path.exists(path):
+            os.remove(path)
+
+def find_kasa(user_id, license_key):
+    for k in kasas_data.get(user_id, []):
+        if k['license_key'] == license_key:
+            return k
+    return None
+
+def apply_shard_state(user_id, state):
+    """Стан каси після циклу опитування у воркері: оновлюємо локальну копію і зберігаємо."""
+    kasa = find_kasa(user_id, state.get('license_key'))
+    if kasa is None:
+        # Каси вже немає у фронта - воркер більше не опитує її
+        shards.remove(user_id, state.get('license_key'))
+        return
+    kasa.update({k: v for k, v in state.items() if k not in FRONT_FIELDS})
+    persister.mark_dirty()
+
+async def deliver_shard_item(item, priority):
+    """
+    Повідомлення з воркера. Дисковий кеш PDF і file_id веде лише фронт:
+    уже надісланий документ іде за file_id, новий PDF зберігається в кеші.
+    Повертає результат DeliveryQueue.enqueue (False - черга переповнена).
+    """
+    key = item['pdf_key']
+    if key and item['document']:
+        file_id = await pdf_cache.get_file_id(key)
+        if file_id:
+            item['file_id'], item['document'] = file_id, None
+        else:
+            await pdf_cache.put(key, item['document'])
+    return delivery.enqueue(item, priority)
+
+async def enable_sharding(count):
+    """
+    Переводить опитування кас у процеси-воркери (див. services.sharding).
+    Повторний виклик з іншою кількістю воркерів перерозподіляє каси.
+    """
+    global shards
+    if shards is not None:
+        await shards.resize(count)
+        return
+    shards = ShardSupervisor(find_kasa, deliver_shard_item, apply_shard_state, shards=count)
+
+def collect_metrics():
+    """Оновлює метрики зі стану кас і черги перед експортом /metrics."""
+    if delivery is not None:
+        metrics.DELIVERY_QUEUE_DEPTH.set(delivery.size)
+        metrics.DELIVERY_QUEUE_BYTES.set(delivery.bytes)
+    metrics.KASA_POLL_LAG.clear()
+    metrics.KASA_POLL_INTERVAL.clear()
+    metrics.API_BREAKER_OPEN.clear()
+    for kasas in list(kasas_data.values()):
+        for k in kasas:
+            # Назви кас можуть збігатися, тож ряд визначає псевдонім ключа ліцензії
+            labels = {'kasa': kasa_alias(k['license_key']), 'name': k.get('kasa_name', 'N/A')}
+            if 'poll_lag' in k:
+                metrics.KASA_POLL_LAG.set(k['poll_lag'], **labels)
+            if 'poll_interval' in k:
+                metrics.KASA_POLL_INTERVAL.set(k['poll_interval'], **labels)
+            for family, state in k.get('api_breakers', {}).items():
+                metrics.API_BREAKER_OPEN.set(1 if state == 'open' else 0.5, family=family, **labels)
 
 def register_start_handlers(dispatcher: Dispatcher, bot_instance: Bot):
-    global bot, dp
+    global bot, dp, delivery
     bot = bot_instance
     dp = dispatcher
+    delivery = DeliveryQueue(bot_instance, pdf_cache)
+    metrics.REGISTRY.add_collector(collect_metrics)
     dp.message.register(cmd_start, Command('start'))
-    dp.message.register(cmd_list_kasas, Command('list_kasas'))
\ No newline at end of file
+    dp.message.register(cmd_list_kasas, Command('list_kasas'))
+    dp.message.register(cmd_stats, Command('stats'))
+    dp.message.register(cmd_totals, Command('totals'))
+    dp.message.register(cmd_report, Command('report'))
+    dp.message.register(cmd_export, Command('export'))
\ No newline at end of file
@@ -3,19 +3,19 @@ import sys
 import asyncio
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
-from utils.storage import check_or_create_token_file, load_token
-from handlers.start import register_start_handlers
+from utils.storage import check_or_create_token_file, load_token, open_storage
+from services.checkbox_api import CheckboxClient, set_client
+from services.metrics import MetricsServer
+from services.api_trace import ApiRecorder
+from services.webhook import serve_webhook
+from config.settings import METRICS_ENABLED, API_RECORD_FILE, API_RECORD_KEEP_PDF, UPDATE_MODE, POLL_SHARDS
+from handlers.start import register_start_handlers, stop_background_polling, enable_sharding, load_state
 from handlers.add_kasa import register_add_kasa_handlers
 from handlers.general_commands import register_general_commands
 from utils.log_config import setup_logging
 
 # Ініціалізуємо логування
 setup_logging()
-
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-)
 logger = logging.getLogger(__name__)
 
 def main():
@@ -25,14 +25,37 @@ def main():
         default=DefaultBotProperties(parse_mode="HTML")
     )
     dp = Dispatcher()
+    # Сховище відкриває (і за потреби переносить kasas.json) лише цей процес
+    open_storage()
+    load_state()
     
     register_start_handlers(dp, bot)
     register_add_kasa_handlers(dp)
     register_general_commands(dp)
     
     async def runner():
-        await bot.delete_webhook(drop_pending_updates=True)
-        await dp.start_polling(bot)
+        if POLL_SHARDS > 1:
+            # Каси опитують процеси-воркери; цей процес - Telegram і збереження стану
+            await enable_sharding(POLL_SHARDS)
+        # Один пул з'єднань до Checkbox API на весь процес
+        recorder = ApiRecorder(API_RECORD_FILE, API_RECORD_KEEP_PDF) if API_RECORD_FILE else None
+        client = CheckboxClient(recorder=recorder)
+        set_client(client)
+        metrics_server = MetricsServer() if METRICS_ENABLED else None
+        if metrics_server:
+            await metrics_server.start()
+        try:
+            if UPDATE_MODE == 'webhook':
+                await serve_webhook(dp, bot)
+            else:
+                # Оновлення, що надійшли, поки працював webhook, не відкидаються
+                await bot.delete_webhook(drop_pending_updates=False)
+                await dp.start_polling(bot)
+        finally:
+            await stop_background_polling()
+            await client.close()
+            if metrics_server:
+                await metrics_server.stop()
     
     try:
         asyncio.run(runner())
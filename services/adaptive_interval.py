@@ -0,0 +1,74 @@
+# services/adaptive_interval.py
+import math
+import time
+from datetime import datetime
+from config.settings import (
+    ADAPTIVE_POLLING, POLL_INTERVAL_OPEN, POLL_INTERVAL_CLOSED,
+    POLL_INTERVAL_MIN, POLL_INTERVAL_MAX, POLL_INTERVAL_NIGHT, POLL_NIGHT_HOURS,
+    POLL_SHIFT_OPEN_BOOST, POLL_RATE_WINDOW, POLL_TARGET_RECEIPTS
+)
+from utils.receipt import KYIV_TZ
+
+
+def mark_shift_opened(kasa, now=None):
+    """Фіксує момент відкриття зміни: наступні POLL_SHIFT_OPEN_BOOST секунд опитуємо найчастіше."""
+    kasa['shift_opened_monotonic'] = now if now is not None else time.monotonic()
+
+
+def observe_receipts(kasa, new_receipts, now=None):
+    """
+    Оновлює ковзне середнє частоти надходження чеків (чеків/секунду).
+    Використовується експоненційне згладжування з вагою, що залежить від
+    часу між опитуваннями: вікно усереднення - POLL_RATE_WINDOW секунд.
+    """
+    now = now if now is not None else time.monotonic()
+    last = kasa.get('rate_observed_at')
+    kasa['rate_observed_at'] = now
+    if last is None:
+        return
+    elapsed = now - last
+    if elapsed <= 0:
+        return
+    instant = new_receipts / elapsed
+    alpha = 1 - math.exp(-elapsed / POLL_RATE_WINDOW)
+    rate = kasa.get('receipt_rate')
+    kasa['receipt_rate'] = instant if rate is None else rate + alpha * (instant - rate)
+
+
+def is_night(now_local=None):
+    hour = (now_local or datetime.now(KYIV_TZ)).hour
+    start, end = POLL_NIGHT_HOURS
+    if start <= end:
+        return start <= hour < end
+    return hour >= start or hour < end
+
+
+def compute_interval(kasa, now=None, now_local=None):
+    """
+    Інтервал до наступного опитування каси (у секундах).
+
+    - зміна закрита: POLL_INTERVAL_CLOSED, вночі - POLL_INTERVAL_NIGHT;
+    - щойно відкрита зміна: POLL_INTERVAL_MIN протягом POLL_SHIFT_OPEN_BOOST;
+    - відкрита зміна: інтервал, за який в середньому надходить
+      POLL_TARGET_RECEIPTS чеків, в межах [POLL_INTERVAL_MIN, POLL_INTERVAL_MAX].
+    Результат зберігається в kasa['poll_interval'] для перегляду.
+    """
+    if not ADAPTIVE_POLLING:
+        interval = POLL_INTERVAL_OPEN if kasa.get('last_polled_shift_status') == 'OPENED' else POLL_INTERVAL_CLOSED
+    elif kasa.get('last_polled_shift_status') != 'OPENED':
+        interval = POLL_INTERVAL_NIGHT if is_night(now_local) else POLL_INTERVAL_CLOSED
+    else:
+        now = now if now is not None else time.monotonic()
+        opened = kasa.get('shift_opened_monotonic')
+        rate = kasa.get('receipt_rate')
+        if opened is not None and now - opened < POLL_SHIFT_OPEN_BOOST:
+            interval = POLL_INTERVAL_MIN
+        elif rate is None:
+            interval = POLL_INTERVAL_OPEN
+        elif rate <= 0:
+            interval = POLL_INTERVAL_MAX
+        else:
+            interval = POLL_TARGET_RECEIPTS / rate
+        interval = min(POLL_INTERVAL_MAX, max(POLL_INTERVAL_MIN, interval))
+    kasa['poll_interval'] = round(interval, 1)
+    return interval
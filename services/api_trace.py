@@ -0,0 +1,181 @@
+# services/api_trace.py
+import base64
+import gzip
+import hashlib
+import json
+import logging
+import time
+from collections import defaultdict, deque
+
+logger = logging.getLogger(__name__)
+
+# Ключі JSON-відповідей, значення яких не потрапляють у запис
+SECRET_KEYS = {'access_token', 'refresh_token', 'token', 'license_key', 'pin_code', 'password', 'key'}
+# Параметри запиту, що залежать від часу запуску, - не враховуються при пошуку відповіді
+VOLATILE_PARAMS = {'from_date', 'to_date'}
+# Заголовки відповіді, які варто зберегти
+KEPT_HEADERS = ('Content-Type', 'Retry-After')
+
+KASA_PREFIX = 'anon-'
+
+
+def kasa_alias(license_key):
+    """
+    Псевдонім каси в записі: односторонній хеш ключа ліцензії.
+    Ключ, що вже є псевдонімом (відтворення), повертається як є.
+    """
+    license_key = str(license_key or '')
+    if license_key.startswith(KASA_PREFIX):
+        return license_key
+    return KASA_PREFIX + hashlib.sha256(license_key.encode()).hexdigest()[:12]
+
+
+def redact(value):
+    if isinstance(value, dict):
+        return {k: ('<redacted>' if k in SECRET_KEYS else redact(v)) for k, v in value.items()}
+    if isinstance(value, list):
+        return [redact(v) for v in value]
+    return value
+
+
+def _params(params):
+    """Параметри запиту як відсортований список пар (значення-списки розгортаються)."""
+    items = []
+    for k, v in (params or {}).items():
+        for one in (v if isinstance(v, (list, tuple)) else [v]):
+            items.append([k, str(one)])
+    return sorted(items)
+
+
+def _match_key(entry_or_request):
+    kasa, method, path, params = entry_or_request
+    stable = tuple((k, v) for k, v in params if k not in VOLATILE_PARAMS)
+    return kasa, method, path, stable
+
+
+class ApiRecorder:
+    """
+    Запис пар запит/відповідь Checkbox API у gzip JSON lines.
+
+    Ключ ліцензії замінюється псевдонімом (kasa_alias), заголовки запиту
+    та тіло запиту (PIN-код) не зберігаються, секрети у відповідях
+    (access_token тощо) замінюються на '<redacted>'. PDF зберігаються лише
+    як розмір, якщо не ввімкнено keep_binary.
+    """
+
+    def __init__(self, path, keep_binary=False):
+        self.path = path
+        self.keep_binary = keep_binary
+        self._file = gzip.open(path, 'at', encoding='utf-8')
+        self._started = time.monotonic()
+        self.count = 0
+
+    def record(self, method, path, headers, params, resp, duration):
+        entry = {
+            't': round(time.monotonic() - self._started, 3),
+            'd': round(duration * 1000, 1),
+            'k': kasa_alias((headers or {}).get('X-License-Key')),
+            'm': method,
+            'p': path,
+            'q': _params(params),
+            's': resp.status,
+            'h': {h: resp.headers[h] for h in KEPT_HEADERS if h in resp.headers}
+        }
+        content_type = entry['h'].get('Content-Type', '')
+        body = resp.body or b''
+        if 'json' in content_type or body[:1] in (b'{', b'['):
+            try:
+                entry['j'] = redact(json.loads(body))
+            except ValueError:
+                entry['x'] = body.decode('utf-8', errors='replace')
+        elif body.startswith(b'%PDF-') and not self.keep_binary:
+            entry['n'] = len(body)
+        elif body:
+            entry['b'] = base64.b64encode(body).decode('ascii')
+        self._file.write(json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n')
+        self.count += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            logger.info(f"[ApiRecorder] Recorded {self.count} API calls to {self.path}")
+
+
+def load_trace(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def entry_body(entry):
+    if 'j' in entry:
+        return json.dumps(entry['j'], ensure_ascii=False).encode('utf-8')
+    if 'x' in entry:
+        return entry['x'].encode('utf-8')
+    if 'n' in entry:
+        # Розмір PDF збережено, вміст - ні: відтворюємо заглушку того ж розміру
+        return b'%PDF-1.4\n' + b'0' * max(0, entry['n'] - 9)
+    if 'b' in entry:
+        return base64.b64decode(entry['b'])
+    return b''
+
+
+class ReplayTransport:
+    """
+    Відтворює записаний трафік замість мережі, без затримок.
+
+    Відповідь шукається за (каса, метод, шлях, параметри без дат) і
+    видається в записаному порядку; коли записані відповіді для ключа
+    закінчились, повторюється остання (наприклад, стан зміни між циклами).
+    Якщо точного збігу немає - відповідь того ж шляху з іншими параметрами,
+    інакше 404. Касам бота треба дати license_key, рівний псевдоніму з запису.
+    """
+
+    def __init__(self, entries):
+        self._exact = defaultdict(deque)
+        self._by_path = defaultdict(deque)
+        self._last = {}
+        for e in entries:
+            key = _match_key((e['k'], e['m'], e['p'], [tuple(p) for p in e['q']]))
+            self._exact[key].append(e)
+            self._by_path[key[:3]].append(e)
+        self.hits = 0
+        self.fallbacks = 0
+        self.misses = 0
+
+    @classmethod
+    def from_file(cls, path):
+        return cls(load_trace(path))
+
+    @property
+    def kasas(self):
+        return sorted({key[0] for key in self._by_path})
+
+    def _pick(self, key):
+        queue = self._exact.get(key)
+        if queue:
+            entry = queue.popleft()
+            self._last[key] = entry
+            self.hits += 1
+            return entry
+        if key in self._last:
+            self.hits += 1
+            return self._last[key]
+        same_path = self._by_path.get(key[:3])
+        if same_path:
+            self.fallbacks += 1
+            return same_path[0]
+        self.misses += 1
+        return None
+
+    async def send(self, method, path, headers, params, json_body):
+        from services.checkbox_api import ApiResponse
+        key = _match_key((kasa_alias((headers or {}).get('X-License-Key')), method, path,
+                          [tuple(p) for p in _params(params)]))
+        entry = self._pick(key)
+        if entry is None:
+            return ApiResponse(404, {'Content-Type': 'application/json'}, b'{"message": "not recorded"}')
+        return ApiResponse(entry['s'], dict(entry.get('h') or {}), entry_body(entry))
+
+    def stats(self):
+        return {'hits': self.hits, 'fallbacks': self.fallbacks, 'misses': self.misses}
@@ -1,295 +1,682 @@
 # services/checkbox_api.py
+import json
+import asyncio
 import aiohttp
 import logging
-from tenacity import retry, stop_after_attempt, wait_exponential
-from config.settings import BASE_URL, CLIENT_NAME, CLIENT_VERSION
-from datetime import datetime
+import time
+from collections import Counter
+from contextvars import ContextVar
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
+from services import metrics
+from services.token_manager import TokenManager
+from services.resilience import ApiGuard, ApiUnavailableError
+from utils.receipt import decode_receipts
+from config.settings import (
+    BASE_URL, CLIENT_NAME, CLIENT_VERSION,
+    HTTP_POOL_LIMIT, HTTP_POOL_LIMIT_PER_HOST, HTTP_DNS_CACHE_TTL,
+    HTTP_KEEPALIVE_TIMEOUT, HTTP_REQUEST_TIMEOUT
+)
 
 logger = logging.getLogger(__name__)
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10))
-async def get_cashier_token(license_key, pin_code):
-    headers = {
-        'X-License-Key': license_key,
-        'X-Client-Name': CLIENT_NAME,
-        'X-Client-Version': CLIENT_VERSION,
-        'Content-Type': 'application/json'
-    }
-    
-    async with aiohttp.ClientSession() as session:
+
+class ApiResponse:
+    """
+    Повністю прочитана відповідь API: статус, заголовки та тіло.
+    З'єднання повертається в пул одразу після читання тіла.
+    """
+    __slots__ = ('status', 'headers', 'body')
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body) if self.body else None
+
+    def text(self):
+        return self.body.decode('utf-8', errors='replace')
+
+
+def _path_template(path):
+    """Шлях без ID (чеків, змін), щоб групувати запити за типом."""
+    parts = path.strip('/').split('/')
+    return '/' + '/'.join(p if i == 0 or p in ('pdf', 'search') else '{id}' for i, p in enumerate(parts))
+
+
+def _endpoint_family(path):
+    """Група ендпоінтів для circuit breaker: перший сегмент шляху, PDF чеків - окремо."""
+    parts = path.strip('/').split('/')
+    return f"{parts[0]}/pdf" if parts[-1] == 'pdf' else parts[0]
+
+
+def _server_failure(status):
+    """Статус, що означає збій API, а не відсутність ресурсу."""
+    return status == 429 or status >= 500
+
+
+def _raise_unavailable(err):
+    if isinstance(err, ApiUnavailableError):
+        raise err
+    raise ApiUnavailableError(str(err)) from err
+
+
+class ReceiptsTruncatedError(Exception):
+    """
+    Сторінку receipts/search не отримано: результат неповний. offset -
+    зміщення сторінки, що не завантажилась; received - скільки чеків
+    ітератор уже віддав до збою.
+    """
+
+    def __init__(self, message, offset=0, received=0):
+        super().__init__(message)
+        self.offset = offset
+        self.received = received
+
+
+class ReceiptPages:
+    """
+    Сторінки GET /api/v1/receipts/search (списки Receipt) як асинхронний
+    ітератор: поки викликач обробляє сторінку, наступна вже завантажується.
+    Збій будь-якої сторінки завершує ітерацію винятком ReceiptsTruncatedError,
+    тож неповний результат не видається за повний.
+
+    first_page_size - мала перша сторінка-"зонд" (інкрементальна
+    синхронізація): після неї наступна наперед не завантажується, бо
+    зазвичай викликач на ній і зупиняється.
+
+        async with iter_receipts(lic, token, shift_id=sid) as pages:
+            async for page in pages:
+                ...  # break - завантаження наступної сторінки скасовується
+    """
+
+    def __init__(self, client, license_key, cashier_token, shift_id=None, from_date=None, to_date=None,
+                 desc=False, page_size=100, first_page_size=None):
+        self._client = client
+        self._headers = client._auth_headers(license_key, cashier_token)
+        self._params = {'desc': 'true' if desc else 'false'}
+        if shift_id is not None:
+            self._params['shift_id[]'] = shift_id
+        if from_date is not None:
+            self._params['from_date'] = from_date.isoformat()
+        if to_date is not None:
+            self._params['to_date'] = to_date.isoformat()
+        self.page_size = page_size
+        self._probe = first_page_size is not None
+        self._next_limit = first_page_size or page_size
+        self.offset = 0             # зміщення наступної сторінки
+        self.pages = 0
+        self.received = 0
+        self._pending = None        # (задача, limit, offset) сторінки, що завантажується
+        self._done = False
+
+    def _fetch(self):
+        limit, offset = self._next_limit, self.offset
+        params = dict(self._params, limit=limit, offset=offset)
+        task = asyncio.ensure_future(self._client._search_page(self._headers, params))
+        self._pending = (task, limit, offset)
+        self.offset += limit
+        self._next_limit = self.page_size
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._done:
+            raise StopAsyncIteration
+        if self._pending is None:
+            self._fetch()
+        task, limit, offset = self._pending
+        self._pending = None
         try:
-            async with session.post(
-                f"{BASE_URL}/cashier/signinPinCode",
-                headers=headers,
-                json={'pin_code': pin_code}
-            ) as resp:
-                if resp.status == 200:
-                    return (await resp.json()).get('access_token')
-                logger.error(f"Auth error: {await resp.text()}")
-                return None
+            page = await task
+        except asyncio.CancelledError:
+            self._done = True
+            raise
         except Exception as e:
-            logger.error(f"Auth request error: {str(e)}")
+            self._done = True
+            raise ReceiptsTruncatedError(
+                f"receipts/search page at offset {offset} failed: {e}", offset, self.received
+            ) from e
+        self.pages += 1
+        if len(page) < limit:
+            self._done = True
+        elif not (self._probe and self.pages == 1):
+            self._fetch()
+        if not page:
+            raise StopAsyncIteration
+        self.received += len(page)
+        return page
+
+    async def aclose(self):
+        """Скасовує наперед запитану сторінку (викликач зупинився раніше)."""
+        self._done = True
+        if self._pending is not None:
+            task = self._pending[0]
+            self._pending = None
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+
+class RequestCounter:
+    """
+    Лічильник HTTP-запитів до API в межах одного циклу опитування каси.
+    Прив'язується до контексту через count_requests(); задачі, створені
+    всередині циклу, успадковують той самий лічильник.
+    """
+    __slots__ = ('calls', 'by_path')
+
+    def __init__(self):
+        self.calls = 0
+        self.by_path = Counter()
+
+    def add(self, method, path):
+        self.calls += 1
+        self.by_path[f"{method} {_path_template(path)}"] += 1
+
+    def summary(self):
+        return ', '.join(f"{k}: {v}" for k, v in sorted(self.by_path.items()))
+
+
+_request_counter = ContextVar('checkbox_request_counter', default=None)
+
+
+def count_requests():
+    """Починає підрахунок запитів для поточного контексту; повертає лічильник."""
+    counter = RequestCounter()
+    _request_counter.set(counter)
+    return counter
+
+
+class CheckboxClient:
+    """
+    Довгоживучий клієнт Checkbox API з одним пулом з'єднань.
+
+    Сесія створюється ліниво всередині запущеного event loop і тримає
+    keep-alive з'єднання та DNS-кеш, тож повторні опитування кас не
+    виконують новий TCP+TLS handshake. Закривається через close().
+    Кожен запит проходить через ApiGuard (services.resilience): межа
+    частоти, Retry-After і circuit breaker на касу.
+    """
+
+    def __init__(self, base_url=BASE_URL, limit=HTTP_POOL_LIMIT,
+                 limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+                 dns_cache_ttl=HTTP_DNS_CACHE_TTL,
+                 keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+                 request_timeout=HTTP_REQUEST_TIMEOUT,
+                 recorder=None, transport=None, guard=None):
+        self.base_url = base_url
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.request_timeout = request_timeout
+        self._session = None
+        self.tokens = TokenManager(self._signin_pin_code)
+        # Запис трафіку (services.api_trace.ApiRecorder) та транспорт
+        # відтворення замість мережі (ReplayTransport) - для бенчмарків
+        self.recorder = recorder
+        self.transport = transport
+        self.guard = guard if guard is not None else ApiGuard()
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.dns_cache_ttl,
+                use_dns_cache=True,
+                keepalive_timeout=self.keepalive_timeout
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.request_timeout),
+                headers={
+                    'X-Client-Name': CLIENT_NAME,
+                    'X-Client-Version': CLIENT_VERSION
+                }
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        if self.recorder is not None:
+            self.recorder.close()
+
+    @staticmethod
+    def _auth_headers(license_key, cashier_token=None, accept=None):
+        headers = {'X-License-Key': license_key}
+        if cashier_token:
+            headers['Authorization'] = f'Bearer {cashier_token}'
+        if accept:
+            headers['Accept'] = accept
+        return headers
+
+    async def _request(self, method, path, headers=None, params=None, json_body=None, op=None):
+        """
+        Єдина точка виконання HTTP-запитів до API.
+        Повертає ApiResponse; мережеві помилки прокидаються викликачу.
+        op - назва функції клієнта для метрик (за замовчуванням шлях).
+        На 401 токен касира оновлюється (одна спільна авторизація на касу)
+        і запит повторюється один раз з новим токеном.
+        """
+        resp = await self._send(method, path, headers, params, json_body, op)
+        auth = (headers or {}).get('Authorization', '')
+        if resp.status == 401 and auth.startswith('Bearer '):
+            license_key = headers.get('X-License-Key')
+            new_token = await self.tokens.reauthenticate(license_key, auth[len('Bearer '):])
+            if new_token:
+                logger.info(f"[CheckboxClient] Retrying {method} {path} after token refresh")
+                headers = dict(headers, Authorization=f'Bearer {new_token}')
+                resp = await self._send(method, path, headers, params, json_body, op)
+        return resp
+
+    async def _send(self, method, path, headers, params, json_body, op=None):
+        counter = _request_counter.get()
+        if counter is not None:
+            counter.add(method, path)
+        op = op or f"{method} {_path_template(path)}"
+        license_key = (headers or {}).get('X-License-Key')
+        family = _endpoint_family(path)
+        # ApiUnavailableError - запит не надсилається (див. ApiGuard)
+        await self.guard.before(license_key, family)
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            if self.transport is not None:
+                result = await self.transport.send(method, path, headers, params, json_body)
+            else:
+                async with self._get_session().request(
+                    method,
+                    f"{self.base_url}{path}",
+                    headers=headers,
+                    params=params,
+                    json=json_body
+                ) as resp:
+                    body = await resp.read()
+                    result = ApiResponse(resp.status, resp.headers, body)
+            status = result.status
+            self.guard.after(license_key, family, status, result.headers)
+            if self.recorder is not None:
+                self.recorder.record(method, path, headers, params, result, time.perf_counter() - started)
+            return result
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.guard.failed(license_key, family)
             raise
+        finally:
+            metrics.API_REQUESTS.inc(function=op, status=status)
+            metrics.API_LATENCY.observe(time.perf_counter() - started, function=op, status=status)
 
-async def get_current_shift_id(license_key, cashier_token):
-    headers = {
-        'Authorization': f'Bearer {cashier_token}',
-        'X-License-Key': license_key,
-        'X-Client-Name': CLIENT_NAME,
-        'X-Client-Version': CLIENT_VERSION
-    }
-    
-    params = {
-        'statuses[]': ['OPENED', 'OPENING'],  # Фікс параметрів запиту
-        'limit': 1,
-        'desc': 'true'  # Отримуємо останню активну зміну
-    }
-
-    async with aiohttp.ClientSession() as session:
+    @retry(
+        retry=retry_if_exception_type((aiohttp.ClientError, asyncio.TimeoutError)),
+        stop=stop_after_attempt(3),
+        wait=wait_exponential(multiplier=1, min=2, max=10),
+        reraise=True
+    )
+    async def _signin_pin_code(self, license_key, pin_code):
+        """
+        Авторизація касира за PIN-кодом. Повторюється лише при мережевих
+        помилках; відмова API (невірний PIN тощо) повертає None одразу.
+        """
+        resp = await self._send(
+            'POST', '/cashier/signinPinCode',
+            self._auth_headers(license_key), None, {'pin_code': pin_code},
+            op='signin_pin_code'
+        )
+        if resp.status == 200:
+            return resp.json().get('access_token')
+        logger.error(f"Auth error: {resp.text()}")
+        return None
+
+    async def get_cashier_token(self, license_key, pin_code):
+        """
+        Повертає кешований токен касира, оновлюючи його перед закінченням дії.
+        """
         try:
-            async with session.get(
-                f"{BASE_URL}/shifts",
-                headers=headers,
-                params=params
-            ) as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    logger.debug(f"Shifts API response: {data}")  # Додаткове логування
-                    return data['results'][0]['id'] if data['results'] else None
-                logger.error(f"Shifts error {resp.status}: {await resp.text()}")
-                return None
+            return await self.tokens.get_token(license_key, pin_code)
         except Exception as e:
+            logger.error(f"Auth request error: {str(e)}")
+            return None
+
+    async def get_current_shift(self, license_key, cashier_token, strict=False):
+        """
+        Поточна (відкрита або та, що відкривається) зміна каси одним запитом
+        GET /api/v1/shifts. Об'єкт зміни вже містить status, serial, opened_at
+        та balance, тож окремий GET /shifts/{id} у циклі опитування не потрібен.
+        Повертає словник зміни або None, якщо відкритої зміни немає чи стався збій.
+        strict=True - збій прокидається винятком (ApiUnavailableError), щоб
+        недоступність API не сприймалась як закрита зміна.
+        """
+        params = {
+            'statuses[]': ['OPENED', 'OPENING'],  # Фікс параметрів запиту
+            'limit': 1,
+            'desc': 'true'  # Отримуємо останню активну зміну
+        }
+        try:
+            resp = await self._request(
+                'GET', '/shifts',
+                headers=self._auth_headers(license_key, cashier_token),
+                params=params,
+                op='get_current_shift'
+            )
+            if resp.status == 200:
+                data = resp.json()
+                logger.debug(f"Shifts API response: {data}")  # Додаткове логування
+                return data['results'][0] if data['results'] else None
+            logger.error(f"Shifts error {resp.status}: {resp.text()}")
+            if strict:
+                raise ApiUnavailableError(f"Shifts error {resp.status}")
+            return None
+        except Exception as e:
+            if strict:
+                raise
             logger.error(f"Shifts request error: {str(e)}")
             return None
-        
-async def get_receipt_info(receipt_id, license_key, cashier_token):
-    """
-    Отримання повної інформації про чек за ID.
-    Використовує GET /api/v1/receipts/{receipt_id}.
-    """
-    headers = {
-        'X-License-Key': license_key,
-        'X-Client-Name': CLIENT_NAME,
-        'X-Client-Version': CLIENT_VERSION,
-        'Authorization': f'Bearer {cashier_token}',
-        'Accept': 'application/json'
-    }
-    url = f"{BASE_URL}/receipts/{receipt_id}"
-    async with aiohttp.ClientSession() as session:
+
+    async def get_current_shift_id(self, license_key, cashier_token):
+        shift = await self.get_current_shift(license_key, cashier_token)
+        return shift['id'] if shift else None
+
+    async def get_receipt_info(self, receipt_id, license_key, cashier_token, strict=False):
+        """
+        Отримання повної інформації про чек за ID.
+        Використовує GET /api/v1/receipts/{receipt_id}.
+        Повертає None, якщо чек недоступний. strict=True - збій API (мережа,
+        429, 5xx, ApiGuard) прокидається винятком ApiUnavailableError, щоб
+        його можна було відрізнити від чека, який ще не готовий.
+        """
         try:
-            async with session.get(url, headers=headers) as resp:
-                if resp.status == 200:
-                    receipt_data = await resp.json()
-                    logger.info(f"[get_receipt_info] Successfully retrieved receipt info for {receipt_id}")
-                    return receipt_data
-                else:
-                    text = await resp.text()
-                    logger.error(f"[get_receipt_info] Error fetching receipt {receipt_id}: Status {resp.status}, Response: {text}")
-                    return None
+            resp = await self._request(
+                'GET', f"/receipts/{receipt_id}",
+                headers=self._auth_headers(license_key, cashier_token, accept='application/json'),
+                op='get_receipt_info'
+            )
+            if resp.status == 200:
+                receipt_data = resp.json()
+                logger.info(f"[get_receipt_info] Successfully retrieved receipt info for {receipt_id}")
+                return receipt_data
+            logger.error(f"[get_receipt_info] Error fetching receipt {receipt_id}: Status {resp.status}, Response: {resp.text()}")
+            if strict and _server_failure(resp.status):
+                raise ApiUnavailableError(f"Receipt {receipt_id} error {resp.status}")
+            return None
         except Exception as err:
             logger.error(f"[get_receipt_info] Exception while fetching receipt {receipt_id}: {str(err)}")
+            if strict:
+                _raise_unavailable(err)
             return None
-        
-async def get_receipt_pdf(kasa, receipt_id):
-    """
-    Отримання PDF представлення чека за заданим receipt_id.
-    Використовується GET /api/v1/receipts/{receipt_id}/pdf із параметрами:
-      - is_second_copy: false
-      - download: false
-    """
-    headers = {
-        'Authorization': f'Bearer {kasa["cashier_token"]}',
-        'X-License-Key': kasa["license_key"],
-        'X-Client-Name': CLIENT_NAME,
-        'X-Client-Version': CLIENT_VERSION,
-        'Accept': 'application/pdf'
-    }
-    params = {
-        'is_second_copy': 'false',
-        'download': 'false'
-    }
-    url = f"{BASE_URL}/receipts/{receipt_id}/pdf"
-    async with aiohttp.ClientSession() as session:
+
+    async def get_receipt_pdf(self, kasa, receipt_id, strict=False):
+        """
+        Отримання PDF представлення чека за заданим receipt_id.
+        Використовується GET /api/v1/receipts/{receipt_id}/pdf із параметрами:
+          - is_second_copy: false
+          - download: false
+        strict - як у get_receipt_info.
+        """
+        params = {
+            'is_second_copy': 'false',
+            'download': 'false'
+        }
         try:
-            async with session.get(url, headers=headers, params=params) as resp:
-                if resp.status == 200:
-                    pdf_data = await resp.read()
-                    if pdf_data.startswith(b'%PDF-'):
-                        logger.info(f"[get_receipt_pdf] Successfully retrieved PDF for receipt {receipt_id}")
-                        return pdf_data
-                    else:
-                        logger.error(f"[get_receipt_pdf] Returned data does not look like a PDF for receipt {receipt_id}.")
-                        return None
-                else:
-                    text = await resp.text()
-                    logger.error(f"[get_receipt_pdf] Error fetching receipt PDF: Status {resp.status}, Response: {text}")
-                    return None
+            resp = await self._request(
+                'GET', f"/receipts/{receipt_id}/pdf",
+                headers=self._auth_headers(kasa["license_key"], kasa["cashier_token"], accept='application/pdf'),
+                params=params,
+                op='get_receipt_pdf'
+            )
+            if resp.status == 200:
+                if resp.body.startswith(b'%PDF-'):
+                    logger.info(f"[get_receipt_pdf] Successfully retrieved PDF for receipt {receipt_id}")
+                    return resp.body
+                logger.error(f"[get_receipt_pdf] Returned data does not look like a PDF for receipt {receipt_id}.")
+                return None
+            logger.error(f"[get_receipt_pdf] Error fetching receipt PDF: Status {resp.status}, Response: {resp.text()}")
+            if strict and _server_failure(resp.status):
+                raise ApiUnavailableError(f"Receipt {receipt_id} PDF error {resp.status}")
+            return None
         except Exception as e:
             logger.error(f"[get_receipt_pdf] Exception while fetching receipt PDF: {str(e)}")
+            if strict:
+                _raise_unavailable(e)
             return None
 
-async def get_report_receipt_info(license_key, cashier_token, is_z_report, shift_id, from_date, to_date):
-    """
-    Запит до GET /api/v1/reports для отримання звітів (X або Z) за заданий часовий діапазон.
-    Повертається список звітів (results).
-    Параметри:
-      - is_z_report: True для Z звіту, False для X звіту.
-      - shift_id: рядок (передається як масив із одним елементом).
-      - from_date, to_date: часові діапазони (ISO‑рядки).
-      - Додатково: desc=false, offset=0, limit=25.
-    """
-    headers = {
-        'Authorization': f'Bearer {cashier_token}',
-        'X-License-Key': license_key,
-        'X-Client-Name': CLIENT_NAME,
-        'X-Client-Version': CLIENT_VERSION,
-        'Accept': 'application/json'
-    }
-    
-    params = {
-        'from_date': from_date,
-        'to_date': to_date,
-        'shift_id': [shift_id],
-        'is_z_report': 'true' if is_z_report else 'false',
-        'desc': 'false',
-        'offset': 0,
-        'limit': 25
-    }
-    
-    url = f"{BASE_URL}/reports"
-    async with aiohttp.ClientSession() as session:
+    async def get_report_receipt_info(self, license_key, cashier_token, is_z_report, shift_id, from_date, to_date):
+        """
+        Запит до GET /api/v1/reports для отримання звітів (X або Z) за заданий часовий діапазон.
+        Повертається список звітів (results).
+        Параметри:
+          - is_z_report: True для Z звіту, False для X звіту.
+          - shift_id: рядок (передається як масив із одним елементом).
+          - from_date, to_date: часові діапазони (ISO‑рядки).
+          - Додатково: desc=false, offset=0, limit=25.
+        """
+        params = {
+            'from_date': from_date,
+            'to_date': to_date,
+            'shift_id': [shift_id],
+            'is_z_report': 'true' if is_z_report else 'false',
+            'desc': 'false',
+            'offset': 0,
+            'limit': 25
+        }
         try:
-            async with session.get(url, headers=headers, params=params) as resp:
-                if resp.status == 200:
-                    json_resp = await resp.json()
-                    results = json_resp.get("results", [])
-                    if results:
-                        logger.info(f"[get_report_receipt_info] Found {len(results)} report(s) for shift {shift_id}")
-                        return results
-                    else:
-                        logger.error(f"[get_report_receipt_info] No reports found for shift {shift_id}")
-                        return []
-                else:
-                    text = await resp.text()
-                    logger.error(f"[get_report_receipt_info] Error fetching reports: Status {resp.status}, Response: {text}")
-                    return []
+            resp = await self._request(
+                'GET', '/reports',
+                headers=self._auth_headers(license_key, cashier_token, accept='application/json'),
+                params=params,
+                op='get_report_receipt_info'
+            )
+            if resp.status == 200:
+                results = resp.json().get("results", [])
+                if results:
+                    logger.info(f"[get_report_receipt_info] Found {len(results)} report(s) for shift {shift_id}")
+                    return results
+                logger.error(f"[get_report_receipt_info] No reports found for shift {shift_id}")
+                return []
+            logger.error(f"[get_report_receipt_info] Error fetching reports: Status {resp.status}, Response: {resp.text()}")
+            return []
         except Exception as e:
             logger.error(f"[get_report_receipt_info] Exception while fetching reports: {str(e)}")
             return []
 
-async def get_shift_info(license_key, cashier_token, shift_id):
-    headers = {
-        'Authorization': f'Bearer {cashier_token}',
-        'X-License-Key': license_key,
-        'X-Client-Name': CLIENT_NAME,
-        'X-Client-Version': CLIENT_VERSION
-    }
-    
-    async with aiohttp.ClientSession() as session:
+    async def get_shift_info(self, license_key, cashier_token, shift_id):
         try:
-            async with session.get(
-                f"{BASE_URL}/shifts/{shift_id}",
-                headers=headers
-            ) as resp:
-                if resp.status == 200:
-                    return await resp.json()
-                logger.error(f"Shift info error {resp.status}: {await resp.text()}")
-                return None
-        except Exception as e:
-            logger.error(f"Shift info request error: {str(e)}")
+            resp = await self._request(
+                'GET', f"/shifts/{shift_id}",
+                headers=self._auth_headers(license_key, cashier_token),
+                op='get_shift_info'
+            )
+            if resp.status == 200:
+                return resp.json()
+            logger.error(f"Shift info error {resp.status}: {resp.text()}")
             return None
-
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.get(
-                f"{BASE_URL}/shifts/{shift_id}",
-                headers=headers
-            ) as resp:
-                return await resp.json() if resp.status == 200 else None
         except Exception as e:
-            logger.error(f"Помилка інформації зміни: {str(e)}")
+            logger.error(f"Shift info request error: {str(e)}")
             return None
 
-async def get_kasa_name(license_key, cashier_token):
-    headers = {
-        'Authorization': f'Bearer {cashier_token}',
-        'X-License-Key': license_key,
-        'X-Client-Name': CLIENT_NAME,
-        'X-Client-Version': CLIENT_VERSION
-    }
-    
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.get(f"{BASE_URL}/cash-register", headers=headers) as resp:
-                if resp.status == 200:
-                    return (await resp.json()).get('title', 'Невідома каса')
-                return 'Невідома каса'
-        except Exception as e:
-            logger.error(f"Помилка назви каси: {str(e)}")
-            return 'Невідома каса'
-
-async def get_recent_receipts(license_key, cashier_token, shift_id, from_date, to_date):
-    all_receipts = []
-    limit = 100
-    offset = 0
-    
-    headers = {
-        'Authorization': f'Bearer {cashier_token}',
-        'X-License-Key': license_key,
-        'X-Client-Name': CLIENT_NAME,
-        'X-Client-Version': CLIENT_VERSION
-    }
-    
-    async with aiohttp.ClientSession() as session:
+    async def get_shifts(self, license_key, cashier_token, from_date, to_date):
+        """
+        Зміни каси, відкриті в проміжку [from_date, to_date], від найстаріших
+        (GET /api/v1/shifts з пагінацією). Повертає список словників змін або
+        None при помилці - неповний список не можна кешувати як повний.
+        """
+        shifts = []
+        limit = 100
+        offset = 0
+        headers = self._auth_headers(license_key, cashier_token)
         while True:
             params = {
-                'shift_id[]': shift_id,
                 'from_date': from_date.isoformat(),
                 'to_date': to_date.isoformat(),
+                'desc': 'false',
                 'limit': limit,
                 'offset': offset
             }
-            
             try:
-                async with session.get(
-                    f"{BASE_URL}/receipts/search",
-                    headers=headers,
-                    params=params
-                ) as resp:
-                    if resp.status != 200:
-                        break
-                    
-                    data = await resp.json()
-                    results = data.get('results', [])
-                    all_receipts.extend(results)
-                    
-                    if len(results) < limit:
-                        break
-                    offset += limit
+                resp = await self._request('GET', '/shifts', headers=headers, params=params, op='get_shifts')
+                if resp.status != 200:
+                    logger.error(f"[get_shifts] Error listing shifts: Status {resp.status}, Response: {resp.text()}")
+                    return None
+                results = resp.json().get('results') or []
             except Exception as e:
-                logger.error(f"Помилка пошуку чеків: {str(e)}")
-                break
-    
-    return all_receipts
-
-async def get_receipt_pdf(kasa_info, receipt_id):
-    headers = {
-        'Authorization': f'Bearer {kasa_info["cashier_token"]}',
-        'X-License-Key': kasa_info['license_key'],
-        'X-Client-Name': CLIENT_NAME,
-        'X-Client-Version': CLIENT_VERSION
-    }
-    
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.get(
-                f"{BASE_URL}/receipts/{receipt_id}/pdf",
-                headers=headers
-            ) as resp:
-                if resp.status == 200:
-                    pdf_data = await resp.read()
-                    return pdf_data if pdf_data.startswith(b'%PDF-') else None
+                logger.error(f"[get_shifts] Exception while listing shifts: {str(e)}")
                 return None
+            shifts.extend(results)
+            if len(results) < limit:
+                return shifts
+            offset += limit
+
+    async def get_kasa_name(self, license_key, cashier_token):
+        try:
+            resp = await self._request(
+                'GET', '/cash-register',
+                headers=self._auth_headers(license_key, cashier_token),
+                op='get_kasa_name'
+            )
+            if resp.status == 200:
+                return resp.json().get('title', 'Невідома каса')
+            return 'Невідома каса'
         except Exception as e:
-            logger.error(f"Помилка PDF: {str(e)}")
-            return None
\ No newline at end of file
+            logger.error(f"Помилка назви каси: {str(e)}")
+            return 'Невідома каса'
+
+    async def _search_page(self, headers, params, op='iter_receipts'):
+        """Одна сторінка receipts/search; збій (не-200 або мережа) - виняток."""
+        resp = await self._request('GET', '/receipts/search', headers=headers, params=params, op=op)
+        if resp.status != 200:
+            raise ApiUnavailableError(f"Status {resp.status}, Response: {resp.text()[:200]}")
+        return decode_receipts(resp.json().get('results'))
+
+    def iter_receipts(self, license_key, cashier_token, shift_id=None, from_date=None, to_date=None,
+                      desc=False, page_size=100, first_page_size=None):
+        """Чеки зміни (shift_id None - усіх змін каси) посторінково, див. ReceiptPages."""
+        return ReceiptPages(self, license_key, cashier_token, shift_id, from_date, to_date,
+                            desc, page_size, first_page_size)
+
+    async def get_receipts_page(self, license_key, cashier_token, shift_id, limit, offset=0, desc=True,
+                                from_date=None, to_date=None):
+        """
+        Одна сторінка GET /api/v1/receipts/search для зміни (shift_id None -
+        для всіх змін каси), за замовчуванням без часового вікна і від
+        найновіших чеків. Повертає список Receipt (utils.receipt) або None
+        при помилці, щоб викликач міг відрізнити порожню сторінку від збою.
+        """
+        params = {
+            'desc': 'true' if desc else 'false',
+            'limit': limit,
+            'offset': offset
+        }
+        if shift_id is not None:
+            params['shift_id[]'] = shift_id
+        if from_date is not None:
+            params['from_date'] = from_date.isoformat()
+        if to_date is not None:
+            params['to_date'] = to_date.isoformat()
+        try:
+            return await self._search_page(
+                self._auth_headers(license_key, cashier_token), params, op='get_receipts_page'
+            )
+        except Exception as e:
+            logger.error(f"[get_receipts_page] Error searching receipts: {str(e)}")
+            return None
+
+    async def get_recent_receipts(self, license_key, cashier_token, shift_id, from_date, to_date):
+        """
+        Усі чеки зміни за часовий проміжок одним списком (див. iter_receipts).
+        Якщо частину сторінок отримати не вдалося, повертається отримане,
+        а обрив логується як помилка.
+        """
+        all_receipts = []
+        try:
+            async with self.iter_receipts(license_key, cashier_token, shift_id, from_date, to_date) as pages:
+                async for page in pages:
+                    all_receipts.extend(page)
+        except ReceiptsTruncatedError as e:
+            logger.error(f"[get_recent_receipts] Result truncated after {e.received} receipts: {e}")
+        return all_receipts
+
+
+# Спільний клієнт процесу; створюється при старті в main.py через set_client()
+_client = None
+
+
+def set_client(client):
+    global _client
+    _client = client
+
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = CheckboxClient()
+    return _client
+
+
+# Функції модуля делегують спільному клієнту, щоб обробники
+# використовували "теплі" з'єднання з пулу.
+
+async def get_cashier_token(license_key, pin_code):
+    return await get_client().get_cashier_token(license_key, pin_code)
+
+
+async def get_current_shift(license_key, cashier_token, strict=False):
+    return await get_client().get_current_shift(license_key, cashier_token, strict)
+
+
+async def get_current_shift_id(license_key, cashier_token):
+    return await get_client().get_current_shift_id(license_key, cashier_token)
+
+
+async def get_receipt_info(receipt_id, license_key, cashier_token, strict=False):
+    return await get_client().get_receipt_info(receipt_id, license_key, cashier_token, strict)
+
+
+async def get_receipt_pdf(kasa, receipt_id, strict=False):
+    return await get_client().get_receipt_pdf(kasa, receipt_id, strict)
+
+
+async def get_report_receipt_info(license_key, cashier_token, is_z_report, shift_id, from_date, to_date):
+    return await get_client().get_report_receipt_info(
+        license_key, cashier_token, is_z_report, shift_id, from_date, to_date
+    )
+
+
+async def get_shift_info(license_key, cashier_token, shift_id):
+    return await get_client().get_shift_info(license_key, cashier_token, shift_id)
+
+
+async def get_shifts(license_key, cashier_token, from_date, to_date):
+    return await get_client().get_shifts(license_key, cashier_token, from_date, to_date)
+
+
+async def get_kasa_name(license_key, cashier_token):
+    return await get_client().get_kasa_name(license_key, cashier_token)
+
+
+async def get_receipts_page(license_key, cashier_token, shift_id, limit, offset=0, desc=True,
+                            from_date=None, to_date=None):
+    return await get_client().get_receipts_page(
+        license_key, cashier_token, shift_id, limit, offset, desc, from_date, to_date
+    )
+
+
+async def get_recent_receipts(license_key, cashier_token, shift_id, from_date, to_date):
+    return await get_client().get_recent_receipts(license_key, cashier_token, shift_id, from_date, to_date)
+
+
+def iter_receipts(license_key, cashier_token, shift_id=None, from_date=None, to_date=None,
+                  desc=False, page_size=100, first_page_size=None):
+    return get_client().iter_receipts(license_key, cashier_token, shift_id, from_date, to_date,
+                                      desc, page_size, first_page_size)
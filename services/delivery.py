@@ -0,0 +1,258 @@
+# services/delivery.py
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from aiogram.exceptions import TelegramRetryAfter, TelegramBadRequest, TelegramForbiddenError
+from aiogram.types import BufferedInputFile
+from config.settings import (
+    TELEGRAM_GLOBAL_RATE, TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST,
+    DELIVERY_WORKERS, DELIVERY_QUEUE_MAXSIZE, DELIVERY_QUEUE_MAX_BYTES, DELIVERY_RECEIPT_SHARE,
+    DELIVERY_MAX_ATTEMPTS
+)
+from services import metrics
+from utils.rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Пріоритети: менше число - раніше
+PRIORITY_SHIFT = 0      # відкриття/закриття зміни, звіти
+PRIORITY_RECEIPT = 1    # сповіщення про чеки
+
+
+def make_item(chat_id, text, document=None, file_id=None, filename=None, pdf_key=None, checkpoint=None):
+    """
+    Вихідне повідомлення. Це простий словник, тож його можна передати
+    між процесами. Якщо є file_id або document - надсилається документ
+    з text як підписом, інакше - текстове повідомлення. checkpoint - стан
+    каси до сповіщення про чек (див. handlers.start.receipt_checkpoint).
+    """
+    return {
+        'chat_id': chat_id,
+        'text': text,
+        'document': document,
+        'file_id': file_id,
+        'filename': filename,
+        'pdf_key': pdf_key,
+        'checkpoint': checkpoint,
+        'attempts': 0
+    }
+
+
+class DeliveryQueue:
+    """
+    Черга вихідних повідомлень Telegram з обмеженням швидкості.
+
+    - глобальний token bucket (TELEGRAM_GLOBAL_RATE повідомлень/с) і
+      окремий bucket на кожен чат (TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST);
+    - у межах чату зберігається порядок, повідомлення про зміну йдуть
+      перед сповіщеннями про чеки;
+    - на 429 (TelegramRetryAfter) надсилання призупиняється на retry_after,
+      а повідомлення повертається на початок черги чату;
+    - черга обмежена кількістю повідомлень (maxsize) і сумарним розміром
+      PDF у них (max_bytes): сповіщення про чеки відкидаються вже на
+      receipt_share від межі, решта лишається для повідомлень про зміну;
+      понад межу не приймається нічого.
+
+    Опитування кас лише викликає enqueue() і не чекає на Telegram.
+    """
+
+    def __init__(self, bot, pdf_cache=None, workers=DELIVERY_WORKERS, maxsize=DELIVERY_QUEUE_MAXSIZE,
+                 max_bytes=DELIVERY_QUEUE_MAX_BYTES, receipt_share=DELIVERY_RECEIPT_SHARE):
+        self.bot = bot
+        self.pdf_cache = pdf_cache
+        self.workers = workers
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.receipt_share = receipt_share
+        self._chats = {}        # chat_id -> (deque пріоритету 0, deque пріоритету 1)
+        self._buckets = {}      # chat_id -> TokenBucket
+        self._ready = []        # (ready_at, priority, seq, chat_id)
+        self._queued = set()    # чати, що є в _ready
+        self._busy = set()      # чати, повідомлення яких зараз надсилається
+        self._seq = itertools.count()
+        self._global = TokenBucket(TELEGRAM_GLOBAL_RATE)
+        self._paused_until = 0.0
+        self._wakeup = None
+        self._tasks = []
+        self.size = 0
+        self.bytes = 0
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+        self.retry_after_count = 0
+
+    def start(self):
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        for n in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(n)))
+
+    async def stop(self, drain_timeout=5.0):
+        """Чекає до drain_timeout секунд, поки черга спорожніє, і зупиняє воркери."""
+        deadline = time.monotonic() + drain_timeout
+        while self._tasks and (self.size or self._busy) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        tasks, self._tasks = self._tasks, []
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self.size:
+            logger.warning(f"[DeliveryQueue] Stopped with {self.size} undelivered messages")
+
+    @staticmethod
+    def _item_bytes(item):
+        return len(item['document']) if item['document'] else 0
+
+    def enqueue(self, item, priority=PRIORITY_RECEIPT):
+        share = 1.0 if priority == PRIORITY_SHIFT else self.receipt_share
+        nbytes = self._item_bytes(item)
+        if self.size + 1 > self.maxsize * share or self.bytes + nbytes > self.max_bytes * share:
+            self.dropped += 1
+            logger.warning(f"[DeliveryQueue] Queue full ({self.size} messages, {self.bytes} bytes), "
+                           f"dropping message for chat {item['chat_id']}")
+            return False
+        if not self._tasks:
+            self.start()
+        chat_id = item['chat_id']
+        queues = self._chats.get(chat_id)
+        if queues is None:
+            queues = self._chats[chat_id] = (deque(), deque())
+        queues[min(priority, 1)].append(item)
+        self.size += 1
+        self.bytes += nbytes
+        self._schedule(chat_id)
+        return True
+
+    def _bucket(self, chat_id):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = TokenBucket(TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST)
+        return bucket
+
+    def _schedule(self, chat_id, not_before=0.0):
+        if chat_id in self._queued or chat_id in self._busy:
+            return
+        queues = self._chats.get(chat_id)
+        if not queues or not (queues[0] or queues[1]):
+            self._chats.pop(chat_id, None)
+            bucket = self._buckets.get(chat_id)
+            if bucket is not None and bucket.full:
+                self._buckets.pop(chat_id, None)
+            return
+        now = time.monotonic()
+        ready_at = max(not_before, now + self._bucket(chat_id).delay(now))
+        priority = 0 if queues[0] else 1
+        heapq.heappush(self._ready, (ready_at, priority, next(self._seq), chat_id))
+        self._queued.add(chat_id)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _next_chat(self):
+        while True:
+            now = time.monotonic()
+            if self._ready:
+                ready_at = max(self._ready[0][0], self._paused_until)
+                if ready_at <= now:
+                    _, _, _, chat_id = heapq.heappop(self._ready)
+                    self._queued.discard(chat_id)
+                    self._busy.add(chat_id)
+                    return chat_id
+                timeout = ready_at - now
+            else:
+                timeout = None
+            # Між перевіркою _ready і clear() немає await, тож _schedule() не загубиться
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _worker(self, n):
+        while True:
+            chat_id = await self._next_chat()
+            queues = self._chats[chat_id]
+            queue = queues[0] if queues[0] else queues[1]
+            item = queue.popleft()
+            self.size -= 1
+            self.bytes -= self._item_bytes(item)
+            not_before = 0.0
+            kind = 'document' if item['file_id'] or item['document'] else 'message'
+            try:
+                await self._global.acquire()
+                self._bucket(chat_id).reserve()
+                await self._send(item)
+                self.sent += 1
+                metrics.TELEGRAM_SENDS.inc(kind=kind, result='sent')
+            except asyncio.CancelledError:
+                queue.appendleft(item)
+                self.size += 1
+                self.bytes += self._item_bytes(item)
+                raise
+            except TelegramRetryAfter as e:
+                self.retry_after_count += 1
+                metrics.TELEGRAM_SENDS.inc(kind=kind, result='retry_after')
+                not_before = time.monotonic() + e.retry_after
+                self._paused_until = max(self._paused_until, not_before)
+                logger.warning(f"[DeliveryQueue] Flood control, retry after {e.retry_after}s (chat {chat_id})")
+                queue.appendleft(item)
+                self.size += 1
+                self.bytes += self._item_bytes(item)
+            except (TelegramBadRequest, TelegramForbiddenError) as e:
+                self.failed += 1
+                metrics.TELEGRAM_SENDS.inc(kind=kind, result='rejected')
+                logger.error(f"[DeliveryQueue] Message to chat {chat_id} rejected: {e}")
+            except Exception as e:
+                metrics.TELEGRAM_SENDS.inc(kind=kind, result='error')
+                item['attempts'] += 1
+                if item['attempts'] < DELIVERY_MAX_ATTEMPTS:
+                    not_before = time.monotonic() + 2 ** item['attempts']
+                    logger.warning(f"[DeliveryQueue] Send to chat {chat_id} failed (attempt {item['attempts']}): {e}")
+                    queue.appendleft(item)
+                    self.size += 1
+                    self.bytes += self._item_bytes(item)
+                else:
+                    self.failed += 1
+                    logger.error(f"[DeliveryQueue] Giving up on message to chat {chat_id}: {e}")
+            finally:
+                self._busy.discard(chat_id)
+                self._schedule(chat_id, not_before)
+
+    async def _send(self, item):
+        chat_id = item['chat_id']
+        caption = item['text']
+        if item['file_id']:
+            try:
+                await self.bot.send_document(chat_id, item['file_id'], caption=caption)
+                return
+            except TelegramBadRequest as e:
+                # file_id недійсний - пробуємо завантажити PDF з дискового кешу
+                logger.warning(f"[DeliveryQueue] Sending by file_id failed for {item['pdf_key']}: {e}")
+                item['file_id'] = None
+                if self.pdf_cache is not None and item['pdf_key']:
+                    item['document'] = await self.pdf_cache.get(item['pdf_key'])
+        if item['document']:
+            msg = await self.bot.send_document(
+                chat_id, BufferedInputFile(item['document'], filename=item['filename'] or 'document.pdf'),
+                caption=caption
+            )
+            document = getattr(msg, 'document', None)
+            if document and item['pdf_key'] and self.pdf_cache is not None:
+                await self.pdf_cache.set_file_id(item['pdf_key'], document.file_id)
+            return
+        await self.bot.send_message(chat_id, caption)
+
+    def stats(self):
+        return {
+            'depth': self.size,
+            'bytes': self.bytes,
+            'chats': len(self._chats),
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'retry_after': self.retry_after_count,
+            'paused_for': max(0.0, self._paused_until - time.monotonic())
+        }
@@ -0,0 +1,183 @@
+# services/export.py
+# Експорт чеків за період у CSV або JSON Lines (/export і командний рядок).
+# Чеки читаються з receipts/search сторінка за сторінкою і одразу пишуться
+# у файл (за потреби - gzip на льоту): у пам'яті лише поточна сторінка,
+# незалежно від довжини періоду.
+#
+#     python -m services.export --license-key KEY --pin-code PIN --from 2024-03-01 --to 2024-03-31
+#     python -m services.export --user 123456 --kasa 2 --from 2024-03-01 --format jsonl -o march.jsonl.gz
+import argparse
+import asyncio
+import csv
+import gzip
+import json
+import logging
+import sys
+from datetime import date, timedelta
+from services.checkbox_api import ReceiptsTruncatedError, get_cashier_token, get_client, iter_receipts
+from services.reports import local_midnight_us
+from utils.storage import load_kasas_data, open_storage
+from utils.receipt import local_time_str, us_to_datetime, us_to_iso
+from utils.shift_totals import allocate_payments
+from config.settings import EXPORT_PAGE_SIZE, EXPORT_COMPRESS
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('csv', 'jsonl')
+FIELDS = ('kasa', 'receipt_id', 'serial', 'type', 'created_at', 'local_time',
+          'total', 'cash', 'card', 'service_in', 'service_out', 'payments')
+
+
+def _uah(kop):
+    """Копійки у гривні рядком без округлення через float: 12345 -> '123.45'."""
+    sign = '-' if kop < 0 else ''
+    kop = abs(kop)
+    return f"{sign}{kop // 100}.{kop % 100:02d}"
+
+
+def receipt_row(kasa_name, r):
+    cash, card = (0, 0) if r.is_service else allocate_payments(r)
+    return {
+        'kasa': kasa_name,
+        'receipt_id': r.id,
+        'serial': r.serial,
+        'type': r.type.value,
+        'created_at': us_to_iso(r.created_us),
+        'local_time': local_time_str(r.created_us, '%Y-%m-%d %H:%M:%S') if r.created_us is not None else None,
+        'total': _uah(r.total),
+        'cash': _uah(cash),
+        'card': _uah(card),
+        'service_in': _uah(r.service_in),
+        'service_out': _uah(r.service_out),
+        'payments': [{'type': p.type, 'value': _uah(p.value), 'label': p.label} for p in r.payments]
+    }
+
+
+class ReceiptWriter:
+    """
+    Файл експорту: CSV (UTF-8 з BOM, щоб Excel розпізнав кирилицю) або
+    JSON Lines; compress=True - gzip на льоту. У CSV оплати одним полем
+    "ТИП:сума; ТИП:сума".
+    """
+
+    def __init__(self, path, fmt='csv', compress=EXPORT_COMPRESS):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown export format: {fmt}")
+        self.fmt = fmt
+        encoding = 'utf-8-sig' if fmt == 'csv' else 'utf-8'
+        opener = gzip.open if compress else open
+        self._file = opener(path, 'wt', encoding=encoding, newline='')
+        self._csv = None
+        if fmt == 'csv':
+            self._csv = csv.writer(self._file)
+            self._csv.writerow(FIELDS)
+        self.rows = 0
+
+    def write(self, kasa_name, receipts):
+        for r in receipts:
+            row = receipt_row(kasa_name, r)
+            if self._csv is not None:
+                row['payments'] = '; '.join(f"{p['type']}:{p['value']}" for p in row['payments'])
+                self._csv.writerow([row[f] for f in FIELDS])
+            else:
+                self._file.write(json.dumps(row, ensure_ascii=False))
+                self._file.write('\n')
+        self.rows += len(receipts)
+
+    def close(self):
+        self._file.close()
+
+
+async def export_receipts(kasas, from_us, to_us, path, fmt='csv', compress=EXPORT_COMPRESS,
+                          page_size=EXPORT_PAGE_SIZE):
+    """
+    Вивантажує чеки кас за [from_us, to_us) у файл path. Сторінки
+    receipts/search читаються від найстаріших (нові чеки не зсувають offset)
+    і записуються в окремому потоці, поки завантажується наступна.
+    Повертає {'receipts': записано чеків, 'failed': назви кас, чеки яких
+    вивантажено не повністю}.
+    """
+    loop = asyncio.get_running_loop()
+    writer = await loop.run_in_executor(None, ReceiptWriter, path, fmt, compress)
+    from_date, to_date = us_to_datetime(from_us), us_to_datetime(to_us - 1)
+    failed = []
+    try:
+        for idx, kasa in enumerate(kasas, start=1):
+            name = kasa.get('kasa_name', f"Каса №{idx}")
+            lic = kasa['license_key']
+            token = await get_cashier_token(lic, kasa['pin_code'])
+            if not token:
+                failed.append(name)
+                continue
+            try:
+                async with iter_receipts(lic, token, from_date=from_date, to_date=to_date,
+                                         page_size=page_size) as pages:
+                    async for page in pages:
+                        await loop.run_in_executor(None, writer.write, name, page)
+            except ReceiptsTruncatedError as e:
+                logger.error(f"[Export] Kasa '{name}': export truncated after {e.received} receipts: {e}")
+                failed.append(name)
+    finally:
+        await loop.run_in_executor(None, writer.close)
+    logger.info(f"[Export] {writer.rows} receipts from {len(kasas)} kasas written to {path}")
+    return {'receipts': writer.rows, 'failed': failed}
+
+
+def export_filename(from_day, to_day, fmt, compress=EXPORT_COMPRESS):
+    name = f"receipts_{from_day:%Y%m%d}" + (f"-{to_day:%Y%m%d}" if to_day != from_day else '')
+    return f"{name}.{fmt}" + ('.gz' if compress else '')
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Експорт чеків за період у CSV або JSON Lines")
+    ap.add_argument('--from', dest='from_day', type=date.fromisoformat, required=True, help='РРРР-ММ-ДД')
+    ap.add_argument('--to', dest='to_day', type=date.fromisoformat, help='РРРР-ММ-ДД, включно (за замовчуванням = --from)')
+    ap.add_argument('--license-key', help='ключ ліцензії каси')
+    ap.add_argument('--pin-code', help='PIN-код касира')
+    ap.add_argument('--name', help='назва каси у файлі')
+    ap.add_argument('--user', help='ID користувача Telegram: каси зі сховища бота')
+    ap.add_argument('--kasa', type=int, action='append', help='номер каси користувача (як у /list_kasas)')
+    ap.add_argument('--format', choices=FORMATS, default='csv')
+    ap.add_argument('--no-gzip', action='store_true', help='не стискати файл')
+    ap.add_argument('-o', '--output', help='файл (за замовчуванням receipts_<дати>.<формат>[.gz])')
+    args = ap.parse_args()
+
+    to_day = args.to_day or args.from_day
+    if to_day < args.from_day:
+        ap.error('--to is earlier than --from')
+    if args.user:
+        open_storage(migrate=False)
+        kasas = load_kasas_data().get(args.user, [])
+        if args.kasa:
+            if not all(1 <= n <= len(kasas) for n in args.kasa):
+                ap.error(f"user {args.user} has {len(kasas)} kasas")
+            kasas = [kasas[n - 1] for n in args.kasa]
+        if not kasas:
+            ap.error(f"no kasas for user {args.user}")
+    elif args.license_key and args.pin_code:
+        kasas = [{'license_key': args.license_key, 'pin_code': args.pin_code,
+                  'kasa_name': args.name or args.license_key}]
+    else:
+        ap.error('either --user or --license-key with --pin-code is required')
+
+    compress = not args.no_gzip
+    path = args.output or export_filename(args.from_day, to_day, args.format, compress)
+
+    async def run():
+        try:
+            return await export_receipts(
+                kasas, local_midnight_us(args.from_day), local_midnight_us(to_day + timedelta(days=1)),
+                path, args.format, compress
+            )
+        finally:
+            await get_client().close()
+
+    result = asyncio.run(run())
+    print(f"{result['receipts']} receipts -> {path}")
+    if result['failed']:
+        print(f"incomplete: {', '.join(result['failed'])}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
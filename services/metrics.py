@@ -0,0 +1,293 @@
+# services/metrics.py
+import logging
+import math
+import threading
+from aiohttp import web
+from config.settings import METRICS_HOST, METRICS_PORT
+
+logger = logging.getLogger(__name__)
+
+# Межі кошиків гістограм за замовчуванням, секунди
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _fmt_labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs.extend(f'{n}="{v}"' for n, v in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _fmt_value(v):
+    if v == math.inf:
+        return '+Inf'
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, doc, labels=()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self._values = {}
+        self._remote = {}           # джерело (інший процес) -> значення, див. Registry.set_remote
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name}: expected labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labels)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+    @staticmethod
+    def _add(a, b):
+        return a + b
+
+    def snapshot(self):
+        with self._lock:
+            return {key: self._copy(value) for key, value in self._values.items()}
+
+    def set_remote(self, source, values):
+        with self._lock:
+            if values is None:
+                self._remote.pop(source, None)
+            else:
+                self._remote[source] = values
+
+    def retire_remote(self, source, into):
+        """Додає значення джерела до into: лічильники не зменшуються після перезапуску процесу."""
+        with self._lock:
+            values = self._remote.pop(source, None)
+            if values:
+                self._remote[into] = self._merge(self._remote.get(into, {}), values)
+
+    def _merge(self, base, values):
+        merged = {key: self._copy(value) for key, value in base.items()}
+        for key, value in values.items():
+            merged[key] = self._add(merged[key], value) if key in merged else self._copy(value)
+        return merged
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            values = self._values
+            for remote in self._remote.values():
+                values = self._merge(values, remote)
+            items = sorted(values.items())
+        for key, value in items:
+            lines.extend(self._render_one(key, value))
+        return lines
+
+    def _render_one(self, key, value):
+        return [f"{self.name}{_fmt_labels(self.labels, key)} {_fmt_value(value)}"]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value, **labels):
+        """Для лічильників, які вже ведуться деінде (оновлюються при зборі)."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, doc, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    @staticmethod
+    def _copy(state):
+        return [list(state[0]), state[1], state[2]]
+
+    @staticmethod
+    def _add(a, b):
+        return [[x + y for x, y in zip(a[0], b[0])], a[1] + b[1], a[2] + b[2]]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def _render_one(self, key, state):
+        counts, total, n = state
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            lines.append(
+                f"{self.name}_bucket{_fmt_labels(self.labels, key, [('le', _fmt_value(bound))])} {cumulative}"
+            )
+        lines.append(f"{self.name}_sum{_fmt_labels(self.labels, key)} {_fmt_value(total)}")
+        lines.append(f"{self.name}_count{_fmt_labels(self.labels, key)} {n}")
+        return lines
+
+
+class Registry:
+    """
+    Набір метрик процесу у текстовому форматі Prometheus.
+    Колектори викликаються перед кожним експортом і оновлюють
+    значення, які зручніше прочитати зі стану (глибина черги тощо).
+
+    Лічильники й гістограми інших процесів (воркерів шардування)
+    передаються знімками snapshot() і додаються до власних при експорті
+    (set_remote); gauge лишаються локальними.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def snapshot(self):
+        return {m.name: m.snapshot() for m in self._metrics if m.kind != 'gauge'}
+
+    def set_remote(self, source, snapshot):
+        for m in self._metrics:
+            if m.kind != 'gauge':
+                m.set_remote(source, snapshot.get(m.name, {}))
+
+    def retire_remote(self, source, into='retired'):
+        """Процес source завершився: його останні значення лишаються в сумі під into."""
+        for m in self._metrics:
+            m.retire_remote(source, into)
+
+    def add_collector(self, fn):
+        if fn not in self._collectors:
+            self._collectors.append(fn)
+
+    def render(self):
+        for fn in self._collectors:
+            try:
+                fn()
+            except Exception as e:
+                logger.error(f"[Metrics] Collector {getattr(fn, '__name__', fn)} failed: {e}")
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+API_REQUESTS = REGISTRY.register(Counter(
+    'kasa_bot_api_requests_total', 'Checkbox API requests by client function and HTTP status.',
+    ('function', 'status')
+))
+API_LATENCY = REGISTRY.register(Histogram(
+    'kasa_bot_api_request_duration_seconds', 'Checkbox API request latency by client function and HTTP status.',
+    ('function', 'status')
+))
+API_THROTTLED = REGISTRY.register(Counter(
+    'kasa_bot_api_throttled_total', 'Checkbox API requests delayed or rejected by the client-side guard.',
+    ('reason',)
+))
+API_BREAKER_OPEN = REGISTRY.register(Gauge(
+    'kasa_bot_api_breaker_open', 'Circuit breakers not closed per kasa and endpoint family (1 open, 0.5 half-open).',
+    ('kasa', 'name', 'family')
+))
+POLL_LAG = REGISTRY.register(Histogram(
+    'kasa_bot_poll_lag_seconds', 'Delay between scheduled and actual kasa poll time.',
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+))
+KASA_POLL_LAG = REGISTRY.register(Gauge(
+    'kasa_bot_kasa_poll_lag_seconds', 'Poll lag of the last cycle per kasa.', ('kasa', 'name')
+))
+KASA_POLL_INTERVAL = REGISTRY.register(Gauge(
+    'kasa_bot_kasa_poll_interval_seconds', 'Current polling interval per kasa.', ('kasa', 'name')
+))
+RECEIPTS_PROCESSED = REGISTRY.register(Counter(
+    'kasa_bot_receipts_processed_total', 'Receipt notifications queued for delivery.'
+))
+PDF_FETCHES = REGISTRY.register(Counter(
+    'kasa_bot_pdf_fetches_total', 'PDF lookups by source (telegram file_id, disk cache, api, missing).',
+    ('source',)
+))
+TELEGRAM_SENDS = REGISTRY.register(Counter(
+    'kasa_bot_telegram_sends_total', 'Telegram send attempts by message kind and result.',
+    ('kind', 'result')
+))
+DELIVERY_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    'kasa_bot_delivery_queue_depth', 'Messages waiting in the outbound Telegram queue.'
+))
+DELIVERY_QUEUE_BYTES = REGISTRY.register(Gauge(
+    'kasa_bot_delivery_queue_bytes', 'Size of PDF documents waiting in the outbound Telegram queue.'
+))
+TOKEN_REFRESHES = REGISTRY.register(Counter(
+    'kasa_bot_token_refreshes_total', 'Successful cashier token sign-ins performed by the token manager.'
+))
+TOKEN_REFRESH_FAILURES = REGISTRY.register(Counter(
+    'kasa_bot_token_refresh_failures_total', 'Failed cashier token sign-ins performed by the token manager.'
+))
+STATE_SAVE_DURATION = REGISTRY.register(Histogram(
+    'kasa_bot_state_save_duration_seconds', 'Time to write the kasas state snapshot.'
+))
+
+
+class MetricsServer:
+    """Локальний HTTP-ендпоінт /metrics для Prometheus."""
+
+    def __init__(self, registry=REGISTRY, host=METRICS_HOST, port=METRICS_PORT):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._runner = None
+
+    async def _handle(self, request):
+        return web.Response(
+            text=self.registry.render(),
+            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+        )
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/metrics', self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"[Metrics] Serving metrics on http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,214 @@
+# services/pdf_cache.py
+import asyncio
+import json
+import logging
+import os
+import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from config.settings import PDF_CACHE_DIR, PDF_CACHE_MAX_BYTES, PDF_CACHE_MAX_FILE_IDS
+
+logger = logging.getLogger(__name__)
+
+# Журнал file_id: по рядку [key, file_id] на кожне надсилання, пізніші рядки
+# перекривають раніші. Перезаписується цілком (ущільнюється), лише коли рядків
+# стає вдвічі більше, ніж max_file_ids. file_ids.json - формат попередніх версій.
+FILE_IDS_LOG = 'file_ids.jsonl'
+FILE_IDS_NAME = 'file_ids.json'
+
+
+class PdfCache:
+    """
+    Дисковий кеш PDF чеків і звітів за receipt_id з LRU-витісненням
+    за сумарним розміром (max_bytes).
+
+    Додатково пам'ятає Telegram file_id, отриманий після першого
+    send_document, щоб повторні відправки йшли за file_id без завантаження
+    PDF з API та повторного upload. Дискові операції (зокрема початкове
+    сканування каталогу) виконуються в окремому потоці.
+    """
+
+    def __init__(self, directory=PDF_CACHE_DIR, max_bytes=PDF_CACHE_MAX_BYTES,
+                 max_file_ids=PDF_CACHE_MAX_FILE_IDS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_file_ids = max_file_ids
+        self._entries = OrderedDict()   # key -> розмір файлу, від найстарішого доступу
+        self._file_ids = OrderedDict()  # key -> Telegram file_id
+        self._size = 0
+        self._loading = None
+        self._log_lines = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pdf-cache')
+        self.hits = 0
+        self.misses = 0
+        self.file_id_hits = 0
+
+    @staticmethod
+    def _safe_key(key):
+        return re.sub(r'[^A-Za-z0-9_.-]', '_', str(key))
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{self._safe_key(key)}.pdf")
+
+    def _scan(self):
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.pdf'):
+                st = os.stat(os.path.join(self.directory, name))
+                files.append((st.st_mtime, name[:-4], st.st_size))
+        files.sort()
+        file_ids = []
+        try:
+            with open(os.path.join(self.directory, FILE_IDS_NAME)) as f:
+                file_ids.extend(json.load(f).items())
+        except (FileNotFoundError, ValueError):
+            pass
+        log_lines = 0
+        try:
+            with open(os.path.join(self.directory, FILE_IDS_LOG)) as f:
+                for line in f:
+                    log_lines += 1
+                    try:
+                        key, file_id = json.loads(line)
+                    except ValueError:
+                        # Обірваний останній рядок після аварійного завершення
+                        continue
+                    file_ids.append((key, file_id))
+        except FileNotFoundError:
+            pass
+        return files, file_ids, log_lines
+
+    async def _load(self):
+        try:
+            files, file_ids, self._log_lines = await self._run(self._scan)
+        except OSError as e:
+            logger.error(f"[PdfCache] Failed to scan {self.directory}: {e}")
+            return
+        for _, key, size in files:
+            self._entries[key] = size
+            self._size += size
+        for key, file_id in file_ids:
+            self._file_ids[key] = file_id
+            self._file_ids.move_to_end(key)
+        while len(self._file_ids) > self.max_file_ids:
+            self._file_ids.popitem(last=False)
+
+    def _ensure_loaded(self):
+        if self._loading is None:
+            self._loading = asyncio.ensure_future(self._load())
+        return asyncio.shield(self._loading)
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def get_file_id(self, key):
+        await self._ensure_loaded()
+        file_id = self._file_ids.get(str(key))
+        if file_id:
+            self._file_ids.move_to_end(str(key))
+            self.file_id_hits += 1
+        return file_id
+
+    async def set_file_id(self, key, file_id):
+        await self._ensure_loaded()
+        key = str(key)
+        self._file_ids[key] = file_id
+        self._file_ids.move_to_end(key)
+        while len(self._file_ids) > self.max_file_ids:
+            self._file_ids.popitem(last=False)
+        self._log_lines += 1
+        try:
+            if self._log_lines > 2 * self.max_file_ids:
+                self._log_lines = len(self._file_ids)
+                await self._run(self._rewrite_file_ids, list(self._file_ids.items()))
+            else:
+                await self._run(self._append_file_id, key, file_id)
+        except OSError as e:
+            logger.error(f"[PdfCache] Failed to store file_id for {key}: {e}")
+
+    def _append_file_id(self, key, file_id):
+        with open(os.path.join(self.directory, FILE_IDS_LOG), 'a') as f:
+            f.write(json.dumps([key, file_id]) + '\n')
+
+    def _rewrite_file_ids(self, items):
+        path = os.path.join(self.directory, FILE_IDS_LOG)
+        with open(path + '.tmp', 'w') as f:
+            for item in items:
+                f.write(json.dumps(item) + '\n')
+        os.replace(path + '.tmp', path)
+        try:
+            os.remove(os.path.join(self.directory, FILE_IDS_NAME))
+        except FileNotFoundError:
+            pass
+
+    def _read(self, key):
+        path = self._path(key)
+        with open(path, 'rb') as f:
+            data = f.read()
+        os.utime(path)
+        return data
+
+    async def get(self, key):
+        await self._ensure_loaded()
+        safe = self._safe_key(key)
+        if safe not in self._entries:
+            self.misses += 1
+            return None
+        try:
+            data = await self._run(self._read, key)
+        except OSError:
+            self._forget(safe)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(safe)
+        self.hits += 1
+        return data
+
+    def _forget(self, safe):
+        size = self._entries.pop(safe, None)
+        if size is not None:
+            self._size -= size
+
+    def _write(self, key, data, evict):
+        path = self._path(key)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)
+        for safe in evict:
+            try:
+                os.remove(os.path.join(self.directory, f"{safe}.pdf"))
+            except FileNotFoundError:
+                pass
+
+    async def put(self, key, data):
+        await self._ensure_loaded()
+        safe = self._safe_key(key)
+        self._forget(safe)
+        self._entries[safe] = len(data)
+        self._size += len(data)
+        evict = []
+        while self._size > self.max_bytes and len(self._entries) > 1:
+            old, size = self._entries.popitem(last=False)
+            self._size -= size
+            evict.append(old)
+        try:
+            await self._run(self._write, key, data, evict)
+        except OSError as e:
+            self._forget(safe)
+            logger.error(f"[PdfCache] Failed to store PDF {key}: {e}")
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'files': len(self._entries),
+            'bytes': self._size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'file_id_hits': self.file_id_hits,
+            'file_ids': len(self._file_ids)
+        }
+
+    def close(self):
+        self._executor.shutdown(wait=True)
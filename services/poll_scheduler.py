@@ -0,0 +1,193 @@
+# services/poll_scheduler.py
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+from services import metrics
+from services.resilience import backoff_delay
+from config.settings import (
+    POLL_WORKERS, POLL_JITTER, POLL_ERROR_RETRY, POLL_BACKOFF_MAX, POLL_LAG_WARNING, POLL_STATS_LOG_INTERVAL
+)
+
+logger = logging.getLogger(__name__)
+
+
+class PollScheduler:
+    """
+    Центральний планувальник опитування кас.
+
+    Замість окремої задачі на кожну касу тримає чергу з пріоритетом за
+    часом наступного опитування (heapq) і фіксований пул воркерів.
+    Кількість воркерів - це глобальна межа одночасних опитувань, тож
+    кількість запитів "у польоті" не росте разом з кількістю кас.
+    Інтервали розмиваються на +-jitter, щоб каси, додані одночасно,
+    не опитувались синхронно.
+
+    poll_fn(user_id, kasa) - корутина одного циклу опитування;
+    interval_fn(kasa) - інтервал (у секундах) до наступного опитування.
+    """
+
+    def __init__(self, poll_fn, interval_fn, workers=POLL_WORKERS, jitter=POLL_JITTER):
+        self.poll_fn = poll_fn
+        self.interval_fn = interval_fn
+        self.workers = workers
+        self.jitter = jitter
+        self._heap = []            # (due, seq, key)
+        self._entries = {}         # key -> {'user_id', 'kasa', 'due'}
+        self._seq = itertools.count()
+        self._ready = None         # asyncio.Queue з ключами, час яких настав
+        self._wakeup = None
+        self._tasks = []
+        self.in_flight = 0
+        self.polls_done = 0
+        self.lag_max = 0.0
+        self.lag_sum = 0.0
+        self.lag_count = 0
+
+    @property
+    def running(self):
+        return bool(self._tasks)
+
+    def start(self):
+        if self._tasks:
+            return
+        self._ready = asyncio.Queue(maxsize=self.workers)
+        self._wakeup = asyncio.Event()
+        self._tasks.append(asyncio.create_task(self._dispatch()))
+        for n in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(n)))
+        if POLL_STATS_LOG_INTERVAL:
+            self._tasks.append(asyncio.create_task(self._log_stats()))
+        logger.info(f"[PollScheduler] Started with {self.workers} workers")
+
+    async def stop(self):
+        tasks, self._tasks = self._tasks, []
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def add(self, key, user_id, kasa, delay=None):
+        """
+        Додає касу в розклад (повторне додавання ігнорується).
+        Перше опитування розмивається в межах [0, jitter * інтервал).
+        """
+        if key in self._entries:
+            self._entries[key]['kasa'] = kasa
+            return
+        if not self._tasks:
+            self.start()
+        if delay is None:
+            delay = random.uniform(0, self.jitter * self.interval_fn(kasa))
+        self._entries[key] = {'user_id': user_id, 'kasa': kasa, 'due': None, 'errors': 0}
+        self._push(key, delay)
+
+    def remove(self, key):
+        self._entries.pop(key, None)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def _push(self, key, delay):
+        loop = asyncio.get_running_loop()
+        due = loop.time() + max(0.0, delay)
+        self._entries[key]['due'] = due
+        heapq.heappush(self._heap, (due, next(self._seq), key))
+        self._wakeup.set()
+
+    def _jittered(self, interval):
+        if not self.jitter:
+            return interval
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            due, _, key = self._heap[0]
+            entry = self._entries.get(key)
+            if entry is None or entry['due'] != due:
+                # Каса видалена або перепланована - застарілий запис
+                heapq.heappop(self._heap)
+                continue
+            wait = due - loop.time()
+            if wait > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._heap)
+            # Блокується, поки всі воркери зайняті: запити не накопичуються
+            await self._ready.put((key, due))
+
+    async def _worker(self, n):
+        loop = asyncio.get_running_loop()
+        while True:
+            key, due = await self._ready.get()
+            entry = self._entries.get(key)
+            if entry is None:
+                continue
+            kasa = entry['kasa']
+            lag = max(0.0, loop.time() - due)
+            kasa['poll_lag'] = round(lag, 3)
+            self.lag_sum += lag
+            self.lag_count += 1
+            self.lag_max = max(self.lag_max, lag)
+            metrics.POLL_LAG.observe(lag)
+            if lag > POLL_LAG_WARNING:
+                logger.warning(f"[PollScheduler] Kasa '{kasa.get('kasa_name', 'N/A')}' polled {lag:.1f}s late")
+
+            self.in_flight += 1
+            try:
+                await self.poll_fn(entry['user_id'], kasa)
+                entry['errors'] = 0
+                delay = self._jittered(self.interval_fn(kasa))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(f"[PollScheduler] Error polling kasa '{kasa.get('kasa_name', 'N/A')}': {e}")
+                # Помилки поспіль: пауза росте експоненційно, з розкидом між касами
+                entry['errors'] += 1
+                delay = backoff_delay(entry['errors'], POLL_ERROR_RETRY, POLL_BACKOFF_MAX)
+            finally:
+                self.in_flight -= 1
+                self.polls_done += 1
+
+            if key in self._entries:
+                self._push(key, delay)
+
+    def stats(self):
+        """
+        Поточний стан розкладу: кількість кас, запитів у роботі та затримка (lag)
+        між запланованим і фактичним часом опитування.
+        """
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        overdue = [now - e['due'] for e in self._entries.values() if e['due'] is not None and e['due'] < now]
+        return {
+            'kasas': len(self._entries),
+            'workers': self.workers,
+            'in_flight': self.in_flight,
+            'polls_done': self.polls_done,
+            'lag_avg': self.lag_sum / self.lag_count if self.lag_count else 0.0,
+            'lag_max': self.lag_max,
+            'overdue': len(overdue),
+            'overdue_max': max(overdue) if overdue else 0.0
+        }
+
+    async def _log_stats(self):
+        while True:
+            await asyncio.sleep(POLL_STATS_LOG_INTERVAL)
+            st = self.stats()
+            logger.info(
+                f"[PollScheduler] kasas={st['kasas']} in_flight={st['in_flight']} "
+                f"polls={st['polls_done']} lag_avg={st['lag_avg']:.2f}s lag_max={st['lag_max']:.2f}s "
+                f"overdue={st['overdue']} overdue_max={st['overdue_max']:.2f}s"
+            )
+            # Максимум рахується за вікно між записами в лог
+            self.lag_max = 0.0
@@ -0,0 +1,342 @@
+# services/reports.py
+# Звіти за довільний період (/report). Чеки кас за період складаються в
+# стовпці (масиви модуля array, без об'єкта на чек) і групуються за днем,
+# годиною, касою та видом оплати векторно - NumPy, якщо він встановлений,
+# інакше одним проходом Python по стовпцях. Закриті зміни беруться з
+# журналу (utils.ledger): повторний звіт за минулий період не звертається до API.
+import asyncio
+import logging
+from array import array
+from datetime import date, datetime, time, timedelta, timezone
+try:
+    import numpy as np
+except ImportError:  # NumPy - необов'язкова залежність
+    np = None
+from services.checkbox_api import ReceiptsTruncatedError, get_cashier_token, get_shifts, get_shift_info, iter_receipts
+from utils.ledger import shift_receipts_count
+from utils.receipt import KYIV_TZ, ReceiptType, datetime_to_us, parse_timestamp, us_to_datetime
+from utils.shift_totals import SERVICE_TYPES, allocate_payments, empty_totals
+from config.settings import REPORT_MAX_DAYS
+
+logger = logging.getLogger(__name__)
+
+HOUR_US = 3600 * 1_000_000
+DAY_US = 24 * HOUR_US
+# Зміна триває не довше доби: зміни, відкриті до початку періоду, шукаємо на добу раніше
+SHIFT_LOOKBACK_US = DAY_US
+# Запас на розбіжність годинників при запиті чеків зміни
+FETCH_MARGIN = timedelta(minutes=1)
+_EPOCH_DAY = date(1970, 1, 1)
+
+SELL, RETURN, SERVICE_IN, SERVICE_OUT = range(4)
+_TYPE_CODES = {
+    ReceiptType.SELL: SELL, ReceiptType.UNKNOWN: SELL, ReceiptType.RETURN: RETURN,
+    ReceiptType.SERVICE_IN: SERVICE_IN, ReceiptType.SERVICE_OUT: SERVICE_OUT
+}
+
+# Показники груп звіту: чеки продажу та повернення, нетто-сума, готівка і картки (нетто)
+MEASURES = ('count', 'net', 'cash', 'card')
+
+PERIOD_ALIASES = {
+    'today': 'today', 'сьогодні': 'today',
+    'yesterday': 'yesterday', 'вчора': 'yesterday',
+    'week': 'week', 'тиждень': 'week',
+    'month': 'month', 'місяць': 'month'
+}
+
+
+class ReceiptColumns:
+    """
+    Чеки звіту по стовпцях: kasa - номер каси у звіті, time - created_at
+    (мкс UTC), type - код типу (SELL..SERVICE_OUT), amount - сума чеку
+    (для службових - сума внесення/видачі), cash і card - розподіл оплати
+    (utils.shift_totals.allocate_payments). Суми в копійках, без знаку.
+    """
+
+    def __init__(self):
+        self.kasa = array('i')
+        self.time = array('q')
+        self.type = array('b')
+        self.amount = array('q')
+        self.cash = array('q')
+        self.card = array('q')
+
+    def __len__(self):
+        return len(self.time)
+
+    def extend(self, kasa_idx, receipts):
+        add_kasa, add_time, add_type = self.kasa.append, self.time.append, self.type.append
+        add_amount, add_cash, add_card = self.amount.append, self.cash.append, self.card.append
+        for r in receipts:
+            if r.created_us is None:
+                continue
+            code = _TYPE_CODES[r.type]
+            if code == SERVICE_IN:
+                amount, cash, card = r.total or r.service_in, 0, 0
+            elif code == SERVICE_OUT:
+                amount, cash, card = r.total or r.service_out, 0, 0
+            else:
+                amount = r.total
+                cash, card = allocate_payments(r)
+            add_kasa(kasa_idx)
+            add_time(r.created_us)
+            add_type(code)
+            add_amount(amount)
+            add_cash(cash)
+            add_card(card)
+
+
+def _kyiv_offset_us(utc_hour):
+    """Зсув часу Києва від UTC (мкс) у годину utc_hour від epoch; перехід на літній час - на межі години."""
+    return int(us_to_datetime(utc_hour * HOUR_US).astimezone(KYIV_TZ).utcoffset().total_seconds()) * 1_000_000
+
+
+def aggregate(columns, from_us, to_us, first_day, days, kasas):
+    """
+    Групує чеки з [from_us, to_us): підсумки періоду (формат
+    utils.shift_totals.empty_totals) і показники MEASURES за днем
+    (0..days-1, first_day - номер першого дня за Києвом від epoch),
+    годиною за Києвом (0..23) і касою (0..kasas-1).
+    """
+    if np is not None:
+        return _aggregate_numpy(columns, from_us, to_us, first_day, days, kasas)
+    return _aggregate_python(columns, from_us, to_us, first_day, days, kasas)
+
+
+def _aggregate_numpy(columns, from_us, to_us, first_day, days, kasas):
+    t = np.frombuffer(columns.time, dtype=np.int64)
+    mask = (t >= from_us) & (t < to_us)
+    t = t[mask]
+    kasa = np.frombuffer(columns.kasa, dtype=np.int32)[mask]
+    code = np.frombuffer(columns.type, dtype=np.int8)[mask]
+    amount = np.frombuffer(columns.amount, dtype=np.int64)[mask]
+    cash = np.frombuffer(columns.cash, dtype=np.int64)[mask]
+    card = np.frombuffer(columns.card, dtype=np.int64)[mask]
+
+    # Зсув від UTC обчислюється раз на кожну годину, в яку є чеки, і розкладається назад на чеки
+    utc_hours, inverse = np.unique(t // HOUR_US, return_inverse=True)
+    offsets = np.array([_kyiv_offset_us(h) for h in utc_hours.tolist()], dtype=np.int64)
+    local = t + offsets[inverse.reshape(-1)]
+
+    sale = code <= RETURN
+    ret = code == RETURN
+    sign = np.where(ret, -1, 1)
+    values = {
+        'count': sale.astype(np.int64),
+        'net': np.where(sale, sign * amount, 0),
+        'cash': sign * cash,
+        'card': sign * card
+    }
+
+    def group(keys, size):
+        return {m: np.rint(np.bincount(keys, weights=v, minlength=size)).astype(np.int64).tolist()
+                for m, v in values.items()}
+
+    totals = empty_totals()
+    totals.update({
+        'count': int(sale.sum()),
+        'sales': int(amount[code == SELL].sum()),
+        'returns': int(amount[ret].sum()),
+        'returns_count': int(ret.sum()),
+        'cash': int(values['cash'].sum()),
+        'card': int(values['card'].sum()),
+        'service_in': int(amount[code == SERVICE_IN].sum()),
+        'service_out': int(amount[code == SERVICE_OUT].sum())
+    })
+    return {
+        'totals': totals,
+        'by_day': group(local // DAY_US - first_day, days),
+        'by_hour': group(local // HOUR_US % 24, 24),
+        'by_kasa': group(kasa, kasas)
+    }
+
+
+def _aggregate_python(columns, from_us, to_us, first_day, days, kasas):
+    totals = empty_totals()
+    by_day = {m: [0] * days for m in MEASURES}
+    by_hour = {m: [0] * 24 for m in MEASURES}
+    by_kasa = {m: [0] * kasas for m in MEASURES}
+    offsets = {}
+    rows = zip(columns.kasa, columns.time, columns.type, columns.amount, columns.cash, columns.card)
+    for kasa, t, code, amount, cash, card in rows:
+        if t < from_us or t >= to_us:
+            continue
+        if code == SERVICE_IN:
+            totals['service_in'] += amount
+            continue
+        if code == SERVICE_OUT:
+            totals['service_out'] += amount
+            continue
+        utc_hour = t // HOUR_US
+        offset = offsets.get(utc_hour)
+        if offset is None:
+            offset = offsets[utc_hour] = _kyiv_offset_us(utc_hour)
+        local = t + offset
+        if code == RETURN:
+            totals['returns'] += amount
+            totals['returns_count'] += 1
+            amount, cash, card = -amount, -cash, -card
+        else:
+            totals['sales'] += amount
+        totals['count'] += 1
+        totals['cash'] += cash
+        totals['card'] += card
+        for grouped, key in ((by_day, local // DAY_US - first_day), (by_hour, local // HOUR_US % 24),
+                             (by_kasa, kasa)):
+            grouped['count'][key] += 1
+            grouped['net'][key] += amount
+            grouped['cash'][key] += cash
+            grouped['card'][key] += card
+    return {'totals': totals, 'by_day': by_day, 'by_hour': by_hour, 'by_kasa': by_kasa}
+
+
+def local_midnight_us(day):
+    return datetime_to_us(KYIV_TZ.localize(datetime.combine(day, time())))
+
+
+def parse_period(args, today):
+    """
+    Період /report: today/сьогодні, yesterday/вчора, week/тиждень (7 днів до
+    сьогодні включно), month/місяць (з 1-го числа), одна дата або дві дати
+    РРРР-ММ-ДД. Без аргументів - тиждень. Повертає (перший день, останній
+    день) включно; ValueError з текстом для користувача.
+    """
+    if not args:
+        args = ['week']
+    if len(args) == 1 and args[0].lower() in PERIOD_ALIASES:
+        period = PERIOD_ALIASES[args[0].lower()]
+        if period == 'today':
+            return today, today
+        if period == 'yesterday':
+            day = today - timedelta(days=1)
+            return day, day
+        if period == 'week':
+            return today - timedelta(days=6), today
+        return today.replace(day=1), today
+    if len(args) > 2:
+        raise ValueError("Забагато аргументів періоду.")
+    try:
+        days = [date.fromisoformat(a) for a in args]
+    except ValueError:
+        raise ValueError(f"Не вдалося розібрати період: {' '.join(args)}.")
+    from_day, to_day = days[0], days[-1]
+    if from_day > to_day:
+        raise ValueError("Початок періоду пізніше за кінець.")
+    if from_day > today:
+        raise ValueError("Період ще не настав.")
+    to_day = min(to_day, today)
+    if (to_day - from_day).days + 1 > REPORT_MAX_DAYS:
+        raise ValueError(f"Період довший за {REPORT_MAX_DAYS} днів.")
+    return from_day, to_day
+
+
+async def load_kasa_receipts(ledger, kasa, from_us, to_us, stats):
+    """
+    Чеки каси зі змін, що перетинаються з [from_us, to_us).
+
+    Список змін запитується в API лише за ту частину проміжку, якої ще немає
+    в журналі (ledger.coverage). Чеки зміни, позначеної повною, беруться з
+    журналу; решта - з API (від найновіших, доки кількість не збіжеться),
+    після чого закрита зміна позначається повною,
+    якщо кількість чеків у журналі збігається з даними API. Зміна, відкрита
+    на момент отримання списку, спершу оновлюється (GET /shifts/{id}).
+    Повертає (чеки, ok); ok False - частину даних з API отримати не вдалося.
+    """
+    lic = kasa['license_key']
+    ok = True
+    token = None
+
+    async def auth():
+        nonlocal token, ok
+        if token is None:
+            token = await get_cashier_token(lic, kasa['pin_code'])
+            if not token:
+                ok = False
+        return token
+
+    list_from = from_us - SHIFT_LOOKBACK_US
+    now_us = datetime_to_us(datetime.now(timezone.utc))
+    list_to = min(to_us, now_us)
+    covered = await ledger.coverage(lic)
+    if covered is None or covered[0] > list_from or covered[1] < list_to:
+        # Якщо початок уже в кеші, догружаємо лише хвіст проміжку
+        fetch_from = max(list_from, covered[1]) if covered and covered[0] <= list_from else list_from
+        shifts = None
+        if await auth():
+            shifts = await get_shifts(lic, token, us_to_datetime(fetch_from), us_to_datetime(list_to))
+        if shifts is None:
+            ok = False
+        else:
+            await ledger.add_shifts(lic, shifts)
+            await ledger.add_coverage(lic, fetch_from, list_to)
+
+    receipts = []
+    for sh in await ledger.shifts_between(lic, from_us, to_us):
+        if sh.complete:
+            receipts.extend(await ledger.receipts(sh.id))
+            stats['cached'] += 1
+            continue
+        if not await auth():
+            receipts.extend(await ledger.receipts(sh.id))
+            continue
+        closed_us, expected = sh.closed_us, sh.expected
+        if closed_us is None:
+            info = await get_shift_info(lic, token, sh.id)
+            if info:
+                await ledger.add_shifts(lic, [info])
+                closed_us, expected = parse_timestamp(info.get('closed_at')), shift_receipts_count(info)
+        until = us_to_datetime(closed_us) if closed_us is not None else datetime.now(timezone.utc)
+        try:
+            async with iter_receipts(lic, token, sh.id, us_to_datetime(sh.opened_us) - FETCH_MARGIN,
+                                     until + FETCH_MARGIN, desc=True) as pages:
+                async for page in pages:
+                    await ledger.add_many(sh.id, lic, page)
+                    # Старіші чеки зміни журнал зазвичай уже має з опитування
+                    if expected is not None and await ledger.count(sh.id, exclude_types=SERVICE_TYPES) >= expected:
+                        break
+        except ReceiptsTruncatedError as e:
+            logger.warning(f"[Report] Shift {sh.id}: {e}")
+            ok = False
+        stats['fetched'] += 1
+        if expected is not None:
+            count = await ledger.count(sh.id, exclude_types=SERVICE_TYPES)
+            if count < expected:
+                logger.warning(f"[Report] Shift {sh.id}: {count} receipts in ledger, API reports {expected}")
+                ok = False
+            elif closed_us is not None:
+                await ledger.mark_complete(sh.id)
+        receipts.extend(await ledger.receipts(sh.id))
+    return receipts, ok
+
+
+async def build_report(ledger, kasas, from_day, to_day):
+    """
+    Звіт за дні [from_day, to_day] (дати за Києвом, включно) по касах kasas:
+    результат aggregate плюс період, назви кас, каси з неповними даними
+    та скільки змін узято з кешу / завантажено з API.
+    """
+    from_us = local_midnight_us(from_day)
+    to_us = local_midnight_us(to_day + timedelta(days=1))
+    stats = {'cached': 0, 'fetched': 0}
+    columns = ReceiptColumns()
+
+    async def load(idx, kasa):
+        receipts, ok = await load_kasa_receipts(ledger, kasa, from_us, to_us, stats)
+        columns.extend(idx, receipts)
+        return ok
+
+    results = await asyncio.gather(*(load(idx, kasa) for idx, kasa in enumerate(kasas)))
+    report = aggregate(columns, from_us, to_us, (from_day - _EPOCH_DAY).days,
+                       (to_day - from_day).days + 1, len(kasas))
+    names = [k.get('kasa_name', f"Каса №{idx}") for idx, k in enumerate(kasas, start=1)]
+    report.update({
+        'from': from_day,
+        'to': to_day,
+        'kasas': names,
+        'incomplete': [name for name, ok in zip(names, results) if not ok],
+        'shifts_cached': stats['cached'],
+        'shifts_fetched': stats['fetched']
+    })
+    logger.info(f"[Report] {from_day}..{to_day}, {len(kasas)} kasas: {len(columns)} receipts, "
+                f"shifts cached {stats['cached']}, fetched {stats['fetched']}")
+    return report
@@ -0,0 +1,239 @@
+# services/resilience.py
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from services import metrics
+from utils.rate_limit import TokenBucket
+from config.settings import (
+    CHECKBOX_GLOBAL_RATE, CHECKBOX_GLOBAL_BURST, CHECKBOX_LICENSE_RATE, CHECKBOX_LICENSE_BURST,
+    CHECKBOX_RETRY_AFTER_DEFAULT, CHECKBOX_RETRY_AFTER_MAX, CHECKBOX_MAX_WAIT,
+    BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT, BREAKER_RESET_MAX
+)
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class ApiUnavailableError(Exception):
+    """Запит не надіслано: API зараз недоступне для цієї каси; retry_after - через скільки секунд спробувати."""
+
+    def __init__(self, message, retry_after=0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(ApiUnavailableError):
+    pass
+
+
+class RateLimitedError(ApiUnavailableError):
+    pass
+
+
+def parse_retry_after(value, now=None):
+    """Retry-After у секундах (число або HTTP-дата); None, якщо заголовка немає чи його не розібрати."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    now = now if now is not None else datetime.now(timezone.utc)
+    return max(0.0, (when - now).total_seconds())
+
+
+def backoff_delay(failures, base, cap):
+    """
+    Експоненційна пауза після failures невдач поспіль: base * 2^(failures-1),
+    не більше cap, з розкидом у [половина, ціле] - каси, що впали одночасно,
+    не повертаються до API синхронно.
+    """
+    if failures <= 0:
+        return 0.0
+    delay = min(cap, base * 2 ** min(failures - 1, 32))
+    return random.uniform(delay / 2, delay)
+
+
+class CircuitBreaker:
+    """
+    Запобіжник для однієї пари (каса, група ендпоінтів).
+
+    closed -> open після threshold невдач поспіль; у стані open запити
+    відхиляються без звернення до API. Після паузи (reset_timeout, що
+    подвоюється з кожним повторним відкриттям, до reset_max) - half_open:
+    пропускається один пробний запит; успіх закриває запобіжник, невдача
+    знову відкриває.
+    """
+    __slots__ = ('threshold', 'reset_timeout', 'reset_max', 'state', 'failures', 'trips',
+                 'open_until', 'probe_started')
+
+    def __init__(self, threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT,
+                 reset_max=BREAKER_RESET_MAX):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.reset_max = reset_max
+        self.state = CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.open_until = 0.0
+        self.probe_started = None
+
+    def allow(self, now):
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            if now < self.open_until:
+                return False
+            self.state = HALF_OPEN
+            self.probe_started = None
+        # half_open: один пробний запит; якщо він "завис" (скасовано), за reset_timeout пускаємо наступний
+        if self.probe_started is None or now - self.probe_started > self.reset_timeout:
+            self.probe_started = now
+            return True
+        return False
+
+    def remaining(self, now):
+        return max(0.0, self.open_until - now) if self.state == OPEN else 0.0
+
+    def record_failure(self, now, retry_after=None):
+        """Повертає True, якщо запобіжник щойно відкрився."""
+        self.failures += 1
+        if self.state != HALF_OPEN and self.failures < self.threshold:
+            return False
+        self.trips += 1
+        pause = backoff_delay(self.trips, self.reset_timeout, self.reset_max)
+        self.open_until = now + max(pause, retry_after or 0.0)
+        self.state = OPEN
+        self.probe_started = None
+        return True
+
+
+class ApiGuard:
+    """
+    Захисний шар перед кожним запитом CheckboxClient:
+
+    - token bucket на весь процес і на кожну касу (license_key);
+    - Retry-After: 429 блокує запити каси, 503 - усі запити процесу
+      на вказаний час (не довше retry_after_max);
+    - circuit breaker на (каса, група ендпоінтів), див. CircuitBreaker.
+
+    Короткі очікування (до max_wait) виконуються тут же; якщо чекати
+    довше, запит відхиляється ApiUnavailableError з retry_after, щоб
+    викликач відклав опитування каси, а не тримав воркер планувальника.
+    """
+
+    def __init__(self, global_rate=CHECKBOX_GLOBAL_RATE, global_burst=CHECKBOX_GLOBAL_BURST,
+                 license_rate=CHECKBOX_LICENSE_RATE, license_burst=CHECKBOX_LICENSE_BURST,
+                 max_wait=CHECKBOX_MAX_WAIT):
+        self._global = TokenBucket(global_rate, global_burst) if global_rate > 0 else None
+        self.license_rate = license_rate
+        self.license_burst = license_burst
+        self.max_wait = max_wait
+        self._buckets = {}          # license_key -> TokenBucket
+        self._blocked = {}          # license_key (None - увесь процес) -> monotonic до якого чекати
+        self._breakers = {}         # license_key -> {family: CircuitBreaker}, лише незакриті
+        self.rejected = 0
+
+    def _bucket(self, license_key):
+        bucket = self._buckets.get(license_key)
+        if bucket is None:
+            bucket = self._buckets[license_key] = TokenBucket(self.license_rate, self.license_burst)
+        return bucket
+
+    def _blocked_for(self, license_key, now):
+        return max(self._blocked.get(None, 0.0), self._blocked.get(license_key, 0.0)) - now
+
+    def retry_delay(self, license_key, now=None):
+        """Скільки секунд API ще недоступне для каси (Retry-After або відкритий запобіжник)."""
+        now = now if now is not None else time.monotonic()
+        delay = self._blocked_for(license_key, now)
+        for breaker in self._breakers.get(license_key, {}).values():
+            delay = max(delay, breaker.remaining(now))
+        return max(0.0, delay)
+
+    def _reject(self, error, reason):
+        self.rejected += 1
+        metrics.API_THROTTLED.inc(reason=reason)
+        raise error
+
+    async def before(self, license_key, family):
+        now = time.monotonic()
+        blocked = self._blocked_for(license_key, now)
+        if blocked > self.max_wait:
+            self._reject(RateLimitedError(f"Retry-After: API blocked for {blocked:.0f}s", blocked), 'retry_after')
+        breaker = self._breakers.get(license_key, {}).get(family)
+        if breaker is not None and not breaker.allow(now):
+            self._reject(CircuitOpenError(f"Circuit open for '{family}'", breaker.remaining(now)), 'circuit_open')
+
+        wait = max(0.0, blocked)
+        if self.license_rate > 0 and license_key:
+            wait = max(wait, self._bucket(license_key).reserve(now))
+        if self._global is not None:
+            wait = max(wait, self._global.reserve(now))
+        if wait > 0:
+            metrics.API_THROTTLED.inc(reason='rate_limit')
+            await asyncio.sleep(wait)
+
+    def after(self, license_key, family, status, headers):
+        now = time.monotonic()
+        if status in (429, 503):
+            retry_after = parse_retry_after((headers or {}).get('Retry-After'))
+            if retry_after is None:
+                retry_after = CHECKBOX_RETRY_AFTER_DEFAULT
+            retry_after = min(retry_after, CHECKBOX_RETRY_AFTER_MAX)
+            scope = license_key if status == 429 else None
+            self._blocked[scope] = max(self._blocked.get(scope, 0.0), now + retry_after)
+            logger.warning(f"[ApiGuard] {status} from API, pausing "
+                           f"{'kasa requests' if scope else 'all requests'} for {retry_after:.0f}s")
+            self._failure(license_key, family, now, retry_after)
+        elif status >= 500:
+            self._failure(license_key, family, now)
+        else:
+            families = self._breakers.get(license_key)
+            breaker = families.pop(family, None) if families else None
+            if breaker is not None:
+                # Закритий запобіжник без невдач не потрібен - не тримаємо його в пам'яті
+                if breaker.state != CLOSED:
+                    logger.info(f"[ApiGuard] Circuit for '{family}' closed")
+                if not families:
+                    del self._breakers[license_key]
+
+    def failed(self, license_key, family):
+        """Мережева помилка або тайм-аут запиту."""
+        self._failure(license_key, family, time.monotonic())
+
+    def _failure(self, license_key, family, now, retry_after=None):
+        families = self._breakers.setdefault(license_key, {})
+        breaker = families.get(family)
+        if breaker is None:
+            breaker = families[family] = CircuitBreaker()
+        if breaker.record_failure(now, retry_after):
+            logger.warning(f"[ApiGuard] Circuit for '{family}' opened for "
+                           f"{breaker.remaining(now):.0f}s after {breaker.failures} failures")
+
+    def breaker_states(self, license_key):
+        """Стан запобіжників каси, що не закриті: {група: 'open' | 'half_open' | 'closed'}."""
+        return {family: b.state for family, b in self._breakers.get(license_key, {}).items()
+                if b.state != CLOSED}
+
+    def stats(self):
+        states = [b.state for families in self._breakers.values() for b in families.values()]
+        return {
+            'open': states.count(OPEN),
+            'half_open': states.count(HALF_OPEN),
+            'blocked': sum(1 for until in self._blocked.values() if until > time.monotonic()),
+            'rejected': self.rejected
+        }
@@ -0,0 +1,513 @@
+# services/sharding.py
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+import pickle
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from services import metrics
+from utils.log_config import setup_logging, forward_logs
+from config.settings import POLL_SHARDS, SHARD_STATS_INTERVAL, SHARD_RESTART_DELAY, SHARD_STOP_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+# Поля каси, якими керує фронт-процес; воркер не перезаписує їх своїм станом
+FRONT_FIELDS = ('license_key', 'pin_code', 'kasa_name', 'task_started')
+
+
+def shard_ledger_path(idx, path=None):
+    """Журнал чеків воркера idx: окремий файл поруч із LEDGER_DB_FILE (data/ledger.shard-0.db)."""
+    if path is None:
+        from config.settings import LEDGER_DB_FILE as path
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard-{idx}{ext}"
+
+
+def shard_for(license_key, shards):
+    """
+    Номер воркера для каси: rendezvous (HRW) хеш ключа ліцензії.
+    Стабільний між запусками; при зміні кількості воркерів переїжджає
+    лише частка кас, що припадала на доданий/прибраний воркер.
+    """
+    best, best_score = 0, None
+    for idx in range(shards):
+        score = hashlib.blake2b(f"{idx}:{license_key}".encode(), digest_size=8).digest()
+        if best_score is None or score > best_score:
+            best, best_score = idx, score
+    return best
+
+
+class _Channel:
+    """
+    Кінець Pipe між процесами. Повідомлення серіалізуються одразу (знімок
+    стану на момент виклику), а надсилаються в окремому потоці, тож event
+    loop не блокується, якщо інший бік зайнятий, і обидва боки завжди
+    встигають читати (без взаємного блокування на повному буфері).
+    """
+
+    def __init__(self, conn, name):
+        self.conn = conn
+        self.name = name
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'ipc-{name}')
+        self.closed = False
+        self._shut = False
+
+    def send(self, *msg):
+        if self.closed:
+            return
+        data = pickle.dumps(msg, protocol=pickle.HIGHEST_PROTOCOL)
+        self._executor.submit(self._send_bytes, data)
+
+    def _send_bytes(self, data):
+        try:
+            self.conn.send_bytes(data)
+        except (OSError, EOFError) as e:
+            if not self.closed:
+                logger.error(f"[Shards] IPC send to {self.name} failed: {e}")
+            self.closed = True
+
+    def listen(self, loop, on_message, on_close):
+        def readable():
+            try:
+                while self.conn.poll():
+                    on_message(self.conn.recv())
+            except (EOFError, OSError):
+                loop.remove_reader(self.conn.fileno())
+                self.closed = True
+                on_close()
+        loop.add_reader(self.conn.fileno(), readable)
+
+    def close(self):
+        """
+        Не блокує event loop: Pipe закривається в потоці відправки після
+        повідомлень, що ще в черзі (потік завершується при виході процесу).
+        """
+        self.closed = True
+        if self._shut:
+            return
+        self._shut = True
+        try:
+            asyncio.get_running_loop().remove_reader(self.conn.fileno())
+        except (RuntimeError, ValueError, OSError):
+            pass
+        self._executor.submit(self.conn.close)
+        self._executor.shutdown(wait=False)
+
+
+class ShardSupervisor:
+    """
+    Фронт-процес режиму шардування: запускає POLL_SHARDS процесів-воркерів
+    і розподіляє між ними каси за shard_for(license_key).
+
+    Воркери опитують каси й синхронізують чеки; фронт лишається власником
+    Dispatcher, черги відправки Telegram і збереження стану:
+      воркер -> фронт: ('deliver', item, priority) - у DeliveryQueue;
+                       ('state', user_id, kasa) - стан каси після циклу;
+                       ('stats', stats) - стан планувальника воркера;
+                       ('metrics', idx, snapshot) - лічильники й гістограми
+                       воркера, додаються до /metrics фронту;
+      фронт -> воркер: ('assign', user_id, kasa), ('update', user_id, license_key, fields),
+                       ('remove', user_id, license_key), ('stop',);
+                       ('rejected', user_id, checkpoint) - черга не прийняла
+                       сповіщення про чек, воркер відкочує курсор каси.
+
+    Сповіщення про чеки несуть checkpoint (handlers.start.receipt_checkpoint).
+    Якщо черга фронту переповнена, воркеру повертається checkpoint першого
+    відхиленого чека, а наступні сповіщення каси з тим самим epoch
+    відкидаються, доки воркер не відкотить курсор: інакше після повтору
+    вони надійшли б двічі.
+
+    Додавання/видалення кас не зачіпає інших; воркер, що завершився
+    аварійно, перезапускається і отримує свої каси знову. resize() змінює
+    кількість воркерів і переносить лише каси, номер воркера яких змінився.
+    """
+
+    def __init__(self, get_kasa, on_deliver, on_state, shards=POLL_SHARDS):
+        self.shards = shards
+        self.get_kasa = get_kasa        # (user_id, license_key) -> поточний словник каси або None
+        self.on_deliver = on_deliver    # корутина (item, priority) -> прийнято; викликається по черзі
+        self.on_state = on_state
+        self._ctx = multiprocessing.get_context('spawn')
+        self._procs = [None] * shards
+        self._channels = [None] * shards
+        self._stats = [None] * shards
+        self._assigned = {}             # (user_id, license_key) -> номер воркера
+        self._deliveries = deque()
+        self._deliver_task = None
+        self._rejected = {}             # (user_id, license_key) -> checkpoint першого відхиленого сповіщення
+        self.rejected = 0
+        self._stopping = False
+        self._log_queue = None
+        self._log_listener = None
+        self.restarts = 0
+
+    @property
+    def running(self):
+        return any(p is not None for p in self._procs)
+
+    def start(self):
+        if self.running:
+            return
+        # Логи воркерів пише цей процес (один файл, одна ротація)
+        self._log_queue = self._ctx.Queue()
+        self._log_listener = forward_logs(self._log_queue)
+        for idx in range(self.shards):
+            self._spawn(idx)
+        logger.info(f"[Shards] Started {self.shards} polling workers")
+
+    def _spawn(self, idx):
+        parent, child = self._ctx.Pipe(duplex=True)
+        proc = self._ctx.Process(target=worker_main, args=(idx, child, self._log_queue), name=f'kasa-shard-{idx}', daemon=True)
+        proc.start()
+        child.close()
+        channel = _Channel(parent, f'shard-{idx}')
+        channel.listen(asyncio.get_running_loop(), self._on_message, lambda: self._on_exit(idx))
+        self._procs[idx] = proc
+        self._channels[idx] = channel
+        for key, shard in list(self._assigned.items()):
+            if shard == idx:
+                self._send_assign(idx, *key)
+                self._send_rejected(key)
+
+    def _on_message(self, msg):
+        kind = msg[0]
+        if kind == 'deliver':
+            # Одна задача на всі відправки: порядок повідомлень зберігається
+            self._deliveries.append((msg[1], msg[2]))
+            if self._deliver_task is None or self._deliver_task.done():
+                self._deliver_task = asyncio.ensure_future(self._drain_deliveries())
+        elif kind == 'state':
+            self.on_state(msg[1], msg[2])
+        elif kind == 'stats':
+            if msg[1] < self.shards:
+                self._stats[msg[1]] = msg[2]
+        elif kind == 'metrics':
+            metrics.REGISTRY.set_remote(f'shard-{msg[1]}', msg[2])
+
+    async def _drain_deliveries(self):
+        while self._deliveries:
+            item, priority = self._deliveries.popleft()
+            checkpoint = item.get('checkpoint')
+            key = (item['chat_id'], checkpoint['license_key']) if checkpoint else None
+            rejected = self._rejected.get(key) if key is not None else None
+            if rejected is not None and rejected['epoch'] >= checkpoint['epoch']:
+                # Надіслано до відкату курсора - воркер повторить цей чек
+                continue
+            try:
+                accepted = await self.on_deliver(item, priority)
+            except Exception:
+                logger.exception(f"[Shards] Failed to deliver message for chat {item.get('chat_id')}")
+                accepted = False
+            if not accepted and key is not None:
+                self._rejected[key] = checkpoint
+                self.rejected += 1
+                self._send_rejected(key)
+
+    def _send_rejected(self, key):
+        # Повторюється і для перезапущеного чи нового воркера каси: воркер
+        # ігнорує checkpoint, якщо вже відкотив курсор (epoch каси більший)
+        checkpoint = self._rejected.get(key)
+        idx = self._assigned.get(key)
+        if checkpoint is not None and idx is not None and self._channels[idx] is not None:
+            self._channels[idx].send('rejected', key[0], checkpoint)
+
+    def _on_exit(self, idx):
+        if self._stopping or idx >= self.shards or self._procs[idx] is None:
+            return
+        proc = self._procs[idx]
+        code = proc.exitcode if proc is not None else None
+        logger.error(f"[Shards] Worker {idx} exited (code {code}), restarting in {SHARD_RESTART_DELAY}s")
+        self._stats[idx] = None
+        metrics.REGISTRY.retire_remote(f'shard-{idx}')
+        self.restarts += 1
+        asyncio.get_running_loop().call_later(SHARD_RESTART_DELAY, self._restart, idx)
+
+    def _restart(self, idx):
+        if self._stopping or idx >= self.shards:
+            return
+        old = self._channels[idx]
+        if old is not None:
+            old.close()
+        self._spawn(idx)
+
+    def _send_assign(self, idx, user_id, license_key):
+        kasa = self.get_kasa(user_id, license_key)
+        if kasa is None:
+            self.remove(user_id, license_key)
+            return
+        self._channels[idx].send('assign', user_id, dict(kasa))
+
+    def assign(self, user_id, kasa):
+        """Додає касу в опитування її воркером (повторний виклик оновлює дані каси)."""
+        if not self.running:
+            self.start()
+        key = (user_id, kasa['license_key'])
+        idx = shard_for(kasa['license_key'], self.shards)
+        self._assigned[key] = idx
+        self._send_assign(idx, *key)
+
+    def update(self, user_id, license_key, fields):
+        """
+        Змінює поля каси у воркері, що її опитує. Стан каси веде воркер,
+        тож інакше зміна на фронті (крім FRONT_FIELDS) була б перезаписана
+        наступним повідомленням 'state'.
+        """
+        idx = self._assigned.get((user_id, license_key))
+        if idx is not None and self._channels[idx] is not None:
+            self._channels[idx].send('update', user_id, license_key, dict(fields))
+
+    def remove(self, user_id, license_key):
+        self._rejected.pop((user_id, license_key), None)
+        idx = self._assigned.pop((user_id, license_key), None)
+        if idx is not None and self._channels[idx] is not None:
+            self._channels[idx].send('remove', user_id, license_key)
+
+    async def resize(self, shards):
+        """
+        Змінює кількість воркерів. Каса переїжджає, лише якщо shard_for дає
+        для неї інший номер; новий воркер отримує її з останнім станом фронту.
+        """
+        if shards == self.shards:
+            return
+        old = self.shards
+        moved = []
+        for key, idx in list(self._assigned.items()):
+            new = shard_for(key[1], shards)
+            if new != idx:
+                if self._channels[idx] is not None:
+                    self._channels[idx].send('remove', *key)
+                self._assigned[key] = new
+                moved.append((new, key))
+        self.shards = shards
+        if shards > old:
+            self._procs.extend([None] * (shards - old))
+            self._channels.extend([None] * (shards - old))
+            self._stats.extend([None] * (shards - old))
+        running = any(p is not None for p in self._procs)
+        for idx in range(old, shards):
+            if running:
+                # Новий воркер отримує свої каси при запуску (_spawn)
+                self._spawn(idx)
+        for new, key in moved:
+            if running and new < old:
+                self._send_assign(new, *key)
+                self._send_rejected(key)
+        if shards < old:
+            retired = list(range(shards, old))
+            await self._stop_workers(retired, SHARD_STOP_TIMEOUT)
+            del self._procs[shards:], self._channels[shards:], self._stats[shards:]
+        logger.info(f"[Shards] Resized from {old} to {shards} workers, {len(moved)} kasas moved")
+
+    def __contains__(self, key):
+        return key in self._assigned
+
+    def stats(self):
+        """Зведений стан планувальників усіх воркерів (формат PollScheduler.stats)."""
+        parts = [s for s in self._stats if s]
+        if not parts:
+            return None
+        polls = sum(s['lag_count'] for s in parts)
+        return {
+            'kasas': sum(s['kasas'] for s in parts),
+            'in_flight': sum(s['in_flight'] for s in parts),
+            'workers': sum(s['workers'] for s in parts),
+            'polls_done': sum(s['polls_done'] for s in parts),
+            'lag_avg': sum(s['lag_avg'] * s['lag_count'] for s in parts) / polls if polls else 0.0,
+            'lag_max': max(s['lag_max'] for s in parts),
+            'overdue': sum(s['overdue'] for s in parts),
+            'overdue_max': max(s['overdue_max'] for s in parts),
+            'shards': f"{len(parts)}/{self.shards}",
+            'restarts': self.restarts,
+            'rejected': self.rejected
+        }
+
+    async def _stop_workers(self, indexes, timeout):
+        procs = {idx: self._procs[idx] for idx in indexes if self._procs[idx] is not None}
+        # Воркер вважається зупиненим наперед: його вихід не спричиняє перезапуску
+        for idx in indexes:
+            self._procs[idx] = None
+            if self._channels[idx] is not None:
+                self._channels[idx].send('stop')
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + timeout
+        for idx, proc in procs.items():
+            await loop.run_in_executor(None, proc.join, max(0.1, deadline - time.monotonic()))
+            if proc.is_alive():
+                logger.warning(f"[Shards] Worker {idx} did not stop in time, terminating")
+                proc.terminate()
+                await loop.run_in_executor(None, proc.join)
+        # Останні повідомлення воркерів (стан, відправки) ще можуть бути в Pipe
+        for idx in indexes:
+            channel = self._channels[idx]
+            if channel is None:
+                continue
+            try:
+                while channel.conn.poll():
+                    self._on_message(channel.conn.recv())
+            except (EOFError, OSError):
+                pass
+            channel.close()
+            self._channels[idx] = None
+            self._stats[idx] = None
+            metrics.REGISTRY.retire_remote(f'shard-{idx}')
+
+    async def stop(self, timeout=SHARD_STOP_TIMEOUT):
+        self._stopping = True
+        await self._stop_workers(range(self.shards), timeout)
+        if self._deliver_task is not None:
+            await self._deliver_task
+        if self._log_listener is not None:
+            self._log_listener.stop()
+            self._log_listener = None
+
+
+class _WorkerDelivery:
+    """Замість DeliveryQueue у воркері: повідомлення передаються фронту."""
+
+    def __init__(self, channel):
+        self.channel = channel
+
+    def enqueue(self, item, priority):
+        self.channel.send('deliver', item, priority)
+        return True
+
+    async def stop(self, drain_timeout=0):
+        pass
+
+
+class _NullPdfCache:
+    """
+    Кеш PDF у воркері: PDF завжди береться з API і передається фронту разом
+    із повідомленням. Індекс дискового кешу і file_id веде лише фронт
+    (див. handlers.start.deliver_shard_item), щоб обмеження розміру та
+    file_id не розходились між процесами.
+    """
+
+    async def get(self, key):
+        return None
+
+    async def put(self, key, data):
+        pass
+
+    async def get_file_id(self, key):
+        return None
+
+    async def set_file_id(self, key, file_id):
+        pass
+
+    def stats(self):
+        return {}
+
+    def close(self):
+        pass
+
+
+class _NullPersister:
+    """Стан кас у воркері не зберігається: єдиний записувач - фронт-процес."""
+
+    def mark_dirty(self):
+        pass
+
+    async def stop(self):
+        pass
+
+
+def worker_main(idx, conn, log_queue):
+    setup_logging(log_queue)
+    try:
+        asyncio.run(_worker(idx, conn))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _worker(idx, conn):
+    import handlers.start as start
+    from services.checkbox_api import CheckboxClient, set_client
+    from services.poll_scheduler import PollScheduler
+    from utils.ledger import ReceiptLedger
+
+    loop = asyncio.get_running_loop()
+    channel = _Channel(conn, 'front')
+    client = CheckboxClient()
+    set_client(client)
+    # Мінімальна ініціалізація воркера: без сховища кас (його відкриває лише
+    # фронт, utils.storage.open_storage), без збереження стану і без кешу PDF.
+    # Журнал чеків - власний файл воркера: процеси не ділять одну базу SQLite
+    start.kasas_data.clear()
+    start.ledger = ReceiptLedger(shard_ledger_path(idx))
+    start.persister = _NullPersister()
+    start.delivery = _WorkerDelivery(channel)
+    start.pdf_cache = _NullPdfCache()
+    stopped = asyncio.Event()
+
+    async def poll(user_id, kasa):
+        start.rollback_receipts(kasa)
+        try:
+            await start.poll_kasa_once(user_id, kasa)
+        finally:
+            channel.send('state', user_id, kasa)
+
+    start.scheduler = scheduler = PollScheduler(poll, start.poll_interval)
+
+    def find(user_id, license_key):
+        for i, k in enumerate(start.kasas_data.get(user_id, [])):
+            if k['license_key'] == license_key:
+                return i
+        return None
+
+    def on_message(msg):
+        kind = msg[0]
+        if kind == 'assign':
+            _, user_id, kasa = msg
+            kasas = start.kasas_data.setdefault(user_id, [])
+            i = find(user_id, kasa['license_key'])
+            if i is None:
+                kasas.append(kasa)
+                scheduler.add((user_id, kasa['license_key']), user_id, kasas[-1])
+            else:
+                # Каса вже опитується - оновлюємо лише дані, якими керує фронт
+                kasas[i].update({f: kasa[f] for f in FRONT_FIELDS if f in kasa})
+        elif kind == 'update':
+            _, user_id, license_key, fields = msg
+            i = find(user_id, license_key)
+            if i is not None:
+                start.kasas_data[user_id][i].update(fields)
+        elif kind == 'rejected':
+            _, user_id, checkpoint = msg
+            i = find(user_id, checkpoint['license_key'])
+            if i is not None:
+                start.note_rejected_receipts(start.kasas_data[user_id][i], checkpoint)
+        elif kind == 'remove':
+            _, user_id, license_key = msg
+            scheduler.remove((user_id, license_key))
+            i = find(user_id, license_key)
+            if i is not None:
+                start.kasas_data[user_id].pop(i)
+        elif kind == 'stop':
+            stopped.set()
+
+    async def report_stats():
+        while True:
+            st = scheduler.stats()
+            st['lag_count'] = scheduler.lag_count
+            channel.send('stats', idx, st)
+            channel.send('metrics', idx, metrics.REGISTRY.snapshot())
+            await asyncio.sleep(SHARD_STATS_INTERVAL)
+
+    channel.listen(loop, on_message, stopped.set)
+    scheduler.start()
+    stats_task = asyncio.create_task(report_stats())
+    logger.info(f"[Shards] Worker {idx} started")
+    try:
+        await stopped.wait()
+    finally:
+        stats_task.cancel()
+        await scheduler.stop()
+        await client.close()
+        start.ledger.close()
+        channel.send('metrics', idx, metrics.REGISTRY.snapshot())
+        channel.close()
+        logger.info(f"[Shards] Worker {idx} stopped")
@@ -0,0 +1,127 @@
+# services/token_manager.py
+import asyncio
+import base64
+import json
+import logging
+import time
+from config.settings import CASHIER_TOKEN_TTL, CASHIER_TOKEN_REFRESH_MARGIN
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def token_expiry(token, default_ttl=CASHIER_TOKEN_TTL):
+    """
+    Повертає час закінчення дії токена (epoch-секунди).
+    Токен касира Checkbox - це JWT, тож читаємо поле exp без перевірки підпису.
+    Якщо прочитати не вдалося - рахуємо від поточного часу з default_ttl.
+    """
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        exp = json.loads(base64.urlsafe_b64decode(payload)).get('exp')
+        if exp:
+            return float(exp)
+    except Exception:
+        pass
+    return time.time() + default_ttl
+
+
+class TokenManager:
+    """
+    Кеш токенів касира за (license_key, pin_code).
+
+    - токен оновлюється за refresh_margin секунд до закінчення дії;
+    - одночасні запити на оновлення однієї каси чекають на одну спільну
+      авторизацію (single-flight);
+    - reauthenticate() викликається при 401 і не авторизується повторно,
+      якщо токен уже оновив інший викликач;
+    - якщо дострокове оновлення не вдалося, повертається попередній токен,
+      поки він ще дійсний.
+    """
+
+    def __init__(self, signin, refresh_margin=CASHIER_TOKEN_REFRESH_MARGIN):
+        self._signin = signin
+        self.refresh_margin = refresh_margin
+        self._tokens = {}          # (license_key, pin_code) -> (token, expires_at)
+        self._inflight = {}        # (license_key, pin_code) -> asyncio.Task
+        self._key_by_token = {}    # token -> (license_key, pin_code)
+        self._last_key = {}        # license_key -> (license_key, pin_code)
+        self.refresh_count = 0
+        self.failure_count = 0
+
+    def expires_at(self, license_key, pin_code):
+        cached = self._tokens.get((license_key, pin_code))
+        return cached[1] if cached else None
+
+    async def get_token(self, license_key, pin_code):
+        key = (license_key, pin_code)
+        self._last_key[license_key] = key
+        cached = self._tokens.get(key)
+        if cached and cached[1] - self.refresh_margin > time.time():
+            return cached[0]
+        return await self._refresh(key)
+
+    async def reauthenticate(self, license_key, stale_token):
+        """
+        Примусове оновлення після 401. Повертає актуальний токен або None.
+        """
+        key = self._key_by_token.get(stale_token) or self._last_key.get(license_key)
+        if key is None:
+            return None
+        cached = self._tokens.get(key)
+        if cached and cached[0] != stale_token:
+            # Інший викликач уже отримав новий токен
+            return cached[0]
+        self._drop(key)
+        return await self._refresh(key)
+
+    def _drop(self, key):
+        cached = self._tokens.pop(key, None)
+        if cached:
+            self._key_by_token.pop(cached[0], None)
+
+    async def _refresh(self, key):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._signin_and_store(key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, k=key: self._inflight.pop(k, None))
+        return await asyncio.shield(task)
+
+    def _keep_cached(self, key, reason):
+        """Рахує невдале оновлення; повертає кешований токен, якщо він ще дійсний."""
+        self.failure_count += 1
+        metrics.TOKEN_REFRESH_FAILURES.inc()
+        cached = self._tokens.get(key)
+        if cached and cached[1] > time.time():
+            logger.warning(f"[TokenManager] Early refresh failed for license {key[0][:6]}... ({reason}), "
+                           f"keeping current token for {int(cached[1] - time.time())}s")
+            return cached[0]
+        return None
+
+    async def _signin_and_store(self, key):
+        license_key, pin_code = key
+        try:
+            token = await self._signin(license_key, pin_code)
+        except Exception as e:
+            # Мережа, ApiUnavailableError, CircuitOpenError: поки поточний
+            # токен дійсний, збій дострокового оновлення не зупиняє опитування
+            token = self._keep_cached(key, e)
+            if token is None:
+                raise
+            return token
+        if not token:
+            token = self._keep_cached(key, 'no token')
+            if token is None:
+                self._drop(key)
+            return token
+        self.refresh_count += 1
+        metrics.TOKEN_REFRESHES.inc()
+        self._drop(key)
+        expires_at = token_expiry(token)
+        self._tokens[key] = (token, expires_at)
+        self._key_by_token[token] = key
+        logger.info(f"[TokenManager] Cashier token refreshed for license {license_key[:6]}..., "
+                    f"valid for {int(expires_at - time.time())}s")
+        return token
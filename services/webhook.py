@@ -0,0 +1,61 @@
+# services/webhook.py
+import asyncio
+import logging
+import secrets
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from config.settings import WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SECRET
+
+logger = logging.getLogger(__name__)
+
+
+def build_webhook_app(dp, bot, path=WEBHOOK_PATH, secret_token=None):
+    """
+    aiohttp-застосунок, що приймає оновлення Telegram на path.
+    Запити без правильного X-Telegram-Bot-Api-Secret-Token відхиляються (401);
+    без секрету застосунок не створюється, бо інакше будь-хто, хто дістанеться
+    до порту, зможе надсилати команди від імені будь-якого користувача.
+    Оновлення обробляються у фоні в тому ж event loop, що й опитування кас,
+    тож Telegram отримує відповідь одразу.
+    """
+    if not secret_token:
+        raise ValueError("Webhook secret token is required")
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret_token).register(app, path=path)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def serve_webhook(dp, bot, url=WEBHOOK_URL, path=WEBHOOK_PATH,
+                        host=WEBHOOK_HOST, port=WEBHOOK_PORT, secret_token=WEBHOOK_SECRET):
+    """
+    Режим webhook: слухає host:port і реєструє webhook у Telegram (якщо задано url).
+    Без url webhook не реєструється - зручно для локальної перевірки або
+    коли його налаштовано вручну за reverse proxy; тоді WEBHOOK_SECRET
+    обов'язковий, бо саме з ним webhook зареєстровано. Працює до скасування.
+    """
+    if not secret_token:
+        if not url:
+            raise RuntimeError("WEBHOOK_SECRET is required when WEBHOOK_URL is not set")
+        # Секрет змінюється з кожним запуском; webhook реєструється заново
+        secret_token = secrets.token_urlsafe(32)
+    app = build_webhook_app(dp, bot, path, secret_token)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+        if url:
+            # Оновлення, що надійшли під час перемикання режимів, не відкидаються
+            await bot.set_webhook(
+                f"{url.rstrip('/')}{path}",
+                secret_token=secret_token,
+                allowed_updates=dp.resolve_used_update_types(),
+                drop_pending_updates=False
+            )
+            logger.info(f"[Webhook] Registered webhook {url.rstrip('/')}{path}")
+        else:
+            logger.warning("[Webhook] WEBHOOK_URL is not set, webhook is not registered in Telegram")
+        logger.info(f"[Webhook] Listening on http://{host}:{port}{path}")
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
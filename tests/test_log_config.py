@@ -0,0 +1,47 @@
+# tests/test_log_config.py
+import logging
+from utils.log_config import UNSAMPLED, SamplingFilter
+
+
+def record(name, msg, level=logging.INFO, created=1000.0, extra=None):
+    rec = logging.getLogger(name).makeRecord(name, level, __file__, 1, msg, None, None, extra=extra)
+    rec.created = created
+    return rec
+
+
+def passed(flt, *records):
+    return [flt.filter(r) for r in records]
+
+
+def test_repetitive_poll_lines_are_sampled():
+    flt = SamplingFilter(window=60, burst=2, loggers=('handlers.start',))
+    lines = [record('handlers.start', f"[poll_kasa_once] Polling kasa: K{i} for user: u") for i in range(4)]
+    assert passed(flt, *lines) == [True, True, False, False]
+    assert flt.dropped == 2
+
+    # Наступне вікно: перший запис несе кількість відкинутих
+    later = record('handlers.start', "[poll_kasa_once] Polling kasa: K for user: u", created=1061.0)
+    assert flt.filter(later)
+    assert later.getMessage().endswith("(+2 similar suppressed)")
+
+
+def test_state_changes_are_never_sampled():
+    flt = SamplingFilter(window=60, burst=1, loggers=('handlers.start',))
+    msg = "[handle_shift_and_receipts] Shift opened for kasa 'K' (ID: s)"
+    lines = [record('handlers.start', msg, extra=UNSAMPLED) for _ in range(5)]
+    assert all(passed(flt, *lines))
+    assert flt.dropped == 0
+
+
+def test_other_loggers_and_warnings_pass():
+    flt = SamplingFilter(window=60, burst=1, loggers=('handlers.start',))
+    others = [record('services.sharding', "[Shards] Worker 0 started") for _ in range(3)]
+    warnings = [record('handlers.start', "[SendOne] Delivery queue full", logging.WARNING) for _ in range(3)]
+    assert all(passed(flt, *others, *warnings))
+
+
+def test_child_loggers_are_sampled():
+    flt = SamplingFilter(window=60, burst=1, loggers=('services',))
+    lines = [record('services.checkbox_api', "[get_receipt_pdf] Successfully retrieved PDF") for _ in range(2)]
+    assert passed(flt, *lines) == [True, False]
+    assert flt.filter(record('servicesx', "[x] y z"))
@@ -0,0 +1,82 @@
+# tests/test_polling.py
+import asyncio
+import time
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from benchmarks.fake_checkbox import FakeCheckbox
+
+
+@pytest.mark.parametrize('mode', ['incremental', 'window'])
+def test_receipts_api_failure_backs_off_without_spending_attempts(tmp_path, monkeypatch, mode):
+    """Збій receipts/* рахується невдалим циклом опитування, але не спробою чека."""
+    import config.settings as settings
+    import handlers.start as start
+    from services.sharding import _NullPdfCache, _NullPersister
+    from services.checkbox_api import CheckboxClient, get_client, set_client
+    from services.delivery import PRIORITY_RECEIPT
+    from services.resilience import ApiGuard
+    from utils.ledger import ReceiptLedger
+
+    monkeypatch.setattr(settings, 'RECEIPT_SYNC_MODE', mode)
+    monkeypatch.setattr(start, 'ledger', ReceiptLedger(str(tmp_path / 'ledger.db')))
+    monkeypatch.setattr(start, 'pdf_cache', _NullPdfCache())
+    monkeypatch.setattr(start, 'persister', _NullPersister())
+    fake = FakeCheckbox(rate=1.0, pdf_size=100)
+    fake.started = time.time() - 10
+    fake.kasa('K').rate = 0     # чеки більше не з'являються
+    expected = [r['id'] for r in fake.kasa('K').receipts if r['type'] != 'SERVICE_IN']
+
+    down = set()    # назви маршрутів, що відповідають 500
+    serve = fake.middleware
+
+    @web.middleware
+    async def middleware(request, handler):
+        if request.match_info.route.name in down:
+            return web.json_response({'message': 'down'}, status=500)
+        return await serve(request, handler)
+
+    fake.middleware = middleware
+
+    delivered = []
+
+    class Delivery:
+        def enqueue(self, item, priority):
+            if priority == PRIORITY_RECEIPT:
+                delivered.append((item['pdf_key'], item['document'] is not None))
+            return True
+
+    monkeypatch.setattr(start, 'delivery', Delivery())
+    kasa = {'license_key': 'K', 'pin_code': '1', 'kasa_name': 'K'}
+
+    async def run():
+        server = TestServer(fake.app())
+        await server.start_server()
+        previous = get_client()
+        set_client(CheckboxClient(base_url=str(server.make_url('/api/v1')), guard=ApiGuard(0, 0, 0, 0, max_wait=0)))
+        try:
+            down.add('receipt')
+            for cycle in range(1, settings.RECEIPT_MAX_ATTEMPTS + 2):
+                await start.poll_kasa_once('u', kasa)
+                assert kasa['poll_failures'] == cycle
+            assert 'failed_receipt' not in kasa
+            assert 'balance_sig' not in kasa
+
+            down.clear()
+            down.add('search')
+            await start.poll_kasa_once('u', kasa)
+            assert kasa['poll_failures'] == settings.RECEIPT_MAX_ATTEMPTS + 2
+
+            down.clear()
+            await start.poll_kasa_once('u', kasa)
+            assert kasa['poll_failures'] == 0
+        finally:
+            await get_client().close()
+            set_client(previous)
+            await server.close()
+            start.ledger.close()
+
+    asyncio.run(run())
+    # Жоден чек не пропущено і не надіслано без PDF через недоступність API
+    assert delivered == [(rid, True) for rid in expected]
+    assert kasa['receipt_counter'] == len(expected)
@@ -0,0 +1,54 @@
+# tests/test_rate_limit.py
+import asyncio
+import time
+import pytest
+from utils.rate_limit import TokenBucket
+
+
+def test_burst_up_to_capacity_without_waiting():
+    b = TokenBucket(rate=2, capacity=3)
+    t = time.monotonic()
+    assert [b.reserve(t) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert b.reserve(t) == pytest.approx(0.5)
+    assert b.reserve(t) == pytest.approx(1.0)
+
+
+def test_refill_is_capped_by_capacity():
+    b = TokenBucket(rate=10, capacity=2)
+    t = time.monotonic()
+    b.reserve(t)
+    b.reserve(t)
+    assert b.delay(t) == pytest.approx(0.1)
+    # Через годину бездіяльності доступно не більше capacity токенів
+    t += 3600
+    assert b.delay(t) == 0.0
+    assert b.reserve(t) == 0.0
+    assert b.reserve(t) == 0.0
+    assert b.reserve(t) > 0
+
+
+def test_delay_does_not_consume():
+    b = TokenBucket(rate=1, capacity=1)
+    t = time.monotonic()
+    assert b.delay(t) == 0.0
+    assert b.delay(t) == 0.0
+    assert b.reserve(t) == 0.0
+    assert b.delay(t) == pytest.approx(1.0)
+    assert b.delay(t + 0.25) == pytest.approx(0.75)
+
+
+def test_default_capacity_is_rate():
+    assert TokenBucket(rate=5).capacity == 5
+    assert TokenBucket(rate=0.5).capacity == 1
+
+
+def test_acquire_waits_for_token():
+    b = TokenBucket(rate=20, capacity=1)
+
+    async def run():
+        started = time.monotonic()
+        await b.acquire()
+        await b.acquire()
+        return time.monotonic() - started
+
+    assert asyncio.run(run()) >= 0.04
@@ -0,0 +1,118 @@
+# tests/test_receipt_pages.py
+import asyncio
+import pytest
+from services.checkbox_api import ReceiptPages, ReceiptsTruncatedError
+from utils.receipt import Receipt
+
+
+class FakeClient:
+    """Замість CheckboxClient: receipts/search з total чеків, fail_at - offset сторінки, що не завантажується."""
+
+    def __init__(self, total, fail_at=None):
+        self.total = total
+        self.fail_at = fail_at
+        self.requests = []      # (limit, offset) у порядку запитів
+        self.cancelled = 0
+
+    def _auth_headers(self, license_key, cashier_token):
+        return {}
+
+    async def _search_page(self, headers, params):
+        limit, offset = params['limit'], params['offset']
+        self.requests.append((limit, offset))
+        try:
+            await asyncio.sleep(0.01)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if offset == self.fail_at:
+            raise ConnectionError("boom")
+        return [Receipt(f"r{i}") for i in range(offset, min(offset + limit, self.total))]
+
+
+def collect(client, **kwargs):
+    async def run():
+        got = []
+        async with ReceiptPages(client, 'lic', 'token', **kwargs) as pages:
+            async for page in pages:
+                got.append([r.id for r in page])
+        return got, pages
+    return asyncio.run(run())
+
+
+def test_all_pages_in_order():
+    client = FakeClient(25)
+    got, pages = collect(client, page_size=10)
+    assert [len(p) for p in got] == [10, 10, 5]
+    assert sum(got, []) == [f"r{i}" for i in range(25)]
+    assert client.requests == [(10, 0), (10, 10), (10, 20)]
+    assert pages.received == 25
+
+
+def test_exact_multiple_ends_with_empty_page():
+    client = FakeClient(20)
+    got, _ = collect(client, page_size=10)
+    assert [len(p) for p in got] == [10, 10]
+    assert client.requests[-1] == (10, 20)
+
+
+def test_next_page_is_prefetched_while_caller_works():
+    client = FakeClient(30)
+
+    async def run():
+        async with ReceiptPages(client, 'lic', 'token', page_size=10) as pages:
+            await pages.__anext__()
+            # Викликач ще не просив другу сторінку, а запит уже пішов
+            await asyncio.sleep(0)
+            return list(client.requests)
+
+    assert asyncio.run(run()) == [(10, 0), (10, 10)]
+
+
+def test_probe_page_is_not_followed_by_prefetch():
+    client = FakeClient(30)
+
+    async def run():
+        async with ReceiptPages(client, 'lic', 'token', page_size=10, first_page_size=2) as pages:
+            first = await pages.__anext__()
+            await asyncio.sleep(0.05)
+            requested = list(client.requests)
+            rest = [r.id async for page in pages for r in page]
+        return first, requested, rest
+
+    first, requested, rest = asyncio.run(run())
+    assert [r.id for r in first] == ['r0', 'r1']
+    assert requested == [(2, 0)]
+    assert rest == [f"r{i}" for i in range(2, 30)]
+    assert client.requests[1] == (10, 2)
+
+
+def test_failed_page_raises_truncated():
+    client = FakeClient(50, fail_at=20)
+    got = []
+
+    async def run():
+        async with ReceiptPages(client, 'lic', 'token', page_size=10) as pages:
+            async for page in pages:
+                got.append(page)
+
+    with pytest.raises(ReceiptsTruncatedError) as exc:
+        asyncio.run(run())
+    assert len(got) == 2
+    assert exc.value.offset == 20
+    assert exc.value.received == 20
+
+
+def test_break_cancels_prefetched_page():
+    client = FakeClient(50)
+
+    async def run():
+        async with ReceiptPages(client, 'lic', 'token', page_size=10) as pages:
+            async for page in pages:
+                # Запит наступної сторінки вже виконується
+                await asyncio.sleep(0)
+                break
+
+    asyncio.run(run())
+    assert client.requests == [(10, 0), (10, 10)]
+    assert client.cancelled == 1
@@ -0,0 +1,45 @@
+# tests/test_reports.py
+from datetime import date
+import pytest
+from services.reports import parse_period
+from config.settings import REPORT_MAX_DAYS
+
+TODAY = date(2024, 3, 15)
+
+
+@pytest.mark.parametrize('args, expected', [
+    ([], (date(2024, 3, 9), TODAY)),
+    (['today'], (TODAY, TODAY)),
+    (['Сьогодні'], (TODAY, TODAY)),
+    (['вчора'], (date(2024, 3, 14), date(2024, 3, 14))),
+    (['week'], (date(2024, 3, 9), TODAY)),
+    (['місяць'], (date(2024, 3, 1), TODAY)),
+    (['2024-03-10'], (date(2024, 3, 10), date(2024, 3, 10))),
+    (['2024-03-01', '2024-03-10'], (date(2024, 3, 1), date(2024, 3, 10))),
+])
+def test_parse_period(args, expected):
+    assert parse_period(args, TODAY) == expected
+
+
+def test_period_end_is_clamped_to_today():
+    assert parse_period(['2024-03-10', '2024-04-30'], TODAY) == (date(2024, 3, 10), TODAY)
+
+
+@pytest.mark.parametrize('args', [
+    ['2024-03-10', '2024-03-01'],
+    ['2024-03-20'],
+    ['2024-13-01'],
+    ['last-week'],
+    ['2024-03-01', '2024-03-02', '2024-03-03'],
+])
+def test_parse_period_rejects_invalid(args):
+    with pytest.raises(ValueError):
+        parse_period(args, TODAY)
+
+
+def test_period_length_is_limited():
+    start = date.fromordinal(TODAY.toordinal() - REPORT_MAX_DAYS + 1)
+    assert parse_period([start.isoformat(), TODAY.isoformat()], TODAY) == (start, TODAY)
+    too_early = date.fromordinal(start.toordinal() - 1)
+    with pytest.raises(ValueError):
+        parse_period([too_early.isoformat(), TODAY.isoformat()], TODAY)
@@ -0,0 +1,82 @@
+# tests/test_resilience.py
+import asyncio
+import pytest
+from services.resilience import (
+    ApiGuard, CircuitBreaker, CircuitOpenError, RateLimitedError, OPEN, HALF_OPEN
+)
+
+
+def test_breaker_opens_after_threshold():
+    b = CircuitBreaker(threshold=3, reset_timeout=10, reset_max=100)
+    assert not b.record_failure(0.0)
+    assert not b.record_failure(1.0)
+    assert b.allow(1.0)
+    assert b.record_failure(2.0)
+    assert b.state == OPEN
+    assert not b.allow(2.0)
+    assert 0 < b.remaining(2.0) <= 10
+
+
+def test_breaker_half_open_allows_one_probe():
+    b = CircuitBreaker(threshold=1, reset_timeout=10, reset_max=100)
+    b.record_failure(0.0)
+    now = b.open_until
+    assert b.allow(now)
+    assert b.state == HALF_OPEN
+    assert not b.allow(now + 1)
+    # Пробний запит "завис" довше reset_timeout - пускаємо наступний
+    assert b.allow(now + 11)
+
+
+def test_breaker_reopens_on_failed_probe_with_longer_pause():
+    b = CircuitBreaker(threshold=1, reset_timeout=10, reset_max=1000)
+    b.record_failure(0.0)
+    assert b.allow(b.open_until)
+    assert b.record_failure(b.open_until)
+    assert b.state == OPEN
+    assert b.trips == 2
+
+
+def test_breaker_respects_retry_after():
+    b = CircuitBreaker(threshold=1, reset_timeout=1, reset_max=2)
+    b.record_failure(0.0, retry_after=60)
+    assert b.remaining(0.0) == 60
+
+
+def test_guard_breaker_per_license_and_family():
+    guard = ApiGuard(0, 0, 0, 0, max_wait=0)
+    for _ in range(10):
+        guard.failed('A', 'receipts')
+    assert guard.breaker_states('A') == {'receipts': OPEN}
+    assert guard.breaker_states('B') == {}
+    assert guard.retry_delay('A') > 0
+    assert guard.retry_delay('B') == 0
+
+    async def run():
+        with pytest.raises(CircuitOpenError):
+            await guard.before('A', 'receipts')
+        await guard.before('A', 'shifts')
+        await guard.before('B', 'receipts')
+    asyncio.run(run())
+
+
+def test_guard_success_forgets_breaker():
+    guard = ApiGuard(0, 0, 0, 0, max_wait=0)
+    guard.failed('A', 'receipts')
+    assert guard.stats()['open'] == 0
+    guard.after('A', 'receipts', 200, {})
+    assert guard.breaker_states('A') == {}
+    assert guard._breakers == {}
+
+
+def test_guard_retry_after_blocks_only_kasa():
+    guard = ApiGuard(0, 0, 0, 0, max_wait=0)
+    guard.after('A', 'shifts', 429, {'Retry-After': '30'})
+    assert 29 < guard.retry_delay('A') <= 30
+    assert guard.retry_delay('B') == 0
+
+    async def run():
+        with pytest.raises(RateLimitedError):
+            await guard.before('A', 'shifts')
+        await guard.before('B', 'shifts')
+    asyncio.run(run())
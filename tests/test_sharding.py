@@ -0,0 +1,162 @@
+# tests/test_sharding.py
+import asyncio
+import time
+from collections import Counter
+import pytest
+from aiohttp.test_utils import TestServer
+from benchmarks.fake_checkbox import FakeCheckbox
+from services.sharding import shard_for
+
+KEYS = [f"license-{i}" for i in range(2000)]
+
+
+def test_shard_for_is_stable_and_in_range():
+    for key in KEYS[:100]:
+        idx = shard_for(key, 4)
+        assert 0 <= idx < 4
+        assert shard_for(key, 4) == idx
+
+
+def test_shard_for_single_shard():
+    assert {shard_for(key, 1) for key in KEYS[:100]} == {0}
+
+
+def test_shard_for_spreads_kasas_evenly():
+    counts = Counter(shard_for(key, 4) for key in KEYS)
+    assert set(counts) == {0, 1, 2, 3}
+    assert min(counts.values()) > len(KEYS) / 4 * 0.8
+
+
+def test_adding_shard_moves_only_to_new_worker():
+    moved = 0
+    for key in KEYS:
+        before, after = shard_for(key, 4), shard_for(key, 5)
+        if before != after:
+            assert after == 4
+            moved += 1
+    # Переїжджає близько 1/5 кас, а не більшість
+    assert 0 < moved < len(KEYS) * 0.3
+
+
+def test_removing_shard_moves_only_its_kasas():
+    for key in KEYS:
+        before = shard_for(key, 5)
+        if before != 4:
+            assert shard_for(key, 4) == before
+
+
+class FakeChannel:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, *msg):
+        self.sent.append(msg)
+
+
+@pytest.mark.parametrize('mode', ['incremental', 'window'])
+def test_full_front_queue_makes_worker_refetch(tmp_path, monkeypatch, mode):
+    """Черга фронту відхилила сповіщення: воркер відкочує курсор і надсилає чеки повторно, без дублів."""
+    import config.settings as settings
+    import handlers.start as start
+    from services.sharding import ShardSupervisor, _NullPdfCache, _NullPersister
+    from services.checkbox_api import CheckboxClient, get_client, set_client
+    from services.delivery import PRIORITY_RECEIPT
+    from services.resilience import ApiGuard
+    from utils.ledger import ReceiptLedger
+
+    monkeypatch.setattr(settings, 'RECEIPT_SYNC_MODE', mode)
+    monkeypatch.setattr(start, 'ledger', ReceiptLedger(str(tmp_path / 'ledger.db')))
+    monkeypatch.setattr(start, 'pdf_cache', _NullPdfCache())
+    monkeypatch.setattr(start, 'persister', _NullPersister())
+    fake = FakeCheckbox(rate=1.0, pdf_size=100)
+    fake.started = time.time() - 20
+    fake.kasa('K').rate = 0     # чеки більше не з'являються
+    expected = [r['id'] for r in fake.kasa('K').receipts if r['type'] != 'SERVICE_IN']
+
+    accepted = []
+    capacity = {'receipts': 5}
+
+    async def front_enqueue(item, priority):
+        if priority == PRIORITY_RECEIPT:
+            if capacity['receipts'] <= 0:
+                return False
+            capacity['receipts'] -= 1
+            accepted.append(item['pdf_key'])
+        return True
+
+    class WorkerDelivery:
+        def enqueue(self, item, priority):
+            supervisor._on_message(('deliver', item, priority))
+            return True
+
+    supervisor = ShardSupervisor(lambda user_id, lic: None, front_enqueue, lambda *a: None, shards=1)
+    channel = supervisor._channels[0] = FakeChannel()
+    supervisor._assigned[('u', 'K')] = 0
+    monkeypatch.setattr(start, 'delivery', WorkerDelivery())
+    kasa = {'license_key': 'K', 'pin_code': '1', 'kasa_name': 'K'}
+
+    async def poll():
+        start.rollback_receipts(kasa)
+        await start.poll_kasa_once('u', kasa)
+        if supervisor._deliver_task is not None:
+            await supervisor._deliver_task
+
+    async def run():
+        server = TestServer(fake.app())
+        await server.start_server()
+        previous = get_client()
+        set_client(CheckboxClient(base_url=str(server.make_url('/api/v1')), guard=ApiGuard(0, 0, 0, 0, max_wait=0)))
+        try:
+            await poll()
+            assert accepted == expected[:5]
+            rejected = [m for m in channel.sent if m[0] == 'rejected']
+            assert len(rejected) == 1
+            start.note_rejected_receipts(kasa, rejected[0][2])
+            capacity['receipts'] = len(expected)
+            await poll()
+        finally:
+            await get_client().close()
+            set_client(previous)
+            await server.close()
+            start.ledger.close()
+
+    asyncio.run(run())
+    assert accepted == expected
+    assert kasa['receipt_counter'] == len(expected)
+    assert kasa['shift_totals']['count'] == len(expected)
+    assert kasa['delivery_epoch'] == 1
+
+
+def test_shard_ledger_path():
+    from services.sharding import shard_ledger_path
+    assert shard_ledger_path(0, 'data/ledger.db') == 'data/ledger.shard-0.db'
+    assert shard_ledger_path(3, 'ledger') == 'ledger.shard-3'
+
+
+def test_worker_metrics_are_added_to_front_export():
+    from services.metrics import Counter, Histogram, Registry
+    reg = Registry()
+    calls = reg.register(Counter('calls_total', 'Calls.', ('status',)))
+    latency = reg.register(Histogram('latency_seconds', 'Latency.', buckets=(1.0,)))
+    calls.inc(status='200')
+    latency.observe(0.5)
+
+    worker = Registry()
+    w_calls = worker.register(Counter('calls_total', 'Calls.', ('status',)))
+    w_latency = worker.register(Histogram('latency_seconds', 'Latency.', buckets=(1.0,)))
+    w_calls.inc(2, status='200')
+    w_calls.inc(status='500')
+    w_latency.observe(3.0)
+    reg.set_remote('shard-0', worker.snapshot())
+    text = reg.render()
+    assert 'calls_total{status="200"} 3' in text
+    assert 'calls_total{status="500"} 1' in text
+    assert 'latency_seconds_count 2' in text
+    assert 'latency_seconds_bucket{le="1.0"} 1' in text
+
+    # Перезапущений воркер починає з нуля, а сума на фронті не зменшується
+    reg.retire_remote('shard-0')
+    w_calls.clear()
+    w_calls.inc(status='200')
+    reg.set_remote('shard-0', worker.snapshot())
+    assert 'calls_total{status="200"} 4' in reg.render()
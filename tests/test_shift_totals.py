@@ -0,0 +1,54 @@
+# tests/test_shift_totals.py
+from utils.receipt import Payment, Receipt, ReceiptType
+from utils.shift_totals import allocate_payments, kasa_totals, totals_from_receipts
+
+
+def receipt(total, *payments, type=ReceiptType.SELL, rid='r'):
+    return Receipt(rid, type=type, total=total,
+                   payments=tuple(Payment(t, v, None, None) for t, v in payments))
+
+
+def test_single_payment_gets_whole_total():
+    assert allocate_payments(receipt(1000, ('CASH', 1200))) == (1000, 0)
+    assert allocate_payments(receipt(1000, ('CARD', 1000))) == (0, 1000)
+    assert allocate_payments(receipt(1000, ('CASHLESS', 1000))) == (0, 1000)
+    assert allocate_payments(receipt(1000, ('OTHER', 1000))) == (0, 0)
+
+
+def test_mixed_payments_split_proportionally():
+    assert allocate_payments(receipt(1000, ('CASH', 500), ('CARD', 1500))) == (250, 750)
+
+
+def test_split_keeps_every_kopeck():
+    # 100 коп. на три рівні оплати: 34 + 33 + 33, зайва копійка - першій
+    assert allocate_payments(receipt(100, ('CASH', 1), ('CARD', 1), ('CARD', 1))) == (34, 66)
+    for total in range(1, 200):
+        cash, card = allocate_payments(receipt(total, ('CASH', 7), ('CARD', 13)))
+        assert cash + card == total
+
+
+def test_zero_payment_sum_uses_first_type():
+    assert allocate_payments(receipt(500, ('CARD', 0), ('CASH', 0))) == (0, 500)
+    assert allocate_payments(receipt(500)) == (0, 0)
+
+
+def test_totals_net_returns_and_service():
+    totals = totals_from_receipts([
+        receipt(1000, ('CASH', 1000)),
+        receipt(600, ('CARD', 600)),
+        receipt(200, ('CASH', 200), type=ReceiptType.RETURN),
+        receipt(5000, type=ReceiptType.SERVICE_IN),
+        Receipt('s', type=ReceiptType.SERVICE_OUT, service_out=300),
+    ])
+    assert totals['count'] == 3
+    assert totals['sales'] == 1600
+    assert totals['returns'] == 200 and totals['returns_count'] == 1
+    assert totals['cash'] == 800 and totals['card'] == 600
+    assert totals['service_in'] == 5000 and totals['service_out'] == 300
+
+
+def test_kasa_totals_reset_on_new_shift():
+    kasa = {}
+    kasa_totals(kasa, 'shift-1')['count'] = 5
+    assert kasa_totals(kasa, 'shift-1')['count'] == 5
+    assert kasa_totals(kasa, 'shift-2')['count'] == 0
@@ -0,0 +1,59 @@
+# tests/test_storage.py
+import json
+import os
+import subprocess
+import sys
+from utils.storage import SqliteKasaStore
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+KASA = {'license_key': 'LIC1', 'pin_code': '1111', 'kasa_name': 'Магазин',
+        'shift_id': 'S1', 'last_receipt_datetime': '2024-03-01T10:00:00+00:00',
+        'last_receipt_id': 'R1', 'shift_totals': {'cash': 100}}
+
+
+def write_json(path, data):
+    with open(path, 'w') as f:
+        json.dump(data, f)
+
+
+def test_migrates_json_once(tmp_path):
+    json_path = str(tmp_path / 'kasas.json')
+    write_json(json_path, {'42': [KASA]})
+    store = SqliteKasaStore(str(tmp_path / 'kasas.db'))
+    try:
+        assert store.migrate_from_json(json_path)
+        assert not os.path.exists(json_path)
+        assert os.path.exists(json_path + '.migrated')
+        kasa = store.load()['42'][0]
+        assert kasa['license_key'] == 'LIC1'
+        assert kasa['kasa_name'] == 'Магазин'
+        assert kasa['last_receipt_id'] == 'R1'
+        assert kasa['shift_totals'] == {'cash': 100}
+        # Повторний запуск нічого не робить
+        assert not store.migrate_from_json(json_path)
+    finally:
+        store.close()
+
+
+def test_skips_non_empty_store(tmp_path):
+    json_path = str(tmp_path / 'kasas.json')
+    store = SqliteKasaStore(str(tmp_path / 'kasas.db'))
+    try:
+        store.save({'1': [dict(KASA, license_key='OLD')]})
+        write_json(json_path, {'42': [KASA]})
+        assert not store.migrate_from_json(json_path)
+        assert os.path.exists(json_path)
+        assert list(store.load()) == ['1']
+    finally:
+        store.close()
+
+
+def test_import_has_no_storage_side_effects(tmp_path):
+    os.makedirs(tmp_path / 'data')
+    json_path = tmp_path / 'data' / 'kasas.json'
+    write_json(json_path, {'42': [KASA]})
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    subprocess.run([sys.executable, '-c', 'import handlers.start, handlers.add_kasa, services.export'],
+                   cwd=tmp_path, env=env, check=True)
+    assert json_path.exists()
+    assert not (tmp_path / 'data' / 'kasas.db').exists()
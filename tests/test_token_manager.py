@@ -0,0 +1,75 @@
+# tests/test_token_manager.py
+import asyncio
+import time
+import aiohttp
+import pytest
+from services.token_manager import TokenManager
+
+
+class Signin:
+    """Заглушка авторизації: видає токени по черзі, exc - виняток замість токена."""
+
+    def __init__(self):
+        self.calls = 0
+        self.exc = None
+        self.token = 'token-1'
+
+    async def __call__(self, license_key, pin_code):
+        self.calls += 1
+        if self.exc is not None:
+            raise self.exc
+        return self.token
+
+
+def cached_manager(expires_in):
+    signin = Signin()
+    tm = TokenManager(signin, refresh_margin=300)
+    tm._tokens[('LIC', 'PIN')] = ('cached', time.time() + expires_in)
+    tm._key_by_token['cached'] = ('LIC', 'PIN')
+    return tm, signin
+
+
+def test_fresh_token_is_not_refreshed():
+    tm, signin = cached_manager(3600)
+    assert asyncio.run(tm.get_token('LIC', 'PIN')) == 'cached'
+    assert signin.calls == 0
+
+
+def test_early_refresh_replaces_token():
+    tm, signin = cached_manager(100)
+    assert asyncio.run(tm.get_token('LIC', 'PIN')) == 'token-1'
+    assert signin.calls == 1
+    assert tm.refresh_count == 1
+
+
+def test_raising_signin_keeps_valid_cached_token():
+    tm, signin = cached_manager(100)
+    signin.exc = aiohttp.ClientConnectionError('down')
+    assert asyncio.run(tm.get_token('LIC', 'PIN')) == 'cached'
+    assert tm.failure_count == 1
+    assert tm.refresh_count == 0
+
+
+def test_empty_signin_keeps_valid_cached_token():
+    tm, signin = cached_manager(100)
+    signin.token = None
+    assert asyncio.run(tm.get_token('LIC', 'PIN')) == 'cached'
+    assert tm.failure_count == 1
+
+
+def test_raising_signin_without_valid_token_raises():
+    tm, signin = cached_manager(-1)
+    signin.exc = aiohttp.ClientConnectionError('down')
+    with pytest.raises(aiohttp.ClientConnectionError):
+        asyncio.run(tm.get_token('LIC', 'PIN'))
+    assert tm.failure_count == 1
+
+
+def test_concurrent_refresh_signs_in_once():
+    tm, signin = cached_manager(-1)
+
+    async def run():
+        return await asyncio.gather(*(tm.get_token('LIC', 'PIN') for _ in range(5)))
+
+    assert asyncio.run(run()) == ['token-1'] * 5
+    assert signin.calls == 1
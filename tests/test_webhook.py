@@ -0,0 +1,47 @@
+# tests/test_webhook.py
+import asyncio
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from aiogram import Bot, Dispatcher
+from services.webhook import build_webhook_app, serve_webhook
+
+PATH = '/telegram/webhook'
+SECRET = 'test-secret'
+UPDATE = {'update_id': 1, 'message': {
+    'message_id': 1, 'date': 0, 'chat': {'id': 1, 'type': 'private'},
+    'from': {'id': 1, 'is_bot': False, 'first_name': 'Test'}, 'text': '/export'
+}}
+
+
+def post_update(headers):
+    async def run():
+        bot = Bot(token='123456:TEST')
+        app = build_webhook_app(Dispatcher(), bot, PATH, SECRET)
+        async with TestClient(TestServer(app)) as client:
+            resp = await client.post(PATH, json=UPDATE, headers=headers)
+            status = resp.status
+        await bot.session.close()
+        return status
+    return asyncio.run(run())
+
+
+def test_rejects_missing_secret():
+    assert post_update({}) == 401
+
+
+def test_rejects_wrong_secret():
+    assert post_update({'X-Telegram-Bot-Api-Secret-Token': 'wrong'}) == 401
+
+
+def test_accepts_matching_secret():
+    assert post_update({'X-Telegram-Bot-Api-Secret-Token': SECRET}) == 200
+
+
+def test_app_requires_secret():
+    with pytest.raises(ValueError):
+        build_webhook_app(Dispatcher(), Bot(token='123456:TEST'), PATH, None)
+
+
+def test_serve_without_url_requires_secret():
+    with pytest.raises(RuntimeError):
+        asyncio.run(serve_webhook(Dispatcher(), Bot(token='123456:TEST'), url=None, secret_token=None))
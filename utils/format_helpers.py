@@ -1,28 +1,19 @@
 # utils/format_helpers.py
-from dateutil import parser
-from datetime import datetime
-import pytz
+from datetime import timedelta
+from utils.receipt import local_time_str
+from utils.shift_totals import totals_from_receipts
 
 def format_receipt_info(receipt, kasa_name, custom_number=None):
-    s = receipt.get('serial', 'N/A')
-    ts_str = receipt.get('created_at', 'N/A')
-    total_sum = receipt.get('total_sum', 0) / 100
+    """Текст сповіщення про чек (utils.receipt.Receipt)."""
+    s = receipt.serial if receipt.serial is not None else 'N/A'
+    total_sum = receipt.total / 100
     pm = []
-    for p in receipt.get('payments', []):
-        t = p.get('type', '').upper()
-        if t in ('CASH', 'CARD', 'CASHLESS'):
-            pm.append(p.get('type_label', t))
+    for p in receipt.payments:
+        if p.type in ('CASH', 'CARD', 'CASHLESS'):
+            pm.append(p.type_label or p.type)
 
     pay_methods = ', '.join(pm) if pm else 'N/A'
-    local_ts = ts_str
-    if ts_str != 'N/A':
-        try:
-            d_utc = parser.isoparse(ts_str)
-            kyiv_tz = pytz.timezone("Europe/Kiev")
-            d_local = d_utc.astimezone(kyiv_tz)
-            local_ts = d_local.strftime('%d.%m.%Y %H:%M:%S')
-        except:
-            pass
+    local_ts = local_time_str(receipt.created_us) if receipt.created_us is not None else 'N/A'
 
     lines = []
     lines.append(f"Каса: {kasa_name}")
@@ -35,24 +26,91 @@ def format_receipt_info(receipt, kasa_name, custom_number=None):
     return "\n".join(lines)
 
 def format_shift_statistics(receipts, kasa_name):
-    total_cash = 0.0
-    total_card = 0.0
-    count = 0
-    for r in receipts:
-        for p in r.get('payments', []):
-            t = p.get('type', '').upper()
-            val = p.get('value', 0) / 100
-            if t == 'CASH':
-                total_cash += val
-            elif t in ('CARD', 'CASHLESS'):
-                total_card += val
-        count += 1
-    total_all = total_cash + total_card
+    totals = totals_from_receipts(receipts)
     msg = (
         f"Статистика на касі '{kasa_name}':\n"
-        f"Чеків: {count}\n"
-        f"— Готівкою: {total_cash:.2f} грн\n"
-        f"— Карткою/Безготівково: {total_card:.2f} грн\n"
-        f"Всього: {total_all:.2f} грн"
+        f"Чеків: {totals['count']}\n"
+        f"— Готівкою: {totals['cash'] / 100:.2f} грн\n"
+        f"— Карткою/Безготівково: {totals['card'] / 100:.2f} грн\n"
+        f"Всього: {(totals['cash'] + totals['card']) / 100:.2f} грн"
     )
-    return msg
\ No newline at end of file
+    return msg
+
+def format_shift_totals(totals, kasa_name, title="Звіт за зміною"):
+    lines = [
+        f"{title} на касі '{kasa_name}':",
+        f"Кількість чеків: {totals['count']}",
+        f"Сума продаж (готівка): {totals['cash'] / 100:.2f} грн",
+        f"Сума продаж (картки): {totals['card'] / 100:.2f} грн",
+        f"Загальна сума продаж: {(totals['sales'] - totals['returns']) / 100:.2f} грн"
+    ]
+    if totals['returns_count']:
+        lines.append(f"Повернення: {totals['returns_count']} на {totals['returns'] / 100:.2f} грн")
+    if totals['service_in']:
+        lines.append(f"Службове внесення: {totals['service_in'] / 100:.2f} грн")
+    if totals['service_out']:
+        lines.append(f"Службова видача: {totals['service_out'] / 100:.2f} грн")
+    return "\n".join(lines)
+
+def _money(kop):
+    return f"{kop / 100:.2f} грн"
+
+def format_report(report):
+    """Текст звіту за період (services.reports.build_report); розділи відокремлені порожнім рядком."""
+    totals = report['totals']
+    start, end = report['from'], report['to']
+    period = f"{start:%d.%m.%Y}" if start == end else f"{start:%d.%m.%Y} – {end:%d.%m.%Y}"
+    lines = [
+        f"Звіт за {period}",
+        f"Каси: {', '.join(report['kasas'])}",
+        f"Кількість чеків: {totals['count']}",
+        f"Сума продаж (готівка): {_money(totals['cash'])}",
+        f"Сума продаж (картки): {_money(totals['card'])}",
+        f"Загальна сума продаж: {_money(totals['sales'] - totals['returns'])}"
+    ]
+    other = totals['sales'] - totals['returns'] - totals['cash'] - totals['card']
+    if other:
+        lines.append(f"Інші види оплати: {_money(other)}")
+    if totals['returns_count']:
+        lines.append(f"Повернення: {totals['returns_count']} на {_money(totals['returns'])}")
+    if totals['service_in']:
+        lines.append(f"Службове внесення: {_money(totals['service_in'])}")
+    if totals['service_out']:
+        lines.append(f"Службова видача: {_money(totals['service_out'])}")
+    sections = ["\n".join(lines)]
+
+    def group_lines(title, grouped, label):
+        rows = [
+            f"{label(i)}: {count} чек., {_money(net)}"
+            for i, (count, net) in enumerate(zip(grouped['count'], grouped['net'])) if count
+        ]
+        if rows:
+            sections.append("\n".join([title] + rows))
+
+    if start != end:
+        group_lines("По днях:", report['by_day'], lambda i: f"{start + timedelta(days=i):%d.%m}")
+    group_lines("По годинах:", report['by_hour'], lambda i: f"{i:02d}:00–{i + 1:02d}:00")
+    if len(report['kasas']) > 1:
+        group_lines("По касах:", report['by_kasa'], lambda i: report['kasas'][i])
+
+    notes = []
+    if report['incomplete']:
+        notes.append(f"⚠️ Не всі дані вдалося отримати з API ({', '.join(report['incomplete'])}); звіт може бути неповним.")
+    notes.append(f"Змін з локального кешу: {report['shifts_cached']}, завантажено з API: {report['shifts_fetched']}")
+    sections.append("\n".join(notes))
+    return "\n\n".join(sections)
+
+def split_message(text, limit=4096):
+    """Ділить текст на повідомлення Telegram (не довші за limit) по межах розділів, а за потреби - рядків."""
+    parts, current = [], ''
+    for chunk in text.split("\n\n"):
+        pieces = [chunk] if len(chunk) <= limit else chunk.split("\n")
+        for i, piece in enumerate(pieces):
+            sep = "\n\n" if i == 0 else "\n"
+            if current and len(current) + len(sep) + len(piece) > limit:
+                parts.append(current)
+                current = ''
+            current = f"{current}{sep}{piece}" if current else piece[:limit]
+    if current:
+        parts.append(current)
+    return parts
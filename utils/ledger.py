@@ -0,0 +1,254 @@
+# utils/ledger.py
+import asyncio
+import json
+import os
+import sqlite3
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from utils.receipt import Receipt, datetime_to_us, parse_timestamp, us_to_iso
+from config.settings import LEDGER_DB_FILE, LEDGER_RETENTION_DAYS
+
+logger = logging.getLogger(__name__)
+
+# Зміна в кеші журналу: час - мкс UTC (closed_us None - зміна ще не закрита),
+# expected - кількість чеків продажу/повернення за даними API,
+# complete - усі чеки закритої зміни вже в журналі
+ShiftRecord = namedtuple('ShiftRecord', ('id', 'opened_us', 'closed_us', 'status', 'expected', 'complete'))
+
+
+class ReceiptLedger:
+    """
+    Локальний журнал чеків, побачених під час опитування (SQLite, WAL).
+
+    Чеки індексуються за (shift_id, receipt_id); повторне додавання того ж
+    чеку ігнорується. Звіт за зміною будується з журналу, а не повторною
+    пагінацією всієї зміни через API. Запис і читання виконуються в окремому
+    потоці, щоб не блокувати event loop.
+
+    Для звітів за період (services.reports) журнал також кешує список змін
+    каси (shifts) і проміжок часу, за який цей список уже отримано з API
+    (shift_coverage): повторний звіт за закриті зміни не звертається до API.
+    """
+
+    def __init__(self, path=LEDGER_DB_FILE, retention_days=LEDGER_RETENTION_DAYS):
+        self.path = path
+        self.retention_days = retention_days
+        self._lock = threading.Lock()
+        self._conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ledger')
+
+    def _connect(self):
+        if self._conn is None:
+            dirname = os.path.dirname(self.path)
+            if dirname:
+                os.makedirs(dirname, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS receipts (
+                    shift_id TEXT NOT NULL,
+                    receipt_id TEXT NOT NULL,
+                    license_key TEXT NOT NULL,
+                    created_at TEXT,
+                    type TEXT,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (shift_id, receipt_id)
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS receipts_created ON receipts (created_at)")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS shifts (
+                    shift_id TEXT PRIMARY KEY,
+                    license_key TEXT NOT NULL,
+                    opened_us INTEGER NOT NULL,
+                    closed_us INTEGER,
+                    status TEXT,
+                    expected INTEGER,
+                    complete INTEGER NOT NULL DEFAULT 0
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS shifts_opened ON shifts (license_key, opened_us)")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS shift_coverage (
+                    license_key TEXT PRIMARY KEY,
+                    from_us INTEGER NOT NULL,
+                    to_us INTEGER NOT NULL
+                )
+                """
+            )
+            conn.commit()
+            self._conn = conn
+            self._purge_old()
+        return self._conn
+
+    def _purge_old(self):
+        if not self.retention_days:
+            return
+        cutoff_dt = datetime.now(timezone.utc) - timedelta(days=self.retention_days)
+        cutoff, cutoff_us = cutoff_dt.isoformat(), datetime_to_us(cutoff_dt)
+        with self._conn:
+            deleted = self._conn.execute("DELETE FROM receipts WHERE created_at < ?", (cutoff,)).rowcount
+            # Зміна без своїх чеків не може вважатися повною; кеш списку змін теж звужується
+            self._conn.execute("DELETE FROM shifts WHERE opened_us < ?", (cutoff_us,))
+            self._conn.execute("DELETE FROM shift_coverage WHERE to_us <= ?", (cutoff_us,))
+            self._conn.execute("UPDATE shift_coverage SET from_us = ? WHERE from_us < ?", (cutoff_us, cutoff_us))
+        if deleted:
+            logger.info(f"[ReceiptLedger] Purged {deleted} receipts older than {self.retention_days} days")
+
+    def _add_many(self, shift_id, license_key, receipts):
+        rows = [
+            (shift_id, r.id, license_key, us_to_iso(r.created_us), r.type.value,
+             json.dumps(r.as_dict(), ensure_ascii=False))
+            for r in receipts if r.id
+        ]
+        if not rows:
+            return 0
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                before = conn.total_changes
+                conn.executemany(
+                    "INSERT OR IGNORE INTO receipts (shift_id, receipt_id, license_key, created_at, type, data) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+                return conn.total_changes - before
+
+    def _receipts(self, shift_id):
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT data FROM receipts WHERE shift_id = ? ORDER BY created_at, receipt_id", (shift_id,)
+            ).fetchall()
+        return [Receipt.from_api(json.loads(d)) for (d,) in rows]
+
+    def _count(self, shift_id, exclude_types=()):
+        sql = "SELECT COUNT(*) FROM receipts WHERE shift_id = ?"
+        args = [shift_id]
+        if exclude_types:
+            sql += f" AND type NOT IN ({', '.join('?' * len(exclude_types))})"
+            args.extend(exclude_types)
+        with self._lock:
+            return self._connect().execute(sql, args).fetchone()[0]
+
+    def _add_shifts(self, license_key, shifts):
+        rows = []
+        for sh in shifts:
+            opened = parse_timestamp(sh.get('opened_at'))
+            if not sh.get('id') or opened is None:
+                continue
+            rows.append((sh['id'], license_key, opened, parse_timestamp(sh.get('closed_at')),
+                         sh.get('status'), shift_receipts_count(sh)))
+        if not rows:
+            return
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                # complete не скидається: чеки вже збереженої зміни лишаються в журналі
+                conn.executemany(
+                    "INSERT INTO shifts (shift_id, license_key, opened_us, closed_us, status, expected) "
+                    "VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (shift_id) DO UPDATE SET closed_us = excluded.closed_us, "
+                    "status = excluded.status, expected = COALESCE(excluded.expected, shifts.expected)",
+                    rows
+                )
+
+    def _shifts_between(self, license_key, from_us, to_us):
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT shift_id, opened_us, closed_us, status, expected, complete FROM shifts "
+                "WHERE license_key = ? AND opened_us < ? AND (closed_us IS NULL OR closed_us >= ?) "
+                "ORDER BY opened_us",
+                (license_key, to_us, from_us)
+            ).fetchall()
+        return [ShiftRecord(sid, o, c, st, exp, bool(done)) for sid, o, c, st, exp, done in rows]
+
+    def _mark_complete(self, shift_id):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute("UPDATE shifts SET complete = 1 WHERE shift_id = ?", (shift_id,))
+
+    def _coverage(self, license_key):
+        with self._lock:
+            return self._connect().execute(
+                "SELECT from_us, to_us FROM shift_coverage WHERE license_key = ?", (license_key,)
+            ).fetchone()
+
+    def _add_coverage(self, license_key, from_us, to_us):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                row = conn.execute(
+                    "SELECT from_us, to_us FROM shift_coverage WHERE license_key = ?", (license_key,)
+                ).fetchone()
+                # Зберігається один суцільний проміжок: новий, що не перетинається зі старим, замінює його
+                if row is not None and from_us <= row[1] and to_us >= row[0]:
+                    from_us, to_us = min(from_us, row[0]), max(to_us, row[1])
+                conn.execute(
+                    "INSERT OR REPLACE INTO shift_coverage (license_key, from_us, to_us) VALUES (?, ?, ?)",
+                    (license_key, from_us, to_us)
+                )
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def add_many(self, shift_id, license_key, receipts):
+        """Додає чеки зміни; повертає кількість нових записів."""
+        return await self._run(self._add_many, shift_id, license_key, list(receipts))
+
+    async def receipts(self, shift_id):
+        """Усі чеки зміни за зростанням часу (компактні словники)."""
+        return await self._run(self._receipts, shift_id)
+
+    async def count(self, shift_id, exclude_types=()):
+        return await self._run(self._count, shift_id, tuple(exclude_types))
+
+    async def add_shifts(self, license_key, shifts):
+        """Зберігає або оновлює зміни каси (словники з GET /shifts)."""
+        await self._run(self._add_shifts, license_key, list(shifts))
+
+    async def shifts_between(self, license_key, from_us, to_us):
+        """Збережені зміни каси, що перетинаються з [from_us, to_us), як список ShiftRecord."""
+        return await self._run(self._shifts_between, license_key, from_us, to_us)
+
+    async def mark_complete(self, shift_id):
+        await self._run(self._mark_complete, shift_id)
+
+    async def coverage(self, license_key):
+        """Проміжок (from_us, to_us), за який список змін каси вже отримано з API, або None."""
+        return await self._run(self._coverage, license_key)
+
+    async def add_coverage(self, license_key, from_us, to_us):
+        await self._run(self._add_coverage, license_key, from_us, to_us)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def shift_receipts_count(shift_data):
+    """
+    Кількість чеків продажу та повернення за даними зміни з API
+    (z_report або balance). None, якщо API таких даних не повернуло.
+    """
+    if not shift_data:
+        return None
+    for section in ('z_report', 'balance'):
+        block = shift_data.get(section) or {}
+        sell = block.get('sell_receipts_count')
+        ret = block.get('return_receipts_count')
+        if sell is not None or ret is not None:
+            return (sell or 0) + (ret or 0)
+    return None
@@ -1,46 +1,232 @@
 import os
 import glob
+import gzip
+import shutil
+import atexit
 import logging
 import logging.handlers
+import queue
+import threading
+import time
 from datetime import datetime
-from config.settings import LOG_DIR, MAX_LOG_FILES, LOG_FORMAT, LOG_LEVEL
+from config.settings import (
+    LOG_DIR, LOG_FILE, MAX_LOG_FILES, LOG_FORMAT, LOG_LEVEL,
+    LOG_MAX_BYTES, LOG_ROTATE_INTERVAL, LOG_COMPRESS, LOG_SAMPLE_WINDOW, LOG_SAMPLE_BURST,
+    LOG_SAMPLE_LOGGERS
+)
 
-def setup_logging():
-    # Переконаємось, що каталог для логів існує
-    if not os.path.exists(LOG_DIR):
-        os.makedirs(LOG_DIR)
+_listener = None
+# extra для одноразових записів зміни стану ("Shift opened" тощо): SamplingFilter їх не відкидає
+UNSAMPLED = {'sample': False}
+
+
+class RotatingGzipFileHandler(logging.handlers.BaseRotatingHandler):
+    """
+    Лог-файл з ротацією за розміром (max_bytes) і за часом (interval секунд).
+    Ротований файл перейменовується в <файл>.<час> і стискається gzip у
+    фоновому потоці; зберігаються backup_count найновіших ротованих файлів.
+    """
+
+    def __init__(self, filename, max_bytes=LOG_MAX_BYTES, interval=LOG_ROTATE_INTERVAL,
+                 backup_count=MAX_LOG_FILES, compress=LOG_COMPRESS):
+        super().__init__(filename, 'a', encoding='utf-8', delay=False)
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.backup_count = backup_count
+        self.compress = compress
+        self.rollover_at = self._next_rollover(time.time())
+
+    def _next_rollover(self, now):
+        return now + self.interval if self.interval else float('inf')
+
+    def shouldRollover(self, record):
+        if time.time() >= self.rollover_at:
+            return True
+        if self.max_bytes and self.stream is not None:
+            return self.stream.tell() >= self.max_bytes
+        return False
+
+    def doRollover(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        dest = f"{self.baseFilename}.{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+        n = 1
+        while os.path.exists(dest) or os.path.exists(dest + '.gz'):
+            dest = f"{self.baseFilename}.{datetime.now().strftime('%Y%m%d-%H%M%S')}-{n}"
+            n += 1
+        if os.path.exists(self.baseFilename):
+            os.rename(self.baseFilename, dest)
+            if self.compress:
+                threading.Thread(target=self._compress, args=(dest,), name='log-gzip', daemon=True).start()
+        self._prune()
+        self.stream = self._open()
+        self.rollover_at = self._next_rollover(time.time())
+
+    @staticmethod
+    def _compress(path):
+        try:
+            with open(path, 'rb') as src, gzip.open(path + '.gz', 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _prune(self):
+        rotated = []
+        for path in glob.glob(glob.escape(self.baseFilename) + '.*'):
+            try:
+                rotated.append((os.path.getmtime(path), path))
+            except OSError:
+                # Нестиснений файл вже замінено на .gz фоновим потоком
+                pass
+        rotated.sort()
+        for _, path in rotated[:max(0, len(rotated) - self.backup_count)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Проріджує часті повідомлення рівня INFO і нижче логерів loggers (цикли
+    опитування, дані чеків): з кожного джерела за window секунд проходять
+    перші burst записів, решта відкидаються ще до форматування. Джерело -
+    логер плюс тег на початку повідомлення і два слова після нього.
+    Кількість відкинутих дописується до першого запису наступного вікна.
+    WARNING і вище, записи інших логерів і записи з extra=UNSAMPLED
+    проходять завжди.
+    """
+
+    MAX_KEYS = 1000
+
+    def __init__(self, window=LOG_SAMPLE_WINDOW, burst=LOG_SAMPLE_BURST, loggers=LOG_SAMPLE_LOGGERS):
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        self.loggers = tuple(loggers)
+        self._windows = {}      # ключ -> [початок вікна, пропущено, відкинуто]
+        self.dropped = 0
+
+    def _sampled(self, name):
+        return any(name == n or name.startswith(n + '.') for n in self.loggers)
+
+    def filter(self, record):
+        if record.levelno > logging.INFO or not self.burst:
+            return True
+        if not getattr(record, 'sample', True) or not self._sampled(record.name):
+            return True
+        msg = str(record.msg)
+        # Тег і два слова після нього: "[handle_shift_and_receipts] Handling kasa" і
+        # "[handle_shift_and_receipts] Shift opened" - різні джерела
+        key = (record.name, ' '.join(msg.split(' ', 3)[:3]) if msg.startswith('[') else msg[:40])
+        now = record.created
+        state = self._windows.get(key)
+        if state is None or now - state[0] >= self.window:
+            suppressed = state[2] if state is not None else 0
+            if len(self._windows) >= self.MAX_KEYS:
+                self._windows.clear()
+            self._windows[key] = [now, 1, 0]
+            if suppressed:
+                record.msg = f"{record.getMessage()} (+{suppressed} similar suppressed)"
+                record.args = None
+            return True
+        if state[1] < self.burst:
+            state[1] += 1
+            return True
+        state[2] += 1
+        self.dropped += 1
+        return False
 
-    # Формуємо назву нового лог-файлу із відміткою часу
-    log_filename = os.path.join(LOG_DIR, datetime.now().strftime("bot_%Y%m%d_%H%M%S.log"))
 
-    # Налаштовуємо кореневий логгер
+def prune_legacy_logs(log_dir=LOG_DIR, keep=MAX_LOG_FILES):
+    """
+    Файли bot_<час>.log попередніх версій (окремий файл на кожен запуск)
+    ротація не бачить: лишаємо keep найновіших, як і раніше.
+    """
+    log_files = sorted(glob.glob(os.path.join(log_dir, "bot_*.log")))
+    for f in log_files[:max(0, len(log_files) - keep)]:
+        try:
+            os.remove(f)
+        except OSError as e:
+            logging.getLogger(__name__).error(f"Error removing old log file {f}: {e}")
+
+
+class _Forwarder(logging.Handler):
+    """Записи з процесів-воркерів передаються логерам цього процесу."""
+
+    def emit(self, record):
+        logging.getLogger(record.name).handle(record)
+
+
+def setup_logging(log_queue=None):
+    """
+    Логування через чергу: логер лише кладе запис у queue.SimpleQueue
+    (без блокуючого запису на event loop), а файл і консоль обслуговує
+    QueueListener в окремому потоці.
+
+    log_queue - черга multiprocessing процесу-воркера (services.sharding):
+    записи передаються головному процесу, який пише їх у свій файл.
+    """
+    global _listener
     logger = logging.getLogger()
     logger.setLevel(getattr(logging, LOG_LEVEL.upper(), logging.INFO))
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+
+    if log_queue is not None:
+        # Процес-воркер нічого не пише у файл сам
+        stop_logging()
+        handler = logging.handlers.QueueHandler(log_queue)
+        handler.addFilter(SamplingFilter())
+        logger.addHandler(handler)
+        return
+
+    # Переконаємось, що каталог для логів існує
+    if not os.path.exists(LOG_DIR):
+        os.makedirs(LOG_DIR)
+    prune_legacy_logs()
 
     # Форматувальник для логів
     formatter = logging.Formatter(LOG_FORMAT)
 
-    # Створюємо FileHandler із новою назвою файлу
-    file_handler = logging.FileHandler(log_filename, encoding='utf-8')
+    file_handler = RotatingGzipFileHandler(os.path.join(LOG_DIR, LOG_FILE))
     file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
 
-    # Додаємо StreamHandler для виводу в консоль (опціонально)
+    # Вивід у консоль
     stream_handler = logging.StreamHandler()
     stream_handler.setFormatter(formatter)
-    logger.addHandler(stream_handler)
 
-    # Очистка старих лог-файлів (якщо їх більше MAX_LOG_FILES)
-    log_files = sorted(glob.glob(os.path.join(LOG_DIR, "bot_*.log")))
-    if len(log_files) > MAX_LOG_FILES:
-        files_to_remove = log_files[: len(log_files) - MAX_LOG_FILES]
-        for f in files_to_remove:
-            try:
-                os.remove(f)
-            except Exception as e:
-                logger.error(f"Error removing old log file {f}: {e}")
+    records = queue.SimpleQueue()
+    handler = logging.handlers.QueueHandler(records)
+    handler.addFilter(SamplingFilter())
+    logger.addHandler(handler)
+
+    stop_logging()
+    _listener = logging.handlers.QueueListener(records, file_handler, stream_handler)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Дописує записи з черги та закриває файл (викликається і при виході з процесу)."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def forward_logs(log_queue):
+    """Приймає записи процесів-воркерів з log_queue; повертає запущений QueueListener."""
+    listener = logging.handlers.QueueListener(log_queue, _Forwarder())
+    listener.start()
+    return listener
+
 
 if __name__ == '__main__':
     # Для тестування модуля виклик setup_logging
     setup_logging()
-    logging.info("Logging setup is complete.")
\ No newline at end of file
+    logging.info("Logging setup is complete.")
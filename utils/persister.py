@@ -0,0 +1,81 @@
+# utils/persister.py
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config.settings import PERSIST_INTERVAL
+from services import metrics
+from utils.storage import snapshot_kasas_data, write_kasas_snapshot
+
+logger = logging.getLogger(__name__)
+
+
+class StatePersister:
+    """
+    Відкладене (write-behind) збереження стану кас.
+
+    Обробники лише викликають mark_dirty(); фонова задача не частіше ніж
+    раз на interval секунд знімає знімок стану в event loop і записує його
+    в окремому потоці, тож кілька змін за цикл опитування зливаються в один
+    запис, а файловий I/O не блокує loop. stop() виконує фінальний запис.
+    """
+
+    def __init__(self, data, interval=PERSIST_INTERVAL):
+        self.data = data
+        self.interval = interval
+        self._dirty = False
+        self._event = None
+        self._task = None
+        # Один потік: записи виконуються строго по черзі
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='persister')
+        self.flush_count = 0
+        self.last_flush_duration = 0.0
+
+    def mark_dirty(self):
+        self._dirty = True
+        if self._task is None:
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                # Поза event loop (наприклад, утиліти) - записуємо одразу
+                self._dirty = False
+                write_kasas_snapshot(snapshot_kasas_data(self.data))
+                return
+            self._event = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+        self._event.set()
+
+    async def _run(self):
+        while True:
+            await self._event.wait()
+            self._event.clear()
+            await self.flush()
+            await asyncio.sleep(self.interval)
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        self._dirty = False
+        snapshot = snapshot_kasas_data(self.data)
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._executor, write_kasas_snapshot, snapshot)
+        except Exception as e:
+            # Стан лишається "брудним" - наступна спроба через interval
+            self._dirty = True
+            if self._event is not None:
+                self._event.set()
+            logger.error(f"[StatePersister] Failed to save kasas state: {e}")
+            return
+        self.flush_count += 1
+        self.last_flush_duration = time.perf_counter() - started
+        metrics.STATE_SAVE_DURATION.observe(self.last_flush_duration)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,49 @@
+# utils/rate_limit.py
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Класичний token bucket: rate токенів за секунду, не більше capacity.
+    reserve() одразу списує токен і повертає, скільки секунд треба
+    зачекати до моменту, коли цей токен "стане доступним".
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated = now
+
+    def delay(self, now=None):
+        """Скільки секунд до появи токена (без списання)."""
+        now = now if now is not None else time.monotonic()
+        self._refill(now)
+        if self._tokens >= 1:
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    def reserve(self, now=None):
+        now = now if now is not None else time.monotonic()
+        self._refill(now)
+        self._tokens -= 1
+        if self._tokens >= 0:
+            return 0.0
+        return -self._tokens / self.rate
+
+    async def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    @property
+    def full(self):
+        self._refill(time.monotonic())
+        return self._tokens >= self.capacity
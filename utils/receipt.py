@@ -0,0 +1,153 @@
+# utils/receipt.py
+# Компактне представлення чеку з відповіді receipts/search: суми в копійках,
+# час - цілі мікросекунди від epoch (UTC), розібрані один раз при декодуванні сторінки.
+import enum
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+import pytz
+from dateutil import parser
+
+KYIV_TZ = pytz.timezone("Europe/Kiev")
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+class ReceiptType(str, enum.Enum):
+    SELL = 'SELL'
+    RETURN = 'RETURN'
+    SERVICE_IN = 'SERVICE_IN'
+    SERVICE_OUT = 'SERVICE_OUT'
+    UNKNOWN = 'UNKNOWN'
+
+    @classmethod
+    def parse(cls, value):
+        try:
+            return cls(str(value or '').upper())
+        except ValueError:
+            return cls.UNKNOWN
+
+
+# type - 'CASH', 'CARD', 'CASHLESS' тощо (верхній регістр), value - копійки
+Payment = namedtuple('Payment', ('type', 'value', 'label', 'type_label'))
+
+
+def parse_timestamp(value):
+    """ISO-рядок у мікросекунди від epoch (UTC); None, якщо значення порожнє чи не розбирається."""
+    if not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        try:
+            dt = parser.isoparse(value)
+        except (TypeError, ValueError, OverflowError):
+            return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return (dt - _EPOCH) // _MICROSECOND
+
+
+def datetime_to_us(dt):
+    if dt is None:
+        return None
+    if isinstance(dt, str):
+        return parse_timestamp(dt)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return (dt - _EPOCH) // _MICROSECOND
+
+
+def us_to_datetime(us):
+    return _EPOCH + timedelta(microseconds=us) if us is not None else None
+
+
+def us_to_iso(us):
+    return us_to_datetime(us).isoformat() if us is not None else None
+
+
+def local_time_str(us, fmt='%d.%m.%Y %H:%M:%S'):
+    """Час за Києвом для повідомлень."""
+    return us_to_datetime(us).astimezone(KYIV_TZ).strftime(fmt)
+
+
+def _int(value):
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+class Receipt:
+    """
+    Чек для синхронізації, підсумків і форматування. Створюється один раз
+    з відповіді API (from_api) або з журналу (той самий формат, див. as_dict).
+    """
+    __slots__ = ('id', 'serial', 'type', 'total', 'service_in', 'service_out',
+                 'created_us', 'modified_us', 'payments')
+
+    def __init__(self, id, serial=None, type=ReceiptType.SELL, total=0, service_in=0, service_out=0,
+                 created_us=None, modified_us=None, payments=()):
+        self.id = id
+        self.serial = serial
+        self.type = type
+        self.total = total
+        self.service_in = service_in
+        self.service_out = service_out
+        self.created_us = created_us
+        self.modified_us = modified_us
+        self.payments = payments
+
+    @classmethod
+    def from_api(cls, d):
+        return cls(
+            d.get('id'),
+            d.get('serial'),
+            ReceiptType.parse(d.get('type')),
+            _int(d.get('total_sum')),
+            _int(d.get('service_in')),
+            _int(d.get('service_out')),
+            parse_timestamp(d.get('created_at')),
+            parse_timestamp(d.get('modified_at')),
+            tuple(
+                Payment(str(p.get('type', '')).upper(), _int(p.get('value')), p.get('label'), p.get('type_label'))
+                for p in d.get('payments') or ()
+            )
+        )
+
+    @property
+    def best_us(self):
+        """Час для курсора синхронізації: modified_at, а якщо його немає - created_at."""
+        return self.modified_us if self.modified_us is not None else self.created_us
+
+    @property
+    def is_service(self):
+        return self.type in (ReceiptType.SERVICE_IN, ReceiptType.SERVICE_OUT)
+
+    def as_dict(self):
+        """Формат журналу (utils.ledger): поля відповіді API, потрібні для звітів."""
+        rec = {
+            'id': self.id,
+            'type': self.type.value,
+            'total_sum': self.total,
+            'service_in': self.service_in,
+            'service_out': self.service_out,
+            'payments': [
+                {'type': p.type, 'value': p.value, 'label': p.label, 'type_label': p.type_label}
+                for p in self.payments
+            ]
+        }
+        if self.serial is not None:
+            rec['serial'] = self.serial
+        if self.created_us is not None:
+            rec['created_at'] = us_to_iso(self.created_us)
+        if self.modified_us is not None:
+            rec['modified_at'] = us_to_iso(self.modified_us)
+        return rec
+
+    def __repr__(self):
+        return f"Receipt({self.id!r}, {self.type.value}, {self.total})"
+
+
+def decode_receipts(results):
+    return [Receipt.from_api(r) for r in results or ()]
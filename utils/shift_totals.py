@@ -0,0 +1,97 @@
+# utils/shift_totals.py
+# Поточні підсумки зміни в копійках (цілі числа), що оновлюються з кожним чеком.
+# Чеки - utils.receipt.Receipt.
+from utils.receipt import ReceiptType
+
+SERVICE_TYPES = ("SERVICE_OUT", "SERVICE_IN")
+CARD_TYPES = ('CARD', 'CASHLESS')
+
+
+def empty_totals():
+    return {
+        'count': 0,          # чеки продажу та повернення
+        'sales': 0,          # сума продажів
+        'returns': 0,        # сума повернень
+        'returns_count': 0,
+        'cash': 0,           # готівка, нетто (продажі мінус повернення)
+        'card': 0,           # картки/безготівково, нетто
+        'service_in': 0,     # службове внесення
+        'service_out': 0     # службова видача
+    }
+
+
+def allocate_payments(receipt):
+    """
+    Розподіляє total_sum чеку між готівкою та карткою пропорційно до сум
+    оплат, у цілих копійках (залишок від ділення віддається оплатам із
+    найбільшою дробовою частиною). Повертає (cash, card).
+    """
+    total = receipt.total
+    payments = receipt.payments
+    if len(payments) == 1:
+        # Найчастіший випадок: одна оплата отримує всю суму
+        pay_type = payments[0].type
+        return (total, 0) if pay_type == 'CASH' else (0, total if pay_type in CARD_TYPES else 0)
+    values = [p.value for p in payments]
+    sum_payments = sum(values)
+    cash = card = 0
+    if sum_payments == 0:
+        if payments:
+            pay_type = payments[0].type
+            if pay_type == 'CASH':
+                cash = total
+            elif pay_type in CARD_TYPES:
+                card = total
+        return cash, card
+
+    shares = [total * v // sum_payments for v in values]
+    rest = total - sum(shares)
+    order = sorted(range(len(values)), key=lambda i: (total * values[i]) % sum_payments, reverse=True)
+    for i in order[:rest]:
+        shares[i] += 1
+    for p, share in zip(payments, shares):
+        pay_type = p.type
+        if pay_type == 'CASH':
+            cash += share
+        elif pay_type in CARD_TYPES:
+            card += share
+    return cash, card
+
+
+def apply_receipt(totals, receipt):
+    r_type = receipt.type
+    total = receipt.total
+    if r_type is ReceiptType.SERVICE_IN:
+        totals['service_in'] += total or receipt.service_in
+        return totals
+    if r_type is ReceiptType.SERVICE_OUT:
+        totals['service_out'] += total or receipt.service_out
+        return totals
+
+    cash, card = allocate_payments(receipt)
+    totals['count'] += 1
+    if r_type is ReceiptType.RETURN:
+        totals['returns'] += total
+        totals['returns_count'] += 1
+        totals['cash'] -= cash
+        totals['card'] -= card
+    else:
+        totals['sales'] += total
+        totals['cash'] += cash
+        totals['card'] += card
+    return totals
+
+
+def totals_from_receipts(receipts):
+    totals = empty_totals()
+    for r in receipts:
+        apply_receipt(totals, r)
+    return totals
+
+
+def kasa_totals(kasa, shift_id):
+    """Підсумки поточної зміни каси; скидаються при зміні shift_id."""
+    if kasa.get('shift_totals_id') != shift_id or not kasa.get('shift_totals'):
+        kasa['shift_totals'] = empty_totals()
+        kasa['shift_totals_id'] = shift_id
+    return kasa['shift_totals']
@@ -1,9 +1,14 @@
 import os
-from dateutil.parser import parser
+from dateutil import parser
 import json
 import re
+import sqlite3
+import logging
+import threading
 from datetime import datetime
-from config.settings import TOKEN_FILE, KASAS_FILE, TELEGRAM_TOKEN_REGEX
+from config.settings import TOKEN_FILE, KASAS_FILE, KASAS_DB_FILE, STORAGE_BACKEND, TELEGRAM_TOKEN_REGEX
+
+logger = logging.getLogger(__name__)
 
 def check_or_create_token_file():
     if not os.path.exists(TOKEN_FILE):
@@ -11,7 +16,7 @@ def check_or_create_token_file():
         with open(TOKEN_FILE, 'w') as f:
             json.dump({"TELEGRAM_TOKEN": ""}, f)
         raise FileNotFoundError(f"Створено {TOKEN_FILE}. Заповніть токен!")
-    
+
     with open(TOKEN_FILE) as f:
         data = json.load(f)
         if not re.match(TELEGRAM_TOKEN_REGEX, data.get("TELEGRAM_TOKEN", "")):
@@ -21,45 +26,223 @@ def load_token():
     with open(TOKEN_FILE) as f:
         return json.load(f)["TELEGRAM_TOKEN"]
 
-def load_kasas_data():
-    if not os.path.exists(KASAS_FILE):
-        return {}
+def _restore_kasa(kasa):
+    # Ініціалізація обов'язкових полів
+    kasa.setdefault('shift_id', None)
+    kasa.setdefault('last_polled_shift_status', None)
+    kasa.setdefault('last_receipt_datetime', None)
+    kasa.setdefault('shift_closed', True)
+    kasa.setdefault('task_started', False)
 
-    with open(KASAS_FILE) as f:
-        data = json.load(f)
-        for user_id, kasas in data.items():
-            for kasa in kasas:
-                # Ініціалізація обов'язкових полів
-                kasa.setdefault('shift_id', None)
-                kasa.setdefault('last_polled_shift_status', None)
-                kasa.setdefault('last_receipt_datetime', None)
-                kasa.setdefault('shift_closed', True)
-                kasa.setdefault('task_started', False)
-                
-                # Конвертація строкового часу в об'єкт datetime
-                if isinstance(kasa.get('last_receipt_datetime'), str):
-                    try:
-                        kasa['last_receipt_datetime'] = parser.isoparse(kasa['last_receipt_datetime'])
-                    except:
-                        kasa['last_receipt_datetime'] = None
+    # Конвертація строкового часу в об'єкт datetime
+    if isinstance(kasa.get('last_receipt_datetime'), str):
+        try:
+            kasa['last_receipt_datetime'] = parser.isoparse(kasa['last_receipt_datetime'])
+        except:
+            kasa['last_receipt_datetime'] = None
+    return kasa
+
+def _sanitize_kasa(k):
+    """Поля каси, що зберігаються між запусками."""
+    return {
+        'license_key': k['license_key'],
+        'pin_code': k['pin_code'],
+        'kasa_name': k['kasa_name'],
+        'shift_id': k.get('shift_id'),
+        'last_receipt_datetime': (
+            k['last_receipt_datetime'].isoformat()
+            if isinstance(k.get('last_receipt_datetime'), datetime)
+            else None
+        ),
+        'last_receipt_id': k.get('last_receipt_id'),
+        'shift_totals': k.get('shift_totals'),
+        'shift_totals_id': k.get('shift_totals_id')
+    }
+
+def _load_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+class SqliteKasaStore:
+    """
+    Сховище стану кас у SQLite (режим WAL): один рядок на касу.
+
+    save() порівнює рядки з останніми записаними і оновлює лише змінені
+    каси однією транзакцією, тож вартість збереження не залежить від
+    загальної кількості кас. Поля, яких немає серед колонок, зберігаються
+    як JSON у колонці extra.
+    """
+
+    COLUMNS = ('pin_code', 'kasa_name', 'shift_id', 'last_receipt_datetime', 'last_receipt_id')
+
+    def __init__(self, path=KASAS_DB_FILE):
+        self.path = path
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS kasas (
+                user_id TEXT NOT NULL,
+                license_key TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                pin_code TEXT NOT NULL,
+                kasa_name TEXT,
+                shift_id TEXT,
+                last_receipt_datetime TEXT,
+                last_receipt_id TEXT,
+                extra TEXT,
+                PRIMARY KEY (user_id, license_key)
+            )
+            """
+        )
+        self._conn.commit()
+        self._written = {}  # (user_id, license_key) -> кортеж значень рядка
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def is_empty(self):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM kasas LIMIT 1").fetchone() is None
+
+    def _row(self, position, sanitized):
+        extra = {
+            k: v for k, v in sanitized.items()
+            if k != 'license_key' and k not in self.COLUMNS and v is not None
+        }
+        return (
+            position,
+            *(sanitized[c] for c in self.COLUMNS),
+            json.dumps(extra, sort_keys=True, ensure_ascii=False) if extra else None
+        )
+
+    def load(self):
+        data = {}
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT user_id, license_key, position, pin_code, kasa_name, shift_id, "
+                "last_receipt_datetime, last_receipt_id, extra FROM kasas ORDER BY user_id, position"
+            ).fetchall()
+        self._written = {}
+        for user_id, license_key, position, *values, extra in rows:
+            kasa = {'license_key': license_key}
+            kasa.update(zip(self.COLUMNS, values))
+            if extra:
+                kasa.update(json.loads(extra))
+            data.setdefault(user_id, []).append(kasa)
+            self._written[(user_id, license_key)] = (position, *values, extra)
         return data
 
-def save_kasas_data(data):
-    sanitized = {}
+    def save(self, data):
+        return self.save_snapshot(snapshot_kasas_data(data))
+
+    def save_snapshot(self, snapshot):
+        """Зберігає вже серіалізований знімок (див. snapshot_kasas_data)."""
+        upserts = []
+        current = {}
+        for user_id, kasas in snapshot.items():
+            for position, sanitized in enumerate(kasas):
+                key = (str(user_id), sanitized['license_key'])
+                row = self._row(position, sanitized)
+                current[key] = row
+                if self._written.get(key) != row:
+                    upserts.append((*key, *row))
+        deletes = [key for key in self._written if key not in current]
+        if not upserts and not deletes:
+            return 0
+        with self._lock, self._conn:
+            if upserts:
+                self._conn.executemany(
+                    "INSERT INTO kasas (user_id, license_key, position, pin_code, kasa_name, shift_id, "
+                    "last_receipt_datetime, last_receipt_id, extra) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(user_id, license_key) DO UPDATE SET "
+                    "position=excluded.position, pin_code=excluded.pin_code, kasa_name=excluded.kasa_name, "
+                    "shift_id=excluded.shift_id, last_receipt_datetime=excluded.last_receipt_datetime, "
+                    "last_receipt_id=excluded.last_receipt_id, extra=excluded.extra",
+                    upserts
+                )
+            if deletes:
+                self._conn.executemany("DELETE FROM kasas WHERE user_id = ? AND license_key = ?", deletes)
+        self._written = current
+        return len(upserts) + len(deletes)
+
+    def migrate_from_json(self, json_path=KASAS_FILE):
+        """
+        Одноразовий перенос даних з kasas.json у порожню базу.
+        Після переносу файл перейменовується на *.migrated.
+        """
+        if not os.path.exists(json_path) or not self.is_empty():
+            return False
+        data = _load_json(json_path)
+        for kasas in data.values():
+            for kasa in kasas:
+                _restore_kasa(kasa)
+        self.save(data)
+        os.replace(json_path, json_path + '.migrated')
+        logger.info(f"[SqliteKasaStore] Migrated {sum(len(k) for k in data.values())} kasas from {json_path}")
+        return True
+
+
+_store = None
+
+def open_storage(migrate=True):
+    """
+    Відкриває сховище стану кас. Явний крок запуску бота (main.py): імпорт
+    модулів не створює базу і не переносить kasas.json. migrate=False - без
+    одноразового переносу (допоміжні інструменти, що лише читають стан).
+    """
+    global _store
+    if STORAGE_BACKEND == 'sqlite' and _store is None:
+        _store = SqliteKasaStore()
+        if migrate:
+            _store.migrate_from_json()
+    return _store
+
+def get_store():
+    if _store is None:
+        raise RuntimeError("Kasa storage is not open, call open_storage() first")
+    return _store
+
+def load_kasas_data():
+    if STORAGE_BACKEND == 'sqlite':
+        data = get_store().load()
+    else:
+        if not os.path.exists(KASAS_FILE):
+            return {}
+        data = _load_json(KASAS_FILE)
+
     for user_id, kasas in data.items():
-        sanitized[user_id] = [{
-            'license_key': k['license_key'],
-            'pin_code': k['pin_code'],
-            'kasa_name': k['kasa_name'],
-            'shift_id': k.get('shift_id'),
-            'last_receipt_datetime': (
-                k['last_receipt_datetime'].isoformat()
-                if isinstance(k.get('last_receipt_datetime'), datetime)
-                else None
-            ),
-            'last_receipt_id': k.get('last_receipt_id')
-        } for k in kasas]
-    
+        for kasa in kasas:
+            _restore_kasa(kasa)
+    return data
+
+def snapshot_kasas_data(data):
+    """
+    Незалежна копія стану для збереження. Знімається в event loop,
+    після чого може записуватись в іншому потоці.
+    """
+    return {user_id: [_sanitize_kasa(k) for k in kasas] for user_id, kasas in data.items()}
+
+def write_kasas_snapshot(snapshot):
+    if STORAGE_BACKEND == 'sqlite':
+        get_store().save_snapshot(snapshot)
+        return
+
+    # Запис у тимчасовий файл і атомарна заміна: при збої старий файл лишається цілим
     os.makedirs(os.path.dirname(KASAS_FILE), exist_ok=True)
-    with open(KASAS_FILE, 'w') as f:
-        json.dump(sanitized, f, indent=2)
\ No newline at end of file
+    tmp_path = KASAS_FILE + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(snapshot, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, KASAS_FILE)
+
+def save_kasas_data(data):
+    write_kasas_snapshot(snapshot_kasas_data(data))